@@ -0,0 +1,404 @@
+# This file contains a context-adaptive binary arithmetic coder, an alternative to the Exp-Golomb coding in entropy_coding.
+#
+# The range coder works with integers only (32 bit range, 11 bit probabilities that adapt with a shift of 5 after every bin) and
+# the probabilities of all contexts are kept in one compact uint16 array. Syntax elements are binarized into bins:
+#   mode:          in P-frames first mode == MODE_INTER, then for intra blocks mode != 0, and if so mode == 2 (one context per bin and channel type)
+#   motion vector: for both components of the prediction error (see motion.vector_differences) value != 0 (one context per component),
+#                  abs - 1 as Exp-Golomb bypass bins and the sign as bypass bin
+#   coefficients:  coded block flag of every block, then the significance map of every coded block (significant flag and last flag per
+#                  scan position, contexts by position), then for every non-zero coefficient the greater-one flag (context by the number of
+#                  previous coefficients greater one in the block), abs - 2 as Exp-Golomb bypass bins and the sign as bypass bin
+# The encoder binarizes whole frames vectorized and only the range coder itself runs bin by bin. The decoder parses bin by bin.
+import numpy as np
+from array import array
+from functools import lru_cache
+from entropy_coding import zigzag_order, ue_lengths
+from prediction import MODE_INTER
+
+
+PROBABILITY_BITS = 11
+PROBABILITY_ONE = 1 << PROBABILITY_BITS
+ADAPTATION_SHIFT = 5
+TOP = 1 << 24
+
+BYPASS = -1
+NUM_POSITION_BUCKETS = 16
+NUM_GREATER_ONE_CONTEXTS = 5
+
+# Offsets of the context sets in the probability array, every set exists once for luma and once for chroma
+MODE_CONTEXTS = 0
+INTER_CONTEXTS = MODE_CONTEXTS + 2 * 2
+VECTOR_CONTEXTS = INTER_CONTEXTS + 2
+CODED_BLOCK_CONTEXTS = VECTOR_CONTEXTS + 2
+SIGNIFICANT_CONTEXTS = CODED_BLOCK_CONTEXTS + 2
+LAST_CONTEXTS = SIGNIFICANT_CONTEXTS + 2 * NUM_POSITION_BUCKETS
+GREATER_ONE_CONTEXTS = LAST_CONTEXTS + 2 * NUM_POSITION_BUCKETS
+NUM_CONTEXTS = GREATER_ONE_CONTEXTS + 2 * NUM_GREATER_ONE_CONTEXTS
+
+
+def channel_type(channel):
+    '''
+        Returns 0 for the luma channel and 1 for the chroma channels, the context sets are selected by the channel type
+    '''
+    return 0 if channel == "Y" else 1
+
+
+@lru_cache(maxsize=None)
+def position_buckets(block_size):
+    '''
+        Maps every scan position of a block to one of NUM_POSITION_BUCKETS contexts. The first 8 positions get their own context, the remaining positions share the other 8 contexts evenly
+    '''
+    positions = np.arange(block_size * block_size)
+    rest = block_size * block_size - 8
+    buckets = np.where(positions < 8, positions, 8 + (positions - 8) * 8 // rest)
+
+    buckets.flags.writeable = False
+    return buckets
+
+
+class RangeEncoder:
+    '''
+        Binary range encoder (LZMA style carry propagation). All bins of a frame are passed to encode() at once
+    '''
+
+    def __init__(self):
+        self.probabilities = array("H", [PROBABILITY_ONE // 2]) * NUM_CONTEXTS
+        self.low = 0
+        self.range = 0xFFFFFFFF
+        self.cache = 0
+        self.cache_size = 1
+        self.output = bytearray()
+
+    def encode(self, contexts, bins):
+        '''
+            Encodes a sequence of bins
+
+            Parameters:
+                contexts (list): Context index of every bin, BYPASS for bins with probability 1/2
+                bins (list): Value (0 or 1) of every bin
+        '''
+        probabilities = self.probabilities
+        low = self.low
+        range_ = self.range
+
+        for context, bin_ in zip(contexts, bins):
+            if context < 0:
+                range_ >>= 1
+                if bin_:
+                    low += range_
+            else:
+                probability = probabilities[context]
+                bound = (range_ >> PROBABILITY_BITS) * probability
+                if bin_:
+                    low += bound
+                    range_ -= bound
+                    probabilities[context] = probability - (probability >> ADAPTATION_SHIFT)
+                else:
+                    range_ = bound
+                    probabilities[context] = probability + ((PROBABILITY_ONE - probability) >> ADAPTATION_SHIFT)
+
+            while range_ < TOP:
+                range_ <<= 8
+                self.low = low
+                self.__shift_low__()
+                low = self.low
+
+        self.low = low
+        self.range = range_
+
+    def __shift_low__(self):
+        if self.low < 0xFF000000 or self.low >= 1 << 32:
+            carry = self.low >> 32
+            temp = self.cache
+            while True:
+                self.output.append((temp + carry) & 0xFF)
+                temp = 0xFF
+                self.cache_size -= 1
+                if self.cache_size == 0:
+                    break
+            self.cache = (self.low >> 24) & 0xFF
+        self.cache_size += 1
+        self.low = (self.low & 0x00FFFFFF) << 8
+
+    def finish(self):
+        '''
+            Flushes the encoder and returns the coded bytes
+        '''
+        for _ in range(5):
+            self.__shift_low__()
+        return bytes(self.output)
+
+
+class RangeDecoder:
+    '''
+        Decoder matching RangeEncoder, bins are decoded one at a time because the contexts of the following bins depend on them
+    '''
+
+    def __init__(self, data):
+        self.probabilities = array("H", [PROBABILITY_ONE // 2]) * NUM_CONTEXTS
+        self.data = bytes(data) + bytes(5)  # reading past the end of the data returns zeros
+        self.position = 5
+        self.range = 0xFFFFFFFF
+        self.code = int.from_bytes(self.data[:5], "big")
+
+    def decode(self, context):
+        '''
+            Decodes a single bin with the given context
+        '''
+        probability = self.probabilities[context]
+        bound = (self.range >> PROBABILITY_BITS) * probability
+        if self.code < bound:
+            self.range = bound
+            self.probabilities[context] = probability + ((PROBABILITY_ONE - probability) >> ADAPTATION_SHIFT)
+            bin_ = 0
+        else:
+            self.code -= bound
+            self.range -= bound
+            self.probabilities[context] = probability - (probability >> ADAPTATION_SHIFT)
+            bin_ = 1
+
+        if self.range < TOP:
+            self.__normalize__()
+        return bin_
+
+    def decode_bypass(self):
+        '''
+            Decodes a single bin with probability 1/2
+        '''
+        self.range >>= 1
+        if self.code >= self.range:
+            self.code -= self.range
+            bin_ = 1
+        else:
+            bin_ = 0
+
+        if self.range < TOP:
+            self.__normalize__()
+        return bin_
+
+    def decode_ue_bypass(self):
+        '''
+            Decodes an unsigned Exp-Golomb codeword from bypass bins
+        '''
+        leading_zeros = 0
+        while not self.decode_bypass():
+            leading_zeros += 1
+
+        value = 1
+        for _ in range(leading_zeros):
+            value = (value << 1) | self.decode_bypass()
+        return value - 1
+
+    def __normalize__(self):
+        self.range <<= 8
+        self.code = ((self.code << 8) | self.data[self.position]) & 0xFFFFFFFF
+        self.position += 1
+
+
+class ArithmeticWriter:
+    '''
+        Syntax writer of the arithmetic coding mode, counterpart of entropy_coding.VLCWriter. The bins of all syntax elements are collected and coded at once in getvalue()
+    '''
+
+    def __init__(self):
+        self.contexts = []
+        self.bins = []
+
+    def write_modes(self, modes, channel, inter=False):
+        '''
+            Writes the prediction mode of every block, with inter=True (P-frames) MODE_INTER is allowed as well
+        '''
+        modes = np.asarray(modes).ravel()
+        offset = MODE_CONTEXTS + 2 * channel_type(channel)
+        is_inter = modes == MODE_INTER
+
+        bins = np.stack([is_inter, modes != 0, modes == 2], axis=-1)
+        valid = np.stack([np.full(len(modes), inter), ~is_inter, ~is_inter & (modes != 0)], axis=-1)
+        contexts = np.broadcast_to(np.array([INTER_CONTEXTS + channel_type(channel), offset, offset + 1]), bins.shape)
+
+        self.__append__(contexts[valid], bins[valid])
+
+    def write_vectors(self, differences):
+        '''
+            Writes the prediction errors of the motion vectors, differences has the shape (..., 2)
+        '''
+        values = np.asarray(differences, dtype=np.int64).reshape(-1, 2)
+        components = np.broadcast_to(np.arange(2), values.shape).ravel()
+        values = values.ravel()
+
+        non_zero = values != 0
+        remainder = np.where(non_zero, np.abs(values) - 1, 0)
+        remainder_lengths = np.where(non_zero, ue_lengths(remainder), 0)
+        num_bins = remainder_lengths + 1 + non_zero
+        offsets = np.cumsum(num_bins) - num_bins
+
+        contexts = np.full(int(num_bins.sum()), BYPASS, dtype=np.int64)
+        bins = np.zeros(len(contexts), dtype=np.int64)
+        contexts[offsets] = VECTOR_CONTEXTS + components
+        bins[offsets] = non_zero
+        for j in range(int(remainder_lengths.max()) if len(remainder_lengths) else 0):
+            valid = remainder_lengths > j
+            bins[offsets[valid] + 1 + j] = ((remainder[valid] + 1) >> (remainder_lengths[valid] - 1 - j)) & 1
+        bins[(offsets + num_bins - 1)[non_zero]] = values[non_zero] < 0
+
+        self.__append__(contexts, bins)
+
+    def write_levels(self, levels, channel):
+        '''
+            Writes the quantized coefficients of all blocks of a channel, levels has the shape (..., block_size, block_size)
+        '''
+        ct = channel_type(channel)
+        block_size = levels.shape[-1]
+        block_pixels = block_size * block_size
+        scanned = levels.reshape(-1, block_pixels)[:, zigzag_order(block_size)]
+        significant = scanned != 0
+
+        # coded block flags
+        coded_block = significant.any(axis=1)
+        self.__append__(np.full(len(coded_block), CODED_BLOCK_CONTEXTS + ct), coded_block)
+
+        # significance map of the coded blocks: a significant flag for every position up to the last coefficient (the flag of the
+        # last position of the block is implied) and a last flag after every significant flag
+        coded = significant[coded_block]
+        last = block_pixels - 1 - np.argmax(coded[:, ::-1], axis=1)
+        positions = np.arange(block_pixels)
+        significant_valid = positions[None, :] <= np.minimum(last, block_pixels - 2)[:, None]
+        buckets = position_buckets(block_size)
+
+        bins = np.stack([coded, np.broadcast_to(positions[None, :] == last[:, None], coded.shape)], axis=-1)
+        valid = np.stack([significant_valid, significant_valid & coded], axis=-1)
+        contexts = np.stack([SIGNIFICANT_CONTEXTS + NUM_POSITION_BUCKETS * ct + buckets, LAST_CONTEXTS + NUM_POSITION_BUCKETS * ct + buckets], axis=-1)
+        self.__append__(np.broadcast_to(contexts, bins.shape)[valid], bins[valid])
+
+        # levels of the non-zero coefficients in block and scan order
+        rows = np.nonzero(significant)[0]
+        values = scanned[significant].astype(np.int64)
+        absolute = np.abs(values)
+        greater_one = absolute > 1
+
+        # number of previous coefficients greater one in the same block
+        previous_greater_one = np.cumsum(greater_one) - greater_one
+        block_start = np.ones(len(rows), dtype=bool)
+        block_start[1:] = rows[1:] != rows[:-1]
+        previous_greater_one -= np.maximum.accumulate(np.where(block_start, previous_greater_one, 0))
+
+        remainder = np.where(greater_one, absolute - 2, 0)
+        remainder_lengths = np.where(greater_one, ue_lengths(remainder), 0)
+        num_bins = remainder_lengths + 2
+        offsets = np.cumsum(num_bins) - num_bins
+
+        contexts = np.full(int(num_bins.sum()), BYPASS, dtype=np.int64)
+        bins = np.zeros(len(contexts), dtype=np.int64)
+        contexts[offsets] = GREATER_ONE_CONTEXTS + NUM_GREATER_ONE_CONTEXTS * ct + np.minimum(previous_greater_one, NUM_GREATER_ONE_CONTEXTS - 1)
+        bins[offsets] = greater_one
+        for j in range(int(remainder_lengths.max()) if len(remainder_lengths) else 0):
+            valid = remainder_lengths > j
+            bins[offsets[valid] + 1 + j] = ((remainder[valid] + 1) >> (remainder_lengths[valid] - 1 - j)) & 1
+        bins[offsets + num_bins - 1] = values < 0
+
+        self.__append__(contexts, bins)
+
+    def __append__(self, contexts, bins):
+        self.contexts.append(np.asarray(contexts, dtype=np.int64).ravel())
+        self.bins.append(np.asarray(bins, dtype=np.int64).ravel())
+
+    def getvalue(self):
+        '''
+            Runs the range coder over all collected bins and returns the coded bytes
+        '''
+        encoder = RangeEncoder()
+        if self.contexts:
+            encoder.encode(np.concatenate(self.contexts).tolist(), np.concatenate(self.bins).tolist())
+        return encoder.finish()
+
+
+class ArithmeticReader:
+    '''
+        Syntax reader of the arithmetic coding mode, counterpart of entropy_coding.VLCReader
+    '''
+
+    def __init__(self, data):
+        self.decoder = RangeDecoder(data)
+
+    def read_modes(self, count, channel, inter=False):
+        '''
+            Reads the prediction modes of count blocks
+        '''
+        decode = self.decoder.decode
+        offset = MODE_CONTEXTS + 2 * channel_type(channel)
+        inter_context = INTER_CONTEXTS + channel_type(channel)
+
+        modes = np.zeros(count, dtype=np.uint8)
+        for b in range(count):
+            if inter and decode(inter_context):
+                modes[b] = MODE_INTER
+            elif decode(offset):
+                modes[b] = 2 if decode(offset + 1) else 1
+        return modes
+
+    def read_vectors(self, count):
+        '''
+            Reads the prediction errors of count motion vectors, inverse of ArithmeticWriter.write_vectors
+
+            Returns:
+                differences (numpy array): int16 array with shape (count, 2)
+        '''
+        decode = self.decoder.decode
+        decode_bypass = self.decoder.decode_bypass
+
+        values = np.zeros(2 * count, dtype=np.int16)
+        for k in range(2 * count):
+            if decode(VECTOR_CONTEXTS + k % 2):
+                absolute = self.decoder.decode_ue_bypass() + 1
+                values[k] = -absolute if decode_bypass() else absolute
+        return values.reshape(count, 2)
+
+    def read_levels(self, num_blocks, block_size, channel, dtype=np.int16):
+        '''
+            Reads the quantized coefficients of num_blocks blocks, inverse of ArithmeticWriter.write_levels
+
+            Returns:
+                levels (numpy array): Coefficients with shape (num_blocks, block_size, block_size)
+        '''
+        decode = self.decoder.decode
+        decode_bypass = self.decoder.decode_bypass
+        ct = channel_type(channel)
+        block_pixels = block_size * block_size
+
+        coded_blocks = [b for b in range(num_blocks) if decode(CODED_BLOCK_CONTEXTS + ct)]
+
+        significant_contexts = (SIGNIFICANT_CONTEXTS + NUM_POSITION_BUCKETS * ct + position_buckets(block_size)).tolist()
+        last_contexts = (LAST_CONTEXTS + NUM_POSITION_BUCKETS * ct + position_buckets(block_size)).tolist()
+        rows = []
+        positions = []
+        for b in coded_blocks:
+            for p in range(block_pixels - 1):
+                if decode(significant_contexts[p]):
+                    rows.append(b)
+                    positions.append(p)
+                    if decode(last_contexts[p]):
+                        break
+            else:
+                rows.append(b)
+                positions.append(block_pixels - 1)
+
+        greater_one_context = GREATER_ONE_CONTEXTS + NUM_GREATER_ONE_CONTEXTS * ct
+        values = []
+        previous_greater_one = 0
+        for k in range(len(rows)):
+            if k == 0 or rows[k] != rows[k - 1]:
+                previous_greater_one = 0
+
+            absolute = 1
+            if decode(greater_one_context + min(previous_greater_one, NUM_GREATER_ONE_CONTEXTS - 1)):
+                absolute = self.decoder.decode_ue_bypass() + 2
+                previous_greater_one += 1
+
+            values.append(-absolute if decode_bypass() else absolute)
+
+        scanned = np.zeros((num_blocks, block_pixels), dtype=dtype)
+        scanned[np.asarray(rows, dtype=np.intp), np.asarray(positions, dtype=np.intp)] = values
+
+        levels = np.empty_like(scanned)
+        levels[:, zigzag_order(block_size)] = scanned
+        return levels.reshape(num_blocks, block_size, block_size)
@@ -0,0 +1,188 @@
+# This file contains background I/O threads that overlap the file I/O with the encoding and decoding of the streaming pipeline.
+#
+# ReadAhead reads the next items of an iterator (e.g. the chunks of yuv_io.iter_yuv_frames or bitstream_io.iter_bitstream) in a thread while
+# the current chunk is coded. WriteBehind passes the coded chunks to a writer (e.g. bitstream_io.BitstreamWriter or yuv_io.YUVVideoWriter)
+# in a thread while the next chunk is coded. The threads hand over the items through a queue of at most depth items, so at most depth chunks
+# are held in memory in addition. The file I/O releases the GIL, so threads are sufficient for the overlap. It pays off most on slow
+# (e.g. network mounted) storage. A depth of 0 disables the thread and the items are read/written in the calling thread.
+#
+# Both record how long the coding thread waited for the I/O thread ("stall", the I/O is the bottleneck) and how long the I/O thread waited
+# for the coding thread ("idle", the coding is the bottleneck), see statistics. While the telemetry is enabled, the stalls are also recorded
+# as the stages "read_ahead_stall" and "write_behind_stall" (see telemetry).
+import queue
+import threading
+import time
+from telemetry import telemetry
+
+READ_AHEAD = 2
+WRITE_BEHIND = 2
+__END__ = object()
+
+
+class BackgroundIO:
+    '''
+        Common part of ReadAhead and WriteBehind: the bounded queue, the I/O thread and the waiting times
+    '''
+
+    def __init__(self, depth, name):
+        self.depth = depth
+        self.name = name
+        self.items = 0
+        self.stall = 0.0
+        self.idle = 0.0
+        self.queue = queue.Queue(maxsize=max(depth, 1))
+        self.thread = None
+
+    def start(self, target):
+        if self.depth > 0:
+            self.thread = threading.Thread(target=target, name=self.name, daemon=True)
+            self.thread.start()
+
+    def stalled(self, start):
+        '''
+            Adds the time since start to the waiting time of the coding thread
+        '''
+        elapsed = time.perf_counter() - start
+        self.stall += elapsed
+        if telemetry.enabled:
+            telemetry.record(self.name + "_stall", elapsed)
+
+    def statistics(self):
+        '''
+            Returns:
+                statistics (dict): "name", "depth", "items" (number of passed items), "stall" (seconds the coding thread waited for the I/O thread) and "idle" (seconds the I/O thread waited for the coding thread)
+        '''
+        return {"name": self.name, "depth": self.depth, "items": self.items, "stall": self.stall, "idle": self.idle}
+
+    def __str__(self):
+        return "{} (depth {}, {} chunks): coding waited {:.3f} s for the I/O, the I/O thread waited {:.3f} s for the coding".format(
+            self.name, self.depth, self.items, self.stall, self.idle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReadAhead(BackgroundIO):
+    '''
+        Iterates over items in a background thread and keeps up to depth items ready in a queue. Exceptions of the iterator are raised in the coding thread
+
+        Usage:
+            with ReadAhead(iter_yuv_frames(path, frames_per_chunk=32), depth=2) as chunks:
+                for chunk in chunks:
+                    ...
+    '''
+
+    def __init__(self, items, depth=READ_AHEAD, name="read_ahead"):
+        super().__init__(depth, name)
+        self.iterator = iter(items)
+        self.stopped = threading.Event()
+        self.start(self.__read__)
+
+    def __read__(self):
+        try:
+            for item in self.iterator:
+                if not self.__put__((item, None)):
+                    return
+            self.__put__((__END__, None))
+        except BaseException as error:
+            self.__put__((__END__, error))
+
+    def __put__(self, message):
+        # waits for a free place in the queue, gives up if the coding thread stopped reading (see close)
+        start = time.perf_counter()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(message, timeout=0.1)
+                self.idle += time.perf_counter() - start
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        if self.thread is None:
+            for item in self.iterator:
+                self.items += 1
+                yield item
+            return
+
+        while True:
+            start = time.perf_counter()
+            item, error = self.queue.get()
+            self.stalled(start)
+            if item is __END__:
+                if error is not None:
+                    raise error
+                return
+            self.items += 1
+            yield item
+
+    def close(self):
+        '''
+            Stops the thread, e.g. if the items are not read to the end
+        '''
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class WriteBehind(BackgroundIO):
+    '''
+        Passes the written items to writer.write in a background thread. write only blocks if depth items are waiting in the queue. close waits until all items
+        are written and closes the writer. An exception of the writer is raised in the coding thread by the next call of write or close
+
+        Usage:
+            with WriteBehind(BitstreamWriter(path), depth=2) as writer:
+                for chunk in stream_encoder(...):
+                    writer.write(chunk)
+    '''
+
+    def __init__(self, writer, depth=WRITE_BEHIND, name="write_behind"):
+        super().__init__(depth, name)
+        self.writer = writer
+        self.error = None
+        self.start(self.__write__)
+
+    def __write__(self):
+        while True:
+            start = time.perf_counter()
+            item = self.queue.get()
+            self.idle += time.perf_counter() - start
+            if item is __END__:
+                return
+            if self.error is None:  # after an error the queue is only emptied, so that the coding thread does not block
+                try:
+                    self.writer.write(item)
+                except BaseException as error:
+                    self.error = error
+
+    def write(self, item):
+        if self.error is not None:
+            raise self.error
+
+        self.items += 1
+        if self.thread is None:
+            self.writer.write(item)
+            return
+
+        start = time.perf_counter()
+        self.queue.put(item)
+        self.stalled(start)
+
+    def close(self):
+        '''
+            Waits until all items are written, closes the writer and returns the result of writer.close()
+        '''
+        if self.thread is not None and self.thread.is_alive():
+            start = time.perf_counter()
+            self.queue.put(__END__)
+            self.thread.join()
+            self.stalled(start)
+
+        result = self.writer.close()
+        if self.error is not None:
+            raise self.error
+        return result
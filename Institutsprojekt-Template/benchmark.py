@@ -0,0 +1,485 @@
+# This file contains a reproducible benchmark of the codec on synthetic YUV-videos.
+#
+# The test sequences are generated deterministically from a seed (a smooth texture that pans over the frame, a moving square and a little
+# noise) in 4:2:0, 4:2:2 and 4:4:4, with 8 and 10 bit and in several resolutions, and are written with write_yuv_video. For every sequence the
+# stages read_yuv_video, encoder, decoder (and separately its entropy decoding) and psnr_yuv are timed (frames per second and MB/s of the uncompressed video) and the
+# rate/PSNR curve is measured for several QPs, both entropy modes and both transforms (the float and the integer DCT, see transform). The results
+# are written as JSON, together with the BD-rate and the throughput of the integer against the float transform. Given the results of an earlier run
+# as baseline, regressions in throughput and compression (Bjøntegaard delta rate of the rate/PSNR curves, see bd_rate) are reported. Independent of a
+# baseline, every sequence and a still version of it (its first frame repeated) are encoded with and without the skipped blocks of skip_detection,
+# a loss of luma PSNR of more than SKIP_PSNR_TOLERANCE is reported as regression (see check_skip_blocks). With the integer transform its bit-exactness is
+# checked on a fixed random residual tensor, a deviation from the integer arithmetic or between encoder and decoder is a regression (see check_integer_transform).
+# The command line entry point is cli.py bench.
+import json
+import os
+import platform
+import time
+import numpy as np
+from yuv_io import read_yuv_video, write_yuv_video, __get_subsampling_factors__
+from encoder import encoder, transform_coding, FRAME_RATE
+from decoder import decoder, decode_residuals, read_frame, block_grid
+from transform import integer_dct_blocks, integer_idct_blocks, integer_dct_matrix, __integer_shifts__, INT16_LIMIT
+from quantization import dequantize_integer
+from bitstream_io import FRAME_INTRA
+from tiles import tile_layout
+from psnr import psnr_yuv
+
+
+RESOLUTIONS = [(176, 144), (352, 288)]  # (width, height)
+SUBSAMPLING_SCHEMES = ["420", "422", "444"]
+BIT_DEPTHS = [8, 10]
+QPS = [22, 27, 32, 37]
+ENTROPY_MODES = ["vlc", "arithmetic"]
+TRANSFORMS = ["float", "integer"]
+NUM_FRAMES = 8
+TEXTURE_SMOOTHING = 6  # radius of the box filter that smooths the noise of the texture
+PAN = (1, 2)  # motion (dy, dx) of the texture per frame in luma pixels
+THROUGHPUT_TOLERANCE = 0.1  # a stage is reported as regression if its frames per second drop by more than this fraction
+BD_RATE_TOLERANCE = 1.0  # a rate/PSNR curve is reported as regression if its BD-rate increases the rate by more than this percentage
+MIN_COMPARED_TIME = 0.05  # stages that took less seconds are too noisy for the throughput comparison
+SKIP_PSNR_TOLERANCE = 0.1  # the skipped blocks may cost at most this luma PSNR in dB against the encoding without them
+INTEGER_BLOCK_SIZES = [4, 8, 16, 32]
+INTEGER_QPS = [0, 12, 22, 32, 42, 51]  # the low QPs give large coefficients, whose stages exceed the float32 bound of transform.__integer_stage__
+
+
+def synthetic_video(width, height, num_frames=NUM_FRAMES, bit_depth=8, subsampling_scheme="420", seed=0):
+    '''
+        Generates a deterministic synthetic YUV-video: a smooth random texture that pans by PAN pixels per frame, a square that moves in the opposite direction and a little noise
+
+        Parameters:
+            width, height (int): Size of the luma channel
+            num_frames (int): Number of frames
+            bit_depth (int): 8 or 10
+            subsampling_scheme (String): 444, 422 or 420
+            seed (int): Seed of the random generator, the same seed gives the same video
+
+        Returns:
+            video (dict): YUV-video with the keys "Y", "U" and "V" and shapes (frames, height, width), uint8 for 8 bit and uint16 for 10 bit
+    '''
+    rng = np.random.default_rng(seed)
+    peak = (1 << bit_depth) - 1
+    dtype = np.uint8 if bit_depth == 8 else np.uint16
+    h_sub, v_sub = __get_subsampling_factors__(subsampling_scheme)
+
+    margin_h = abs(PAN[0]) * num_frames
+    margin_w = abs(PAN[1]) * num_frames
+    textures = [__texture__(rng, height + margin_h, width + margin_w) for _ in range(3)]
+
+    size = max(min(height, width) // 4, 1)
+    video = {c: np.empty((num_frames, height, width), dtype=np.float64) for c in ["Y", "U", "V"]}
+    for f in range(num_frames):
+        top = margin_h // 2 + PAN[0] * (f - num_frames // 2)
+        left = margin_w // 2 + PAN[1] * (f - num_frames // 2)
+        for c, texture in zip(["Y", "U", "V"], textures):
+            video[c][f] = texture[top:top + height, left:left + width]
+
+        # the square moves against the texture
+        square_top = (height // 3 - 2 * PAN[0] * f) % max(height - size, 1)
+        square_left = (width // 3 - 2 * PAN[1] * f) % max(width - size, 1)
+        video["Y"][f, square_top:square_top + size, square_left:square_left + size] = 0.9
+        video["U"][f, square_top:square_top + size, square_left:square_left + size] = 0.3
+
+    for c in video:
+        video[c] += rng.normal(0, 0.01, video[c].shape)
+
+    # chroma subsampling by averaging the covered pixels
+    for c in ["U", "V"]:
+        frames = video[c][:, :height - height % v_sub, :width - width % h_sub]
+        video[c] = frames.reshape(num_frames, frames.shape[1] // v_sub, v_sub, frames.shape[2] // h_sub, h_sub).mean(axis=(2, 4))
+
+    return {c: np.clip(np.round(video[c] * peak), 0, peak).astype(dtype) for c in video}
+
+
+def __texture__(rng, height, width):
+    '''
+        Smooth random texture with values between 0.1 and 0.8: box filtered white noise plus a diagonal gradient
+    '''
+    radius = TEXTURE_SMOOTHING
+    noise = rng.standard_normal((height + 2 * radius + 1, width + 2 * radius + 1))
+    integral = noise.cumsum(axis=0).cumsum(axis=1)
+    window = 2 * radius + 1
+    smooth = integral[window:, window:] - integral[:-window, window:] - integral[window:, :-window] + integral[:-window, :-window]
+    smooth = smooth[:height, :width]
+    smooth = (smooth - smooth.min()) / (np.ptp(smooth) + 1e-9)
+
+    gradient = np.add.outer(np.arange(height) / max(height, 1), np.arange(width) / max(width, 1)) / 2
+    return 0.1 + 0.5 * smooth + 0.2 * gradient
+
+
+def generate_sequences(directory, resolutions=RESOLUTIONS, subsampling_schemes=SUBSAMPLING_SCHEMES, bit_depths=BIT_DEPTHS, num_frames=NUM_FRAMES, seed=0):
+    '''
+        Writes the synthetic test sequences of all combinations of resolution, subsampling scheme and bit depth with write_yuv_video
+
+        Returns:
+            paths (list): Paths of the written YUV-files, e.g. directory/synthetic_176x144_8bit_420.yuv
+    '''
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for width, height in resolutions:
+        for subsampling_scheme in subsampling_schemes:
+            for bit_depth in bit_depths:
+                video = synthetic_video(width, height, num_frames, bit_depth, subsampling_scheme, seed)
+                paths.append(write_yuv_video(video, os.path.join(directory, "synthetic.yuv")))
+    return paths
+
+
+def __timed__(function, *args, repeats=1, **kwargs):
+    '''
+        Calls function repeats times and returns its last result and the shortest wall time
+    '''
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def __stage__(seconds, num_frames, num_bytes):
+    '''
+        Wall time, frames per second and MB/s of the uncompressed video for one stage
+    '''
+    seconds = max(seconds, 1e-9)
+    return {"time": seconds, "fps": num_frames / seconds, "mb_per_s": num_bytes / 1e6 / seconds}
+
+
+def benchmark_sequence(video_path, qps=QPS, entropy_modes=ENTROPY_MODES, repeats=1, transforms=TRANSFORMS, **parameters):
+    '''
+        Benchmarks one YUV-video: times read_yuv_video once and the encoder, decoder, the entropy decoding alone (see read_syntax) and psnr_yuv for every QP, entropy mode and transform
+
+        Parameters:
+            video_path (String): Path to the YUV-video, the format is inferred from the file name
+            qps (list): QPs of the rate/PSNR curves
+            entropy_modes (list): Entropy modes of the encoder
+            repeats (int): Every stage is run repeats times and the shortest time is kept
+            transforms (list): Transforms of the encoder, "float" and/or "integer"
+            parameters: Further keyword arguments of the encoder, e.g. gop_size or workers
+
+        Returns:
+            result (dict): Dict with the keys "frames", "bytes", "stages" (timing of read_yuv_video) and "curves" (for every entropy mode and transform a list with one point per QP,
+                           the keys are the entropy modes for the float transform and e.g. "vlc/integer" for the integer transform, see curve_name.
+                           Every point has the keys "qp", "bits", "kbps", the PSNR "Y", "U", "V", "YUV", the share of skipped blocks "skipped" (see skip_detection) and the timing of the encoder, decoder, entropy_decoding and psnr_yuv in "stages")
+    '''
+    video, read_time = __timed__(read_yuv_video, video_path, repeats=repeats)
+    num_frames = len(video["Y"])
+    num_bytes = os.path.getsize(video_path)
+
+    curves = {}
+    for entropy_mode in entropy_modes:
+        for transform in transforms:
+            name = curve_name(entropy_mode, transform)
+            curves[name] = []
+            for qp in qps:
+                bitstream, encode_time = __timed__(encoder, video, repeats=repeats, qp=qp, entropy_mode=entropy_mode, transform=transform, **parameters)
+                decoded, decode_time = __timed__(decoder, bitstream, repeats=repeats)
+                _, syntax_time = __timed__(read_syntax, bitstream, repeats=repeats)
+                psnr, psnr_time = __timed__(psnr_yuv, video, decoded, repeats=repeats)
+
+                bits = 8 * sum(len(frame) for frame in bitstream["frames"])
+                skipped_blocks = bitstream["statistics"]["skipped_blocks"]
+                curves[name].append({
+                    "qp": qp,
+                    "bits": bits,
+                    "kbps": bits * FRAME_RATE / num_frames / 1000,
+                    **{c: float(psnr[c]) for c in ["Y", "U", "V", "YUV"]},
+                    "skipped": sum(frame["static"] + frame["flat"] for frame in skipped_blocks) / max(sum(frame["blocks"] for frame in skipped_blocks), 1),
+                    "stages": {
+                        "encoder": __stage__(encode_time, num_frames, num_bytes),
+                        "decoder": __stage__(decode_time, num_frames, num_bytes),
+                        "entropy_decoding": __stage__(syntax_time, num_frames, num_bytes),
+                        "psnr_yuv": __stage__(psnr_time, num_frames, num_bytes),
+                    },
+                })
+
+    return {"frames": num_frames, "bytes": num_bytes, "stages": {"read_yuv_video": __stage__(read_time, num_frames, num_bytes)}, "curves": curves}
+
+
+def read_syntax(bitstream):
+    '''
+        Entropy decoding of all frames of a bitstream without the dequantization, inverse DCT and reconstruction, the part of the decoder that depends on the entropy mode
+
+        Returns:
+            frames (list): The syntax elements of every frame, see decoder.read_frame
+    '''
+    header = bitstream["header"]
+    grid = block_grid(header)
+    tiles = tile_layout(header, {c: grid[c][:2] for c in grid})
+    return [read_frame(frame, header, tiles) for frame in bitstream["frames"]]
+
+
+def curve_name(entropy_mode, transform):
+    '''
+        Key of a rate/PSNR curve in the results: the entropy mode for the float transform (as in results without the integer transform), otherwise "entropy_mode/transform"
+    '''
+    return entropy_mode if transform == "float" else entropy_mode + "/" + transform
+
+
+def bd_rate(anchor, test, metric="Y"):
+    '''
+        Bjøntegaard delta rate: the average rate difference of the test curve to the anchor curve at the same PSNR. log(rate) is fitted as a polynomial
+        of the PSNR (cubic for four or more points) and integrated over the overlapping PSNR range
+
+        Parameters:
+            anchor, test (list): Rate/PSNR points with the keys "kbps" and metric, e.g. a curve of benchmark_sequence
+            metric (String): PSNR key of the points, e.g. "Y" or "YUV"
+
+        Returns:
+            bd_rate (float): Rate difference in percent, negative values mean that the test curve needs less rate for the same quality. nan if the curves do not overlap
+    '''
+    integrals = []
+    low = max(min(point[metric] for point in anchor), min(point[metric] for point in test))
+    high = min(max(point[metric] for point in anchor), max(point[metric] for point in test))
+    if not np.isfinite(low) or not np.isfinite(high) or high <= low:
+        return float("nan")
+
+    for curve in [anchor, test]:
+        psnr = np.array([point[metric] for point in curve])
+        log_rate = np.log10([point["kbps"] for point in curve])
+        polynomial = np.polyint(np.polyfit(psnr, log_rate, min(3, len(curve) - 1)))
+        integrals.append(np.polyval(polynomial, high) - np.polyval(polynomial, low))
+
+    average_difference = (integrals[1] - integrals[0]) / (high - low)
+    return float((10 ** average_difference - 1) * 100)
+
+
+def compare_to_baseline(results, baseline, throughput_tolerance=THROUGHPUT_TOLERANCE, bd_rate_tolerance=BD_RATE_TOLERANCE):
+    '''
+        Compares benchmark results with the results of an earlier run. Sequences and entropy modes that are missing in one of them are skipped,
+        as well as the throughput of stages that took less than MIN_COMPARED_TIME seconds
+
+        Returns:
+            regressions (list): One message per stage whose frames per second dropped by more than throughput_tolerance and per rate/PSNR curve whose BD-rate is worse than bd_rate_tolerance
+            bd_rates (dict): BD-rate (luma) of every curve against the baseline, with the keys "sequence/entropy_mode"
+    '''
+    regressions = []
+    bd_rates = {}
+    for name, sequence in results["sequences"].items():
+        if name not in baseline.get("sequences", {}):
+            continue
+        reference = baseline["sequences"][name]
+
+        checks = [("read_yuv_video", sequence["stages"]["read_yuv_video"], reference["stages"]["read_yuv_video"])]
+        for entropy_mode, curve in sequence["curves"].items():
+            if entropy_mode not in reference["curves"]:
+                continue
+            reference_curve = reference["curves"][entropy_mode]
+
+            key = name + "/" + entropy_mode
+            bd_rates[key] = bd_rate(reference_curve, curve)
+            if bd_rates[key] > bd_rate_tolerance:
+                regressions.append(key + ": BD-rate " + format(bd_rates[key], "+.2f") + "% against the baseline")
+
+            # throughput summed over all QPs of the curve, which is less noisy than single runs
+            for stage in ["encoder", "decoder", "entropy_decoding", "psnr_yuv"]:
+                if stage not in reference_curve[0]["stages"]:
+                    continue  # baselines of earlier versions of the benchmark
+                checks.append((entropy_mode + " " + stage, __total_stage__(curve, stage), __total_stage__(reference_curve, stage)))
+
+        for stage, current, previous in checks:
+            if min(current["time"], previous["time"]) >= MIN_COMPARED_TIME and current["fps"] < (1 - throughput_tolerance) * previous["fps"]:
+                regressions.append(name + " " + stage + ": " + format(current["fps"], ".2f") + " fps, baseline " + format(previous["fps"], ".2f") + " fps")
+
+    return regressions, bd_rates
+
+
+def compare_transforms(float_curve, integer_curve):
+    '''
+        Compares the rate/PSNR curves of the float and the integer transform of the same sequence and entropy mode
+
+        Returns:
+            comparison (dict): "bd_rate" (BD-rate of the integer against the float transform in percent) and "encoder" and "decoder" (frames per second of the integer
+                               transform over all QPs relative to the float transform, values above 1 mean that the integer transform is faster)
+    '''
+    comparison = {"bd_rate": bd_rate(float_curve, integer_curve)}
+    for stage in ["encoder", "decoder"]:
+        comparison[stage] = __total_stage__(integer_curve, stage)["fps"] / __total_stage__(float_curve, stage)["fps"]
+    return comparison
+
+
+def __total_stage__(curve, stage):
+    '''
+        Frames per second of a stage over all points of a curve
+    '''
+    seconds = sum(point["stages"][stage]["time"] for point in curve)
+    frames = sum(point["stages"][stage]["fps"] * point["stages"][stage]["time"] for point in curve)
+    return {"time": seconds, "fps": frames / max(seconds, 1e-9)}
+
+
+def check_skip_blocks(video, qps=QPS, transforms=TRANSFORMS, tolerance=SKIP_PSNR_TOLERANCE, **parameters):
+    '''
+        Encodes a video with and without the skipped blocks of skip_detection (encoder parameter skip_blocks) and compares the luma PSNR of the decoded videos
+
+        Parameters:
+            video (dict): YUV-video
+            qps (list): QPs to check
+            transforms (list): Transforms of the encoder
+            tolerance (float): Largest allowed loss of luma PSNR in dB with the skipped blocks
+            parameters: Further keyword arguments of the encoder
+
+        Returns:
+            gaps (dict): For every transform the list of the PSNR losses (PSNR without minus PSNR with the skipped blocks) per QP
+            regressions (list): One message per transform and QP whose loss exceeds tolerance
+    '''
+    gaps = {}
+    regressions = []
+    for transform in transforms:
+        gaps[transform] = []
+        for qp in qps:
+            psnr = [psnr_yuv(video, decoder(encoder(video, qp=qp, transform=transform, skip_blocks=skip_blocks, **parameters)))["Y"] for skip_blocks in [False, True]]
+            gaps[transform].append(float(psnr[0] - psnr[1]))
+            if gaps[transform][-1] > tolerance:
+                regressions.append(transform + " transform, QP " + str(qp) + ": skipped blocks lose " + format(gaps[transform][-1], ".3f") + " dB luma PSNR")
+    return gaps, regressions
+
+
+def check_integer_transform(seed=0, bit_depths=BIT_DEPTHS, block_sizes=INTEGER_BLOCK_SIZES, qps=INTEGER_QPS, num_blocks=256):
+    '''
+        Checks the bit-exactness of the integer transform on a fixed random residual tensor per bit depth and block size, which also contains the extreme residuals
+        (all samples +-peak and the sign patterns of the DCT basis functions): integer_dct_blocks and integer_idct_blocks (also for random and extreme int16 coefficients)
+        against the integer arithmetic in int64 (see __integer_reference__), which guards the float32 bound of transform.__integer_stage__, and for every QP
+        the reconstructed residual of encoder.transform_coding against the integer arithmetic and against decoder.decode_residuals for the same levels
+
+        Parameters:
+            seed (int): Seed of the random generator
+            bit_depths (list): Bit depths to check
+            block_sizes (list): Block sizes to check, 4, 8, 16 and/or 32
+            qps (list): QPs of the encoder and decoder reconstructions
+            num_blocks (int): Number of random blocks per bit depth and block size
+
+        Returns:
+            regressions (list): One message per check that is not bit-exact
+    '''
+    rng = np.random.default_rng(seed)
+    regressions = []
+    for bit_depth in bit_depths:
+        peak = (1 << bit_depth) - 1
+        header = {"transform": "integer", "bit_depth": bit_depth}
+        for block_size in block_sizes:
+            name = "integer transform, " + str(bit_depth) + " bit, " + str(block_size) + "x" + str(block_size)
+            matrix = integer_dct_matrix(block_size)[::max(block_size // 8, 1)]  # at most 8 x 8 basis functions
+            patterns = np.sign(matrix[:, None, :, None] * matrix[None, :, None, :]).reshape(-1, block_size, block_size)
+            residue = np.concatenate([rng.integers(-peak, peak + 1, (num_blocks, block_size, block_size)), np.full((2, block_size, block_size), peak) * [[[1]], [[-1]]],
+                                      peak * patterns, -peak * patterns]).astype(np.int16)
+            coefficients = np.concatenate([rng.integers(-INT16_LIMIT, INT16_LIMIT, (num_blocks, block_size, block_size)),
+                                           rng.choice([-INT16_LIMIT, INT16_LIMIT - 1], (num_blocks, block_size, block_size))]).astype(np.int16)
+
+            if not np.array_equal(integer_dct_blocks(residue, bit_depth), __integer_reference__(residue, bit_depth, inverse=False)):
+                regressions.append(name + ": integer_dct_blocks differs from the integer arithmetic")
+            if not np.array_equal(integer_idct_blocks(coefficients, bit_depth), __integer_reference__(coefficients, bit_depth, inverse=True)):
+                regressions.append(name + ": integer_idct_blocks differs from the integer arithmetic")
+
+            for channel in ["Y", "U"]:
+                for qp in qps:
+                    _, levels, residual = transform_coding(residue, qp, channel, bit_depth, "integer")
+                    frame = (FRAME_INTRA, {c: levels for c in ["Y", "U", "V"]}, {c: np.zeros(levels.shape[:-2], dtype=np.uint8) for c in ["Y", "U", "V"]}, None, qp)
+                    _, decoded = decode_residuals([frame], header)
+                    if not np.array_equal(residual, __integer_reference__(dequantize_integer(levels[None], qp, channel, bit_depth), bit_depth, inverse=True)[0]):
+                        regressions.append(name + ", " + channel + ", QP " + str(qp) + ": the encoder reconstruction differs from the integer arithmetic")
+                    if not np.array_equal(residual, decoded[channel][0]):
+                        regressions.append(name + ", " + channel + ", QP " + str(qp) + ": encoder and decoder reconstruct differently")
+    return regressions
+
+
+def __integer_reference__(values, bit_depth, inverse):
+    '''
+        The integer transform (inverse=False: T @ X @ T^T, inverse=True: T^T @ Y @ T) of transform.integer_dct_blocks and integer_idct_blocks computed in int64,
+        with a rounding right shift and a clip to 16 bits after each stage
+    '''
+    block_size = values.shape[-1]
+    matrix = integer_dct_matrix(block_size).astype(np.int64)
+    shifts = __integer_shifts__(block_size, bit_depth)
+
+    def stage(result, shift):
+        return np.clip((result + (1 << (shift - 1))) >> shift, -INT16_LIMIT, INT16_LIMIT - 1)
+
+    values = values.astype(np.int64)
+    if inverse:
+        return stage(stage(matrix.T @ values, shifts[2]) @ matrix, shifts[3])
+    return stage(matrix @ stage(values @ matrix.T, shifts[0]), shifts[1])
+
+
+def run_benchmark(directory, output_path="", baseline_path="", resolutions=RESOLUTIONS, subsampling_schemes=SUBSAMPLING_SCHEMES, bit_depths=BIT_DEPTHS,
+                  num_frames=NUM_FRAMES, qps=QPS, entropy_modes=ENTROPY_MODES, repeats=1, seed=0, transforms=TRANSFORMS, **parameters):
+    '''
+        Generates the synthetic sequences in directory, benchmarks them, prints the rate/PSNR curves and writes the results as JSON to output_path.
+        With a baseline_path the results are compared with the baseline and the regressions are printed
+
+        Returns:
+            results (dict): Dict with the keys "environment", "settings", "sequences" (see benchmark_sequence, the keys are the file names of the sequences),
+                            "bd_rate_arithmetic" (BD-rate of the arithmetic against the VLC mode per sequence), "integer_transform" (BD-rate and encoder and decoder
+                            throughput of the integer against the float transform per sequence and entropy mode, see compare_transforms), "skip_blocks" (PSNR losses of the
+                            skipped blocks per sequence and its still version, see check_skip_blocks), "regressions" (including those of check_skip_blocks and,
+                            with the integer transform, check_integer_transform) and with a baseline "bd_rate_baseline"
+    '''
+    results = {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(), "processor": platform.processor()},
+        "settings": {"num_frames": num_frames, "qps": list(qps), "entropy_modes": list(entropy_modes), "transforms": list(transforms), "repeats": repeats, "seed": seed,
+                     "parameters": parameters},
+        "sequences": {},
+        "bd_rate_arithmetic": {},
+        "integer_transform": {},
+        "skip_blocks": {},
+        "regressions": [],
+    }
+
+    if "integer" in transforms:
+        regressions = check_integer_transform(seed)
+        results["regressions"] += regressions
+        print("Integer transform:", "not bit-exact" if regressions else "bit-exact")
+
+    for path in generate_sequences(directory, resolutions, subsampling_schemes, bit_depths, num_frames, seed):
+        name = os.path.basename(path)
+        sequence = benchmark_sequence(path, qps, entropy_modes, repeats, transforms, **parameters)
+        results["sequences"][name] = sequence
+        if "vlc" in sequence["curves"] and "arithmetic" in sequence["curves"]:
+            results["bd_rate_arithmetic"][name] = bd_rate(sequence["curves"]["vlc"], sequence["curves"]["arithmetic"])
+        for entropy_mode in entropy_modes:
+            if "float" in transforms and "integer" in transforms:
+                results["integer_transform"][name + "/" + entropy_mode] = compare_transforms(sequence["curves"][entropy_mode], sequence["curves"][curve_name(entropy_mode, "integer")])
+        print_sequence(name, sequence)
+        for key, comparison in results["integer_transform"].items():
+            if key.startswith(name + "/"):
+                print("integer transform ({}): BD-rate {:+.2f}%, encoder {:.2f}x, decoder {:.2f}x the fps of the float transform".format(
+                    key[len(name) + 1:], comparison["bd_rate"], comparison["encoder"], comparison["decoder"]))
+
+        video = read_yuv_video(path)
+        for suffix, frames in [("", video), ("/still", {c: np.repeat(video[c][:1], len(video[c]), axis=0) for c in video})]:
+            results["skip_blocks"][name + suffix], regressions = check_skip_blocks(frames, qps, transforms, **parameters)
+            results["regressions"] += [name + suffix + " " + regression for regression in regressions]
+            for transform, gaps in results["skip_blocks"][name + suffix].items():
+                print("skipped blocks ({}{} transform): largest luma PSNR loss {:.3f} dB".format(suffix[1:] + ", " if suffix else "", transform, max(gaps)))
+
+    if baseline_path:
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+        regressions, results["bd_rate_baseline"] = compare_to_baseline(results, baseline)
+        results["regressions"] += regressions
+        print("\n---------- Baseline comparison ----------")
+        for key, value in results["bd_rate_baseline"].items():
+            print(key, "BD-rate:", format(value, "+.2f") + "%")
+
+    print("Regressions:" if results["regressions"] else "No regressions")
+    for regression in results["regressions"]:
+        print("  " + regression)
+
+    if output_path:
+        with open(output_path, "w") as file:
+            json.dump(results, file, indent=2)
+
+    return results
+
+
+def print_sequence(name, sequence):
+    '''
+        Prints the rate/PSNR curves and the throughput of the stages of one benchmarked sequence
+    '''
+    print("\n----------", name, "----------")
+    print("read_yuv_video: {:.1f} fps, {:.1f} MB/s".format(sequence["stages"]["read_yuv_video"]["fps"], sequence["stages"]["read_yuv_video"]["mb_per_s"]))
+    print("{:<18} {:>4} {:>10} {:>8} {:>8} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10}".format("mode", "QP", "kbps", "PSNR Y", "PSNR YUV", "skip", "enc fps", "enc MB/s", "dec fps", "dec MB/s",
+                                                                                      "ent fps"))
+    for mode, curve in sequence["curves"].items():
+        for point in curve:
+            print("{:<18} {:>4} {:>10.1f} {:>8.2f} {:>8.2f} {:>6.1f}% {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                mode, point["qp"], point["kbps"], point["Y"], point["YUV"], 100 * point.get("skipped", 0), point["stages"]["encoder"]["fps"], point["stages"]["encoder"]["mb_per_s"],
+                point["stages"]["decoder"]["fps"], point["stages"]["decoder"]["mb_per_s"], point["stages"]["entropy_decoding"]["fps"]))
+
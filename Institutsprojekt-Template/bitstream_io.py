@@ -1,17 +1,370 @@
+# This file contains the container format of the coded video and helpers for writing and reading single bits.
+#
+# Layout of a bitstream file:
+#   header:  magic "IPVC", version, width, height, bit depth, subsampling scheme, block sizes, QP (of the first frame), entropy mode, tile size and transform (see HEADER_FORMAT)
+#   frames:  for every frame a uint32 length prefix followed by the frame type (one byte, FRAME_INTRA or FRAME_INTER),
+#            the QP of the frame (one byte) and the chunks of all tiles of the frame (see tiles). Every tile chunk consists of the tile index and
+#            the length of the tile payload (see TILE_HEADER_FORMAT) followed by the bit-packed payload of the tile
+#   index:   seek index of the I-frames (the random access points): the frame numbers (uint32) followed by the byte offsets of their length prefixes (uint64)
+#   trailer: byte offset of the index, number of I-frames, number of frames and INDEX_MAGIC (see TRAILER_FORMAT)
+# The trailer has a fixed size at the end of the file, so BitstreamReader finds the index without reading the frames.
 import numpy as np
-import pickle as pkl
+import struct
+import mmap
+from telemetry import instrument
 
 
-def read_bitstream(file_path, debug=False):
-    if debug:
-        with open(file_path, "rb") as file:
-            return pkl.load(file)
-    return np.fromfile(file_path, dtype=np.uint8)
+MAGIC = b"IPVC"
+VERSION = 7
+HEADER_FORMAT = "<4sBHHB3sBBBBBBB"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CHUNK_LENGTH_FORMAT = "<I"
+CHUNK_LENGTH_SIZE = struct.calcsize(CHUNK_LENGTH_FORMAT)
+ENTROPY_MODES = ["vlc", "arithmetic"]
+TRANSFORMS = ["float", "integer"]
+FRAME_INTRA = 0
+FRAME_INTER = 1
+INDEX_MAGIC = b"IPVI"
+TRAILER_FORMAT = "<QII4s"
+TRAILER_SIZE = struct.calcsize(TRAILER_FORMAT)
+TILE_HEADER_FORMAT = "<HI"
+TILE_HEADER_SIZE = struct.calcsize(TILE_HEADER_FORMAT)
 
 
-def write_bitstream(file_path, bitstream, debug=False):
-    with open(file_path, "wb") as file:
-        try:
-            file.write(bitstream)
-        except TypeError:
-            pkl.dump(bitstream, file)
+@instrument("bitstream_io")
+def read_bitstream(file_path):
+    '''
+        Reads a bitstream file written by write_bitstream or BitstreamWriter
+
+        Parameters:
+            file_path (String): Path to the bitstream file
+
+        Returns:
+            bitstream (dict): Dict with the keys "header" (dict, see pack_header) and "frames" (list containing the payload of every frame as bytes)
+    '''
+    with open(file_path, "rb") as file:
+        data = file.read()
+
+    header = unpack_header(data[:HEADER_SIZE])
+    index_offset, _, _ = unpack_trailer(data[-TRAILER_SIZE:])
+    frames = []
+
+    position = HEADER_SIZE
+    while position < index_offset:
+        length, = struct.unpack_from(CHUNK_LENGTH_FORMAT, data, position)
+        position += CHUNK_LENGTH_SIZE
+        frames.append(data[position:position + length])
+        position += length
+
+    return {"header": header, "frames": frames}
+
+
+def write_bitstream(file_path, bitstream):
+    '''
+        Writes a bitstream, i.e. the header and the payload of every frame, to a file
+
+        Parameters:
+            file_path (String): Path to the bitstream file
+            bitstream (dict): Dict with the keys "header" and "frames" as returned by the encoder
+    '''
+    with BitstreamWriter(file_path) as writer:
+        writer.write(bitstream)
+
+
+class BitstreamWriter:
+    '''
+        Incremental counterpart to write_bitstream. The header is written with the first chunk, the frames of every chunk passed to write() are appended directly, so the encoder can flush the bitstream frame by frame.
+        The byte offsets of the I-frames are collected on the way and written as seek index by close(). Use iter_bitstream to read the frames back, or BitstreamReader for random access.
+    '''
+
+    def __init__(self, file_path):
+        self.file = open(file_path, "wb")
+        self.header_written = False
+        self.position = 0
+        self.num_frames = 0
+        self.index_frames = []
+        self.index_offsets = []
+
+    @instrument("bitstream_io")
+    def write(self, bitstream):
+        if not self.header_written:
+            self.file.write(pack_header(bitstream["header"]))
+            self.header_written = True
+            self.position = HEADER_SIZE
+
+        for frame in bitstream["frames"]:
+            if frame[0] == FRAME_INTRA:
+                self.index_frames.append(self.num_frames)
+                self.index_offsets.append(self.position)
+
+            self.file.write(struct.pack(CHUNK_LENGTH_FORMAT, len(frame)))
+            self.file.write(frame)
+            self.position += CHUNK_LENGTH_SIZE + len(frame)
+            self.num_frames += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        if self.header_written:
+            self.file.write(np.array(self.index_frames, dtype="<u4").tobytes())
+            self.file.write(np.array(self.index_offsets, dtype="<u8").tobytes())
+            self.file.write(struct.pack(TRAILER_FORMAT, self.position, len(self.index_frames), self.num_frames, INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_bitstream(file_path, frames_per_chunk=1):
+    '''
+        Generator that reads a bitstream file chunk by chunk. Every yielded chunk is a bitstream dict with the header of the file and the next frames_per_chunk frames (the last chunk may contain fewer frames)
+    '''
+    with open(file_path, "rb") as file:
+        header = unpack_header(file.read(HEADER_SIZE))
+        file.seek(-TRAILER_SIZE, 2)
+        index_offset, _, _ = unpack_trailer(file.read(TRAILER_SIZE))
+        file.seek(HEADER_SIZE)
+
+        frames = []
+        while file.tell() < index_offset:
+            length = file.read(CHUNK_LENGTH_SIZE)
+            frames.append(file.read(struct.unpack(CHUNK_LENGTH_FORMAT, length)[0]))
+
+            if len(frames) == frames_per_chunk:
+                yield {"header": header, "frames": frames}
+                frames = []
+
+        if frames:
+            yield {"header": header, "frames": frames}
+
+
+class BitstreamReader:
+    '''
+        Random access to a bitstream file. The file is memory mapped and only the header, the trailer and the seek index are read when it is opened, so the time to
+        access a frame does not depend on the length of the bitstream. Frames can only be decoded starting at an I-frame, see gop_start.
+    '''
+
+    def __init__(self, file_path):
+        self.file = open(file_path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.header = unpack_header(self.data[:HEADER_SIZE])
+        self.index_offset, num_entries, self.num_frames = unpack_trailer(self.data[-TRAILER_SIZE:])
+        self.index_frames = np.frombuffer(self.data, dtype="<u4", count=num_entries, offset=self.index_offset)
+        self.index_offsets = np.frombuffer(self.data, dtype="<u8", count=num_entries, offset=self.index_offset + 4 * num_entries)
+
+    def __len__(self):
+        return self.num_frames
+
+    def gop_start(self, frame):
+        '''
+            Returns the number of the last I-frame at or before the given frame, i.e. the first frame that has to be decoded to reconstruct the given frame
+        '''
+        assert 0 <= frame < self.num_frames, "Frame " + str(frame) + " is not in the bitstream"
+        return int(self.index_frames[np.searchsorted(self.index_frames, frame, side="right") - 1])
+
+    @instrument("bitstream_io")
+    def read_frames(self, start, stop):
+        '''
+            Reads the frames start to stop (exclusive), start has to be an I-frame (see gop_start)
+
+            Returns:
+                bitstream (dict): Dict with the keys "header" and "frames" like read_bitstream
+        '''
+        entry = np.searchsorted(self.index_frames, start)
+        assert entry < len(self.index_frames) and self.index_frames[entry] == start, "Frame " + str(start) + " is not an I-frame"
+
+        frames = []
+        position = int(self.index_offsets[entry])
+        for _ in range(start, stop):
+            length, = struct.unpack_from(CHUNK_LENGTH_FORMAT, self.data, position)
+            position += CHUNK_LENGTH_SIZE
+            frames.append(self.data[position:position + length])
+            position += length
+
+        return {"header": self.header, "frames": frames}
+
+    def close(self):
+        # the index arrays are views on the mapping and have to be released before it can be closed
+        del self.index_frames, self.index_offsets
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def split_tiles(data):
+    '''
+        Splits the tile chunks of a frame (the payload after frame type and QP) into the payloads of the tiles
+
+        Returns:
+            tiles (dict): Payload of every tile, indexed by the tile index
+    '''
+    tiles = {}
+    position = 0
+    while position < len(data):
+        index, length = struct.unpack_from(TILE_HEADER_FORMAT, data, position)
+        position += TILE_HEADER_SIZE
+        tiles[index] = data[position:position + length]
+        position += length
+    return tiles
+
+
+def pack_tile(index, payload):
+    '''
+        Prepends the tile index and the length to the payload of a tile, inverse of split_tiles
+    '''
+    return struct.pack(TILE_HEADER_FORMAT, index, len(payload)) + payload
+
+
+def unpack_trailer(data):
+    '''
+        Unpacks the trailer of a bitstream file
+
+        Returns:
+            trailer (tuple): Byte offset of the seek index, number of I-frames in the index and number of frames
+    '''
+    index_offset, num_entries, num_frames, magic = struct.unpack(TRAILER_FORMAT, data)
+    assert magic == INDEX_MAGIC, "Bitstream has no seek index, it was not closed properly"
+    return index_offset, num_entries, num_frames
+
+
+def pack_header(header):
+    '''
+        Packs the header of a bitstream into bytes
+
+        Parameters:
+            header (dict): Dict with the keys "width", "height", "bit_depth", "subsampling_scheme", "block_size_luma", "block_size_chroma", "qp", "entropy_mode" (one of ENTROPY_MODES),
+                           "tile_height" and "tile_width" (in luma blocks, 0 for one tile per frame) and "transform" (one of TRANSFORMS)
+
+        Returns:
+            header (bytes): Packed header of HEADER_SIZE bytes
+    '''
+    return struct.pack(
+        HEADER_FORMAT, MAGIC, VERSION, header["width"], header["height"], header["bit_depth"],
+        header["subsampling_scheme"].encode("ascii"), header["block_size_luma"], header["block_size_chroma"], header["qp"],
+        ENTROPY_MODES.index(header["entropy_mode"]), header["tile_height"], header["tile_width"], TRANSFORMS.index(header["transform"]),
+    )
+
+
+def unpack_header(data):
+    '''
+        Inverse of pack_header
+    '''
+    magic, version, width, height, bit_depth, subsampling_scheme, block_size_luma, block_size_chroma, qp, entropy_mode, tile_height, tile_width, transform = struct.unpack(HEADER_FORMAT, data)
+    assert magic == MAGIC, "File is not a bitstream of this video coder"
+    assert version == VERSION, "Unsupported bitstream version " + str(version)
+
+    return {
+        "width": width, "height": height, "bit_depth": bit_depth, "subsampling_scheme": subsampling_scheme.decode("ascii"),
+        "block_size_luma": block_size_luma, "block_size_chroma": block_size_chroma, "qp": qp, "entropy_mode": ENTROPY_MODES[entropy_mode],
+        "tile_height": tile_height, "tile_width": tile_width, "transform": TRANSFORMS[transform],
+    }
+
+
+class BitWriter:
+    '''
+        Collects codewords of variable length and packs them into bytes. Codewords are written in batches: write() takes whole arrays of values and lengths, expands them into bits with numpy and the bits are packed with np.packbits once in getvalue().
+    '''
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, values, lengths):
+        '''
+            Appends codewords, most significant bit first
+
+            Parameters:
+                values (int or numpy array): Unsigned values of the codewords
+                lengths (int or numpy array): Number of bits of every codeword (at most 64)
+        '''
+        values = np.atleast_1d(np.asarray(values, dtype=np.uint64))
+        lengths = np.broadcast_to(np.asarray(lengths, dtype=np.int64), values.shape)
+        if values.size == 0:
+            return
+
+        max_length = int(lengths.max())
+        if max_length == 0:
+            return
+
+        # bit j of a codeword (counted from the left, i.e. from the most significant bit) is bit lengths - 1 - j of its value
+        shifts = lengths[:, None] - 1 - np.arange(max_length)[None, :]
+        valid = shifts >= 0
+        bits = (values[:, None] >> np.maximum(shifts, 0).astype(np.uint64)) & np.uint64(1)
+        self.chunks.append(bits[valid].astype(np.uint8))
+
+    def write_bits(self, bits):
+        '''
+            Appends an array of single bits (0 or 1)
+        '''
+        self.chunks.append(np.asarray(bits, dtype=np.uint8))
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def getvalue(self):
+        '''
+            Returns the written bits packed into bytes, the last byte is padded with zeros
+        '''
+        if not self.chunks:
+            return b""
+        return np.packbits(np.concatenate(self.chunks)).tobytes()
+
+
+class BitReader:
+    '''
+        Reads codewords from bytes written by a BitWriter. The data is unpacked into an array of single bits once, codewords of equal length can then be read in batches with read_array().
+    '''
+
+    def __init__(self, data):
+        self.bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+        self.position = 0
+        self.ones = None
+
+    def next_ones(self, count):
+        '''
+            Returns the positions of the next count one bits from the current position on, e.g. the ends of count unary codes. The positions of all one bits
+            are found once with the first call, later calls only search for the current position in them
+
+            Returns:
+                positions (numpy array): Absolute bit positions, fewer than count if the data ends before
+        '''
+        if self.ones is None:
+            self.ones = np.flatnonzero(self.bits)
+        first = np.searchsorted(self.ones, self.position)
+        return self.ones[first:first + count]
+
+    def read(self, length):
+        '''
+            Reads a single unsigned codeword of the given number of bits
+        '''
+        return int(self.read_array(1, length)[0])
+
+    def read_array(self, count, length):
+        '''
+            Reads count unsigned codewords of the same number of bits
+
+            Returns:
+                values (numpy array): uint64 array with count values
+        '''
+        bits = self.bits[self.position:self.position + count * length].reshape(count, length)
+        self.position += count * length
+
+        weights = np.uint64(1) << np.arange(length - 1, -1, -1, dtype=np.uint64)
+        return (bits.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+
+    def read_bits(self, count):
+        '''
+            Reads an array of count single bits
+        '''
+        bits = self.bits[self.position:self.position + count]
+        self.position += count
+        return bits
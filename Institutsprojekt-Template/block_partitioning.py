@@ -0,0 +1,92 @@
+# This file contains helper functions to partition the channels of a video into blocks and to reassemble the channels from blocks.
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from telemetry import instrument
+
+
+def pad_to_block_size(channel, block_size):
+    '''
+        Pads a channel of a video such that its height and width are multiples of the block size. The padding replicates the last row and column of every frame. Channels that already have a suitable size are returned unchanged, i.e. without copying them
+
+        Parameters:
+            channel (numpy array): Channel of a video with shape (frames, height, width)
+            block_size (int): Size of the quadratic blocks
+
+        Returns:
+            channel (numpy array): Channel with shape (frames, padded_height, padded_width)
+    '''
+    frames, height, width = channel.shape
+    pad_h = -height % block_size
+    pad_w = -width % block_size
+
+    if pad_h == 0 and pad_w == 0:
+        return channel
+
+    return np.pad(channel, ((0, 0), (0, pad_h), (0, pad_w)), mode="edge")
+
+
+def block_view(channel, block_size):
+    '''
+        Partitions a channel of a video into quadratic blocks without copying any data. The returned array is a strided view on the channel, so writing to a block of the view writes to the channel and vice versa
+
+        Parameters:
+            channel (numpy array): Channel of a video with shape (frames, height, width). Height and width have to be multiples of the block size (see pad_to_block_size)
+            block_size (int): Size of the quadratic blocks
+
+        Returns:
+            blocks (numpy array): View with shape (frames, num_blocks_h, num_blocks_w, block_size, block_size)
+    '''
+    frames, height, width = channel.shape
+    assert height % block_size == 0 and width % block_size == 0, "Channel has to be padded to a multiple of the block size"
+
+    stride_f, stride_h, stride_w = channel.strides
+    return as_strided(
+        channel,
+        shape=(frames, height // block_size, width // block_size, block_size, block_size),
+        strides=(stride_f, stride_h * block_size, stride_w * block_size, stride_h, stride_w),
+        writeable=channel.flags.writeable,
+    )
+
+
+@instrument("partitioning")
+def partition_video(video, block_size_luma=16, block_size_chroma=8):
+    '''
+        Partitions all channels of a YUV-video into blocks. Channels whose size is not a multiple of the block size are padded by edge replication first
+
+        Parameters:
+            video (dict): YUV-Video given as dict of numpy arrays with the keys "Y", "U" and "V"
+            block_size_luma (int): Size of the blocks of the luma channel
+            block_size_chroma (int): Size of the blocks of the chroma channels
+
+        Returns:
+            blocks (dict): Dict with the keys "Y", "U" and "V" containing the blocks of each channel with shape (frames, num_blocks_h, num_blocks_w, block_size, block_size)
+    '''
+    block_sizes = {"Y": block_size_luma, "U": block_size_chroma, "V": block_size_chroma}
+
+    return {c: block_view(pad_to_block_size(video[c], block_sizes[c]), block_sizes[c]) for c in ["Y", "U", "V"]}
+
+
+@instrument("partitioning")
+def merge_blocks(blocks, height, width, out=None):
+    '''
+        Reassembles a channel of a video from its blocks and removes the padding added by pad_to_block_size
+
+        Parameters:
+            blocks (numpy array): Blocks of a channel with shape (frames, num_blocks_h, num_blocks_w, block_size, block_size)
+            height (int): Height of the channel without padding
+            width (int): Width of the channel without padding
+            out (numpy array): Optional array with shape (frames, height, width) the channel is written to
+
+        Returns:
+            channel (numpy array): Channel with shape (frames, height, width)
+    '''
+    frames, num_blocks_h, num_blocks_w, block_size, _ = blocks.shape
+
+    if out is None:
+        out = np.empty((frames, height, width), dtype=blocks.dtype)
+
+    # Move the block rows and columns next to the pixel rows and columns, this is the inverse of block_view
+    channel = blocks.transpose(0, 1, 3, 2, 4).reshape(frames, num_blocks_h * block_size, num_blocks_w * block_size)
+    out[...] = channel[:, :height, :width]
+
+    return out
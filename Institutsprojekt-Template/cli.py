@@ -0,0 +1,231 @@
+# This file contains the command line entry points of the codec:
+#
+#   python cli.py encode input.yuv output.svc [--qp 28] [--entropy-mode arithmetic] [--workers 4] [--streaming] ...
+#   python cli.py decode input.svc output.yuv [--start 10 --count 20] [--streaming] ...
+#   python cli.py roundtrip input.yuv [--output-directory tmp] ...   (encode, decode and print size, PSNR and throughput, see encode_and_decode_video)
+#   python cli.py bench directory [--output results.json] [--baseline baseline.json]   (see benchmark, exits with 1 on regressions)
+#
+# The format of a YUV-video is inferred from its file name (e.g. video_384x384_8bit_420.yuv) unless it is given with --width, --height,
+# --bit-depth and --subsampling. Every command accepts --telemetry, --trace-memory and --profile (see telemetry).
+# With --streaming the chunks are read and written by background threads while the previous/next chunk is coded (see background_io), the
+# time the coding waited for the I/O is printed afterwards. The modules of a command are only imported when the command runs, e.g. decode does not load the encoder.
+import argparse
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+def main(argv=None):
+    '''
+        Parses the command line arguments (default: sys.argv[1:]) and runs the command
+
+        Returns:
+            exit_code (int): 0 on success, 1 if the benchmark found regressions
+    '''
+    arguments = create_parser().parse_args(argv)
+    return arguments.command(arguments) or 0
+
+
+def create_parser():
+    '''
+        Returns the argparse parser with the subcommands encode, decode, roundtrip and bench
+    '''
+    parser = argparse.ArgumentParser(description="Encoder and decoder for YUV-videos")
+    commands = parser.add_subparsers(required=True, metavar="command")
+
+    encode_parser = commands.add_parser("encode", help="encode a YUV-video into a bitstream file")
+    encode_parser.add_argument("input", help="YUV-video")
+    encode_parser.add_argument("output", help="bitstream file")
+    __add_format_arguments__(encode_parser)
+    __add_coding_arguments__(encode_parser)
+    __add_streaming_arguments__(encode_parser)
+    __add_telemetry_arguments__(encode_parser)
+    encode_parser.set_defaults(command=encode)
+
+    decode_parser = commands.add_parser("decode", help="decode a bitstream file into a YUV-video")
+    decode_parser.add_argument("input", help="bitstream file")
+    decode_parser.add_argument("output", help="YUV-video, written exactly to this path")
+    decode_parser.add_argument("--start", type=int, default=0, help="first decoded frame, decoding starts at the I-frame before it (default: 0)")
+    decode_parser.add_argument("--count", type=int, default=-1, help="number of decoded frames (default: -1, all frames up to the end)")
+    decode_parser.add_argument("--tile-workers", type=int, default=1, help="threads that decode the tiles of a frame concurrently (default: 1)")
+    __add_streaming_arguments__(decode_parser)
+    __add_telemetry_arguments__(decode_parser)
+    decode_parser.set_defaults(command=decode)
+
+    roundtrip_parser = commands.add_parser("roundtrip", help="encode and decode a YUV-video and print size, PSNR and throughput")
+    roundtrip_parser.add_argument("input", help="YUV-video")
+    roundtrip_parser.add_argument("--output-directory", default="tmp", help="directory for VideoStream.svc and the decoded video (default: tmp)")
+    __add_format_arguments__(roundtrip_parser)
+    __add_coding_arguments__(roundtrip_parser)
+    __add_streaming_arguments__(roundtrip_parser)
+    __add_telemetry_arguments__(roundtrip_parser)
+    roundtrip_parser.set_defaults(command=roundtrip)
+
+    bench_parser = commands.add_parser("bench", help="benchmark the codec on synthetic YUV-videos")
+    bench_parser.add_argument("directory", help="directory for the generated sequences")
+    bench_parser.add_argument("--output", default="", help="write the results as JSON to this file, e.g. to use them as baseline later")
+    bench_parser.add_argument("--baseline", default="", help="JSON results of an earlier run to compare with")
+    bench_parser.add_argument("--frames", type=int, default=8, help="frames per sequence (default: 8)")
+    bench_parser.add_argument("--resolutions", nargs="+", default=["176x144", "352x288"], help="resolutions WIDTHxHEIGHT (default: 176x144 352x288)")
+    bench_parser.add_argument("--qps", nargs="+", type=int, default=[22, 27, 32, 37], help="QPs of the rate/PSNR curves (default: 22 27 32 37)")
+    bench_parser.add_argument("--entropy-modes", nargs="+", choices=["vlc", "arithmetic"], default=["vlc", "arithmetic"])
+    bench_parser.add_argument("--transforms", nargs="+", choices=["float", "integer"], default=["float", "integer"], help="transforms to benchmark, if both are given the integer transform is compared with the float transform")
+    bench_parser.add_argument("--repeats", type=int, default=1, help="runs per stage, the shortest time is kept (default: 1)")
+    bench_parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic sequences (default: 0)")
+    bench_parser.set_defaults(command=bench)
+
+    return parser
+
+
+def __add_format_arguments__(parser):
+    group = parser.add_argument_group("video format", "inferred from the file name of the YUV-video if not given")
+    group.add_argument("--width", type=int, default=0)
+    group.add_argument("--height", type=int, default=0)
+    group.add_argument("--bit-depth", type=int, choices=[8, 10], default=0)
+    group.add_argument("--subsampling", choices=["420", "422", "444"], default="")
+    group.add_argument("--frames", type=int, default=-1, help="number of frames to code (default: -1, all frames)")
+
+
+def __add_coding_arguments__(parser):
+    group = parser.add_argument_group("coding parameters", "see encoder.encode_frames")
+    group.add_argument("--qp", type=int, default=28, help="quantization parameter 0 to 51 (default: 28)")
+    group.add_argument("--entropy-mode", choices=["vlc", "arithmetic"], default="vlc")
+    group.add_argument("--gop-size", type=int, default=32, help="frames from one I-frame to the next (default: 32)")
+    group.add_argument("--target-bitrate", type=float, default=0, help="target bitrate in bits per second, enables the rate control (default: 0, constant QP)")
+    group.add_argument("--frame-rate", type=float, default=60, help="frame rate of the rate control (default: 60)")
+    group.add_argument("--tile-size", type=int, nargs=2, default=[0, 0], metavar=("HEIGHT", "WIDTH"), help="tile size in luma blocks (default: 0 0, one tile per frame)")
+    group.add_argument("--tile-workers", type=int, default=1, help="threads that code the tiles of a frame concurrently (default: 1)")
+    group.add_argument("--workers", type=int, default=1, help="encoder processes, each encodes whole GOPs (default: 1, not used with --streaming)")
+    group.add_argument("--transform", choices=["float", "integer"], default="float", help="float32 DCT or integer DCT, which reconstructs bit-exactly on every platform but is somewhat slower (default: float)")
+    group.add_argument("--no-skip-blocks", dest="skip_blocks", action="store_false", help="code static and flat blocks with the full prediction search and transform (see skip_detection)")
+
+
+def __add_streaming_arguments__(parser):
+    parser.add_argument("--streaming", action="store_true", help="process the video chunk by chunk with bounded memory")
+    parser.add_argument("--frames-per-chunk", type=int, default=32, help="frames per chunk with --streaming (default: 32)")
+    parser.add_argument("--read-ahead", type=int, default=2, help="chunks read ahead by a background thread with --streaming (default: 2, 0 reads in the coding thread)")
+    parser.add_argument("--write-behind", type=int, default=2, help="chunks queued for a background writer thread with --streaming (default: 2, 0 writes in the coding thread)")
+
+
+def __add_telemetry_arguments__(parser):
+    group = parser.add_argument_group("telemetry", "see telemetry")
+    group.add_argument("--telemetry", default="", metavar="PATH", help="write the time and bytes of every stage as JSON lines to PATH and print a summary")
+    group.add_argument("--trace-memory", action="store_true", help="record the peak memory of every stage with tracemalloc")
+    group.add_argument("--profile", action="store_true", help="print the cProfile statistics")
+
+
+def __video_format__(arguments):
+    '''
+        Keyword arguments of read_yuv_video and iter_yuv_frames for the video format
+    '''
+    return {"width": arguments.width, "height": arguments.height, "bit_depth": arguments.bit_depth, "subsampling_scheme": arguments.subsampling, "n_frames": arguments.frames}
+
+
+def __coding_parameters__(arguments):
+    '''
+        Keyword arguments of encoder.encode_frames
+    '''
+    return {
+        "qp": arguments.qp,
+        "entropy_mode": arguments.entropy_mode,
+        "gop_size": arguments.gop_size,
+        "target_bitrate": arguments.target_bitrate,
+        "frame_rate": arguments.frame_rate,
+        "tile_size": tuple(arguments.tile_size),
+        "tile_workers": arguments.tile_workers,
+        "skip_blocks": arguments.skip_blocks,
+        "transform": arguments.transform,
+    }
+
+
+@contextmanager
+def __recording__(arguments):
+    '''
+        Records the telemetry of the command if requested and prints/writes it afterwards
+    '''
+    if not (arguments.telemetry or arguments.trace_memory or arguments.profile):
+        yield
+        return
+
+    from telemetry import telemetry
+    telemetry.enable(memory=arguments.trace_memory, profile=arguments.profile)
+    try:
+        yield
+    finally:
+        telemetry.disable()
+    print("\n---------- Stages ----------")
+    print(telemetry.summary())
+    print(telemetry.profile_stats())
+    if arguments.telemetry:
+        telemetry.write_json_lines(arguments.telemetry)
+
+
+def encode(arguments):
+    from yuv_io import read_yuv_video, iter_yuv_frames
+    from encoder import encoder, stream_encoder
+    from bitstream_io import write_bitstream, BitstreamWriter
+    from background_io import ReadAhead, WriteBehind
+
+    parameters = __coding_parameters__(arguments)
+    start = time.perf_counter()
+    with __recording__(arguments):
+        if arguments.streaming:
+            frames = iter_yuv_frames(arguments.input, frames_per_chunk=arguments.frames_per_chunk, **__video_format__(arguments))
+            with ReadAhead(frames, arguments.read_ahead) as reader, WriteBehind(BitstreamWriter(arguments.output), arguments.write_behind) as writer:
+                for chunk in stream_encoder(reader, **parameters):
+                    writer.write(chunk)
+            print(reader, writer, sep="\n")
+        else:
+            video = read_yuv_video(arguments.input, **__video_format__(arguments))
+            write_bitstream(arguments.output, encoder(video, arguments.workers, **parameters))
+    elapsed = time.perf_counter() - start
+
+    print("Size of bitstream:", os.path.getsize(arguments.output), "- time (s):", elapsed)
+
+
+def decode(arguments):
+    from yuv_io import write_yuv_video, YUVVideoWriter
+    from decoder import decoder, stream_decoder
+    from bitstream_io import BitstreamReader, iter_bitstream
+    from background_io import ReadAhead, WriteBehind
+
+    if arguments.streaming and (arguments.start != 0 or arguments.count != -1):
+        raise SystemExit("decode: --start and --count cannot be combined with --streaming")
+
+    start = time.perf_counter()
+    with __recording__(arguments):
+        if arguments.streaming:
+            chunks = iter_bitstream(arguments.input, arguments.frames_per_chunk)
+            with ReadAhead(chunks, arguments.read_ahead) as reader, WriteBehind(YUVVideoWriter(arguments.output, automatic_file_name_extension=False), arguments.write_behind) as writer:
+                for chunk in stream_decoder(reader, arguments.tile_workers):
+                    writer.write(chunk)
+            print(reader, writer, sep="\n")
+        else:
+            with BitstreamReader(arguments.input) as reader:
+                video = decoder(reader, arguments.start, arguments.count, arguments.tile_workers)
+            write_yuv_video(video, arguments.output, automatic_file_name_extension=False)
+    elapsed = time.perf_counter() - start
+
+    print("Size of decoded video:", os.path.getsize(arguments.output), "- time (s):", elapsed)
+
+
+def roundtrip(arguments):
+    from encode_and_decode_video import encode_and_decode_video
+
+    encode_and_decode_video(arguments.input, arguments.streaming, arguments.frames_per_chunk, telemetry_path=arguments.telemetry, trace_memory=arguments.trace_memory,
+                            profile=arguments.profile, output_directory=arguments.output_directory, workers=arguments.workers, video_format=__video_format__(arguments),
+                            read_ahead=arguments.read_ahead, write_behind=arguments.write_behind, **__coding_parameters__(arguments))
+
+
+def bench(arguments):
+    from benchmark import run_benchmark
+
+    resolutions = [tuple(int(size) for size in resolution.lower().split("x")) for resolution in arguments.resolutions]
+    results = run_benchmark(arguments.directory, arguments.output, arguments.baseline, resolutions=resolutions, num_frames=arguments.frames, qps=arguments.qps,
+                            entropy_modes=arguments.entropy_modes, repeats=arguments.repeats, seed=arguments.seed, transforms=arguments.transforms)
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,246 @@
-def decoder(bitstream):
+import numpy as np
+from functools import partial
+from entropy_coding import VLCReader
+from arithmetic_coding import ArithmeticReader
+from yuv_io import __get_chroma_shape__, __get_subsampling_factors__
+from transform import idct_blocks, integer_idct_blocks
+from quantization import dequantize, dequantize_integer
+from prediction import default_pel_value, wavefront_order, neighbour_edges, intra_prediction_for_modes, reconstruct_blocks
+from block_partitioning import merge_blocks
+from motion import motion_compensation, channel_vectors, vectors_from_differences
+from bitstream_io import BitstreamReader, FRAME_INTRA, FRAME_INTER, split_tiles
+from tiles import tile_layout, map_tiles, tile_pool
+from telemetry import telemetry, instrument
+
+
+BATCH_FRAMES = 8  # frames whose syntax elements and residuals are decoded at once, bounds the memory of the decoder independent of the length of the video
+
+
+def decoder(bitstream, start=0, count=-1, tile_workers=1):
+    # Decodes count frames starting at frame start (0 <= start < number of frames, count=-1: all frames up to the end). bitstream is either a dict (e.g. from the encoder or
+    # bitstream_io.read_bitstream) or a bitstream_io.BitstreamReader. Decoding starts at the last I-frame before start, with a BitstreamReader this
+    # I-frame is found in the seek index and only the frames from there to the last requested frame are read from the file
+    # With tile_workers > 1 the tiles of every frame are decoded concurrently by a thread pool (see tiles)
+    print("Decoding video...")
+
+    num_frames = len(bitstream) if isinstance(bitstream, BitstreamReader) else len(bitstream["frames"])
+    assert 0 <= start < num_frames, "Frame " + str(start) + " is not in the bitstream"
+    stop = num_frames if count < 0 else min(start + count, num_frames)
+
+    if isinstance(bitstream, BitstreamReader):
+        gop_start = bitstream.gop_start(start)
+        bitstream = bitstream.read_frames(gop_start, stop)
+    else:
+        gop_start = start
+        while bitstream["frames"][gop_start][0] != FRAME_INTRA:
+            gop_start -= 1
+        bitstream = {"header": bitstream["header"], "frames": bitstream["frames"][gop_start:stop]}
+
+    video = decode_frames(bitstream, tile_workers=tile_workers)
+    return {c: video[c][start - gop_start:] for c in video}
+
+
+def stream_decoder(bitstream_chunks, tile_workers=1):
+    # Decodes a stream of bitstream chunks (e.g. from bitstream_io.iter_bitstream) and yields one decoded chunk of frames per bitstream chunk
+    # The last decoded frame is kept as reference for a P-frame at the start of the next chunk
     print("Decoding video...")
 
-    video = bitstream
-    return video
\ No newline at end of file
+    reference = None
+    for chunk in bitstream_chunks:
+        video = decode_frames(chunk, reference, tile_workers)
+        reference = {c: video[c][-1].copy() for c in video}
+        yield video
+
+
+def decode_frames(bitstream, reference=None, tile_workers=1):
+    # Decodes a single frame or a group of frames: entropy decoding, dequantization, inverse DCT, intra and motion compensated reconstruction
+    # P-frames are predicted from the previous decoded frame, reference is the last decoded frame of the previous group (see stream_decoder)
+    # The tiles of a frame are independent of each other, with tile_workers > 1 they are read and reconstructed concurrently
+    # With the integer transform (header "transform") the dequantization and inverse DCT use integer arithmetic and match the reconstruction of the encoder bit-exactly
+    # The frames are decoded in batches of BATCH_FRAMES frames, only the syntax elements and residuals of the current batch are held in memory
+    header = bitstream["header"]
+    shapes = channel_shapes(header)
+    grid = block_grid(header)
+    tiles = tile_layout(header, {c: grid[c][:2] for c in grid})
+    dtype = np.uint8 if header["bit_depth"] == 8 else np.uint16
+    video = {c: np.empty((len(bitstream["frames"]),) + shapes[c], dtype=dtype) for c in ["Y", "U", "V"]}
+
+    pool = tile_pool(tile_workers)
+    try:
+        for first in range(0, len(bitstream["frames"]), BATCH_FRAMES):
+            frames = []
+            for f, frame in enumerate(bitstream["frames"][first:first + BATCH_FRAMES], first):
+                with telemetry.frame("decode", f):
+                    frames.append(read_frame(frame, header, tiles, pool))
+
+            with telemetry.frame("decode", first, len(frames)):
+                prediction_mode, residual = decode_residuals(frames, header)
+            frames = [(frame_type, vectors) for frame_type, _, _, vectors, _ in frames]  # the levels are no longer needed
+
+            reference = reconstruct_frames(frames, prediction_mode, residual, reference, header, tiles, pool, {c: video[c][first:first + len(frames)] for c in video}, first)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return video
+
+
+def decode_residuals(frames, header):
+    # Dequantization and inverse DCT of all blocks of the given frames (see read_frame) at once, the residual does not depend on the prediction
+    # Returns the prediction modes and the residual (int16) of every channel with a frame axis
+    prediction_mode = {}
+    residual = {}
+    qps = np.array([frame[4] for frame in frames])
+    for c in ["Y", "U", "V"]:
+        levels = np.stack([frame[1][c] for frame in frames])
+        prediction_mode[c] = np.stack([frame[2][c] for frame in frames])
+
+        residual[c] = np.empty(levels.shape, dtype=np.int16)
+        if header["transform"] == "integer":
+            integer_idct_blocks(dequantize_integer(levels, qps, c, header["bit_depth"]), header["bit_depth"], out=residual[c])
+        else:
+            idct_blocks(dequantize(levels, qps, c), out=residual[c])
+
+    return prediction_mode, residual
+
+
+def reconstruct_frames(frames, prediction_mode, residual, reference, header, tiles, pool, video, first_frame=0):
+    # Reconstructs the given frames (list of (frame_type, vectors)) from their prediction modes and residuals (see decode_residuals) into video
+    # consecutive I-frames are independent of each other and reconstructed at once, P-frames one by one from the previous frame (reference for the first one)
+    # Returns the last reconstructed frame, the reference of the next frame
+    shapes = channel_shapes(header)
+    grid = block_grid(header)
+    dtype = video["Y"].dtype
+
+    start = 0
+    while start < len(frames):
+        frame_type, vectors = frames[start]
+        stop = start + 1
+        motion_prediction = {c: None for c in video}
+
+        if frame_type == FRAME_INTRA:
+            while stop < len(frames) and frames[stop][0] == FRAME_INTRA:
+                stop += 1
+
+        with telemetry.frame("decode", first_frame + start, stop - start):
+            if frame_type == FRAME_INTER:
+                assert reference is not None, "P-frame without reference frame"
+                motion_prediction = {c: motion_compensation(reference[c], frame_vectors(vectors, c, header), grid[c][2])[None] for c in video}
+
+            reconstructed = {c: np.empty(residual[c][start:stop].shape, dtype=dtype) for c in video}
+            tile_modes = {c: prediction_mode[c][start:stop] for c in video}
+            tile_residual = {c: residual[c][start:stop] for c in video}
+            for _ in map_tiles(partial(reconstruct_tile, tile_modes, tile_residual, motion_prediction, header["bit_depth"], reconstructed), tiles, pool):
+                pass
+
+            for c in ["Y", "U", "V"]:
+                merge_blocks(reconstructed[c], *shapes[c], out=video[c][start:stop])
+
+        reference = {c: video[c][stop - 1] for c in video}
+        start = stop
+
+    return reference
+
+
+def reconstruct_tile(prediction_mode, residual, motion_prediction, bit_depth, reconstructed, index, tile):
+    # Reconstructs the blocks of one tile of all channels into reconstructed, the tiles write to disjoint blocks and can run concurrently
+    for c in ["Y", "U", "V"]:
+        rows, columns = tile[c]
+        tile_prediction = None if motion_prediction[c] is None else motion_prediction[c][:, rows, columns]
+        reconstructed[c][:, rows, columns] = block_reconstruction(prediction_mode[c][:, rows, columns], residual[c][:, rows, columns], bit_depth, reconstructed[c].dtype, tile_prediction)
+
+
+def block_reconstruction(prediction_mode, residual, bit_depth, dtype, motion_prediction=None):
+    # Reconstructs the blocks of a channel in wavefront order, all blocks of an anti-diagonal only depend on earlier anti-diagonals
+    # and are predicted and reconstructed at once. In P-frames motion_prediction is the prediction of the blocks with MODE_INTER
+    frames, num_blocks_h, num_blocks_w, block_size, _ = residual.shape
+    default = default_pel_value(bit_depth)
+    reconstructed = np.empty(residual.shape, dtype=dtype)
+
+    for rows, columns in wavefront_order(num_blocks_h, num_blocks_w):
+        top, left, top_left = neighbour_edges(reconstructed, rows, columns, default)
+        prediction = intra_prediction_for_modes(prediction_mode[:, rows, columns], top, left, top_left, None if motion_prediction is None else motion_prediction[:, rows, columns])
+        reconstructed[:, rows, columns] = reconstruct_blocks(prediction, residual[:, rows, columns], bit_depth)
+
+    return reconstructed
+
+
+def frame_vectors(vectors, channel, header):
+    # Motion vectors of the blocks of a channel, the chroma blocks use the vectors of the co-located luma blocks
+    if channel == "Y":
+        return vectors
+
+    num_blocks_h, num_blocks_w, block_size = block_grid(header)[channel]
+    return channel_vectors(vectors, num_blocks_h, num_blocks_w, block_size, header["block_size_luma"], __get_subsampling_factors__(header["subsampling_scheme"]))
+
+
+def read_frame(payload, header, tiles=None, pool=None):
+    # Reads the frame type, the QP and all tiles of one frame, inverse of encoder.write_frame. The syntax elements of the tiles are placed into
+    # arrays covering the whole frame, with a pool the tiles are read concurrently
+    frame_type, qp = payload[0], payload[1]
+    grid = block_grid(header)
+    tiles = tiles if tiles is not None else tile_layout(header, {c: grid[c][:2] for c in grid})
+    tile_payloads = split_tiles(payload[2:])
+    inter = frame_type == FRAME_INTER
+
+    vectors = np.empty(grid["Y"][:2] + (2,), dtype=np.int16) if inter else None
+    prediction_mode = {c: np.empty(grid[c][:2], dtype=np.uint8) for c in grid}
+    coefficients = {c: np.empty(grid[c][:2] + (grid[c][2], grid[c][2]), dtype=np.int16) for c in grid}
+
+    for index, (tile_vectors, tile_modes, tile_coefficients) in map_tiles(partial(read_tile, tile_payloads, header, inter), tiles, pool):
+        if inter:
+            vectors[tiles[index]["Y"]] = tile_vectors
+        for c in ["Y", "U", "V"]:
+            rows, columns = tiles[index][c]
+            prediction_mode[c][rows, columns] = tile_modes[c]
+            coefficients[c][rows, columns] = tile_coefficients[c]
+
+    return frame_type, coefficients, prediction_mode, vectors, qp
+
+
+@instrument("entropy_coding")
+def read_tile(tile_payloads, header, inter, index, tile):
+    # Reads the motion vectors (P-frames only), the prediction modes and coefficients of one tile, inverse of encoder.write_tile
+    reader = create_syntax_reader(tile_payloads[index], header["entropy_mode"])
+    block_sizes = {c: size for c, (_, _, size) in block_grid(header).items()}
+    tile_shape = {c: (rows.stop - rows.start, columns.stop - columns.start) for c, (rows, columns) in tile.items()}
+
+    vectors = None
+    if inter:
+        num_blocks_h, num_blocks_w = tile_shape["Y"]
+        vectors = vectors_from_differences(reader.read_vectors(num_blocks_h * num_blocks_w).reshape(num_blocks_h, num_blocks_w, 2))
+
+    prediction_mode = {}
+    for c in ["Y", "U", "V"]:
+        num_blocks_h, num_blocks_w = tile_shape[c]
+        prediction_mode[c] = reader.read_modes(num_blocks_h * num_blocks_w, c, inter).reshape(num_blocks_h, num_blocks_w)
+
+    coefficients = {}
+    for c in ["Y", "U", "V"]:
+        num_blocks_h, num_blocks_w = tile_shape[c]
+        block_size = block_sizes[c]
+        coefficients[c] = reader.read_levels(num_blocks_h * num_blocks_w, block_size, c).reshape(num_blocks_h, num_blocks_w, block_size, block_size)
+
+    return vectors, prediction_mode, coefficients
+
+
+def create_syntax_reader(payload, entropy_mode):
+    # VLCReader and ArithmeticReader share the interface read_vectors, read_modes, read_levels
+    if entropy_mode == "vlc":
+        return VLCReader(payload)
+    if entropy_mode == "arithmetic":
+        return ArithmeticReader(payload)
+    raise ValueError("Unknown entropy mode " + str(entropy_mode))
+
+
+def channel_shapes(header):
+    # Height and width of every channel of the decoded video
+    chroma_height, chroma_width = __get_chroma_shape__(header["width"], header["height"], header["subsampling_scheme"])
+    return {"Y": (header["height"], header["width"]), "U": (chroma_height, chroma_width), "V": (chroma_height, chroma_width)}
+
+
+def block_grid(header):
+    # Number of blocks and block size of every channel, including the blocks covering the padding of the encoder
+    block_sizes = {"Y": header["block_size_luma"], "U": header["block_size_chroma"], "V": header["block_size_chroma"]}
+
+    return {c: (-(-height // block_sizes[c]), -(-width // block_sizes[c]), block_sizes[c]) for c, (height, width) in channel_shapes(header).items()}
\ No newline at end of file
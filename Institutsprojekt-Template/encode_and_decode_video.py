@@ -1,45 +1,173 @@
 # Please write your code for encoding and decoding the video
-from yuv_io import read_yuv_video, write_yuv_video
-from encoder import encoder
-from decoder import decoder
-from bitstream_io import write_bitstream, read_bitstream
-from psnr import psnr_yuv
+from yuv_io import read_yuv_video, write_yuv_video, iter_yuv_frames, YUVVideoWriter
+from encoder import encoder, stream_encoder, GOP_SIZE
+from decoder import decoder, stream_decoder
+from bitstream_io import write_bitstream, read_bitstream, BitstreamWriter, iter_bitstream
+from metrics import VideoMetrics
+from telemetry import telemetry
+from background_io import ReadAhead, WriteBehind, READ_AHEAD, WRITE_BEHIND
 import os
+import sys
+import time
 
 
-data_path = "/home/staff/classen/Teaching/Institutsprojekt-Template/tmp/"
-
-
-def encode_and_decode_video(yuv_video_path):
+def encode_and_decode_video(yuv_video_path, streaming=False, frames_per_chunk=GOP_SIZE, qp=28, entropy_mode="vlc", telemetry_path="", trace_memory=False, profile=False,
+                            output_directory="tmp", workers=1, video_format=None, read_ahead=READ_AHEAD, write_behind=WRITE_BEHIND, **parameters):
     '''
-        Encodes and decodes the video given video. Have a look in the data folder for options of videos to encode. The coded stream and the decoded video is stored in the tmp folder. If you like, you can always ask me for more/larger videos to experiment or any kind of help ;) 
+        Encodes and decodes the video given video. Have a look in the data folder for options of videos to encode. The coded stream (VideoStream.svc) and the decoded video (DecodedVid_*.yuv) are stored in output_directory. If you like, you can always ask me for more/larger videos to experiment or any kind of help ;) 
+        The command line entry point is cli.py roundtrip.
+
+        With streaming=True the video is processed in chunks of frames_per_chunk frames, so the memory usage is bounded by a few frames instead of the length of the video.
+        The GOPs and the reference frame of the P-frames are carried across the chunks (see encoder.stream_encoder), the bitstream is the same for every chunk size.
+        The chunks are then read and written by background threads (see background_io) while the previous/next chunk is coded, read_ahead and write_behind are the depths of their queues in chunks (0 disables the thread).
+        qp is the quantization parameter (0 to 51), lower values give a higher quality and a larger bitstream.
+        entropy_mode selects the entropy coding of the encoder: "vlc" (Exp-Golomb) or "arithmetic" (context-adaptive binary arithmetic coding).
+        With a telemetry_path the time, bytes in/out (and with trace_memory the peak memory) of every stage of the pipeline are written to this file as JSON lines and summarized in a table (see telemetry), profile=True additionally prints the cProfile statistics.
+        workers is the number of encoder processes (see encoder.encoder, not used with streaming=True), video_format optionally gives the format of the video as keyword arguments of read_yuv_video (width, height, bit_depth, subsampling_scheme, n_frames) if it cannot be inferred from the file name.
+        Further keyword arguments are coding parameters of encoder.encode_frames, e.g. gop_size, target_bitrate or tile_size.
     '''
-    coded_video_path = data_path + "VideoStream.svc"
+    if telemetry_path or trace_memory or profile:
+        telemetry.enable(memory=trace_memory, profile=profile)
+        try:
+            encode_and_decode_video(yuv_video_path, streaming, frames_per_chunk, qp, entropy_mode, output_directory=output_directory, workers=workers, video_format=video_format,
+                                    read_ahead=read_ahead, write_behind=write_behind, **parameters)
+        finally:
+            telemetry.disable()
+        print_telemetry(telemetry_path)
+        return
+
+    if streaming:
+        return encode_and_decode_video_streaming(yuv_video_path, frames_per_chunk, qp, entropy_mode, output_directory, video_format, read_ahead, write_behind, **parameters)
+
+    os.makedirs(output_directory, exist_ok=True)
+    coded_video_path = os.path.join(output_directory, "VideoStream.svc")
 
     # Read the uncompressed video
-    originalVideo = read_yuv_video(yuv_video_path)
+    originalVideo = read_yuv_video(yuv_video_path, **(video_format or {}))
 
     # Encode the video
-    bitstream = encoder(originalVideo)
-    write_bitstream(coded_video_path, bitstream, debug=True)
+    start = time.perf_counter()
+    bitstream = encoder(originalVideo, workers, qp=qp, entropy_mode=entropy_mode, **parameters)
+    encodingTime = time.perf_counter() - start
+    bitstream_statistics = bitstream["statistics"]
+    write_bitstream(coded_video_path, bitstream)
     
     # Decode the video
-    bitstream = read_bitstream(coded_video_path, debug=True)
-    decodedVideo = decoder(bitstream)
+    bitstream = read_bitstream(coded_video_path)
+    start = time.perf_counter()
+    decodedVideo = decoder(bitstream, tile_workers=parameters.get("tile_workers", 1))
+    decodingTime = time.perf_counter() - start
 
     # Write the reonstructed video
-    write_yuv_video(decodedVideo, data_path + "DecodedVid.yuv")
+    write_yuv_video(decodedVideo, os.path.join(output_directory, "DecodedVid.yuv"))
     
     # Calculate statistics
     originalVideoSize = os.path.getsize(yuv_video_path)
-    bitstreamSize = os.path.getsize(data_path + "VideoStream.svc")
+    bitstreamSize = os.path.getsize(coded_video_path)
+
+    # Print statistics
+    print("\n\n---------- Results ----------")
+    print("Size of original video:", originalVideoSize)
+    print("Size of bitstream:", bitstreamSize)
+    print("Compression ratio:", originalVideoSize / bitstreamSize)
+    metrics = VideoMetrics()
+    metrics.update(originalVideo, decodedVideo)
+    print("PSNR:", metrics.result())
+    print_search_points(bitstream_statistics["search_points_per_block"])
+    print_skipped_blocks(bitstream_statistics["skipped_blocks"])
+    print_throughput(originalVideoSize, encodingTime, decodingTime)
+
+
+
+def encode_and_decode_video_streaming(yuv_video_path, frames_per_chunk=GOP_SIZE, qp=28, entropy_mode="vlc", output_directory="tmp", video_format=None, read_ahead=READ_AHEAD,
+                                      write_behind=WRITE_BEHIND, **parameters):
+    '''
+        Streaming variant of encode_and_decode_video. Frames are read, encoded and written to the bitstream chunk by chunk. Afterwards the bitstream is decoded chunk by chunk, every decoded chunk is written to the output video immediately and the PSNR is accumulated on the fly (see metrics.VideoMetrics).
+        Reading and writing run in background threads with queues of read_ahead and write_behind chunks (see background_io), the time the coding waited for them is printed with the results.
+    '''
+    os.makedirs(output_directory, exist_ok=True)
+    coded_video_path = os.path.join(output_directory, "VideoStream.svc")
+    video_format = video_format or {}
+
+    # Encode the video
+    search_points = []
+    skipped_blocks = []
+    start = time.perf_counter()
+    frames = iter_yuv_frames(yuv_video_path, frames_per_chunk=frames_per_chunk, **video_format)
+    with ReadAhead(frames, read_ahead, "read_ahead_frames") as frame_reader, WriteBehind(BitstreamWriter(coded_video_path), write_behind, "write_behind_bitstream") as bitstream_writer:
+        for bitstream_chunk in stream_encoder(frame_reader, qp=qp, entropy_mode=entropy_mode, **parameters):
+            bitstream_writer.write(bitstream_chunk)
+            search_points += bitstream_chunk["statistics"]["search_points_per_block"]
+            skipped_blocks += bitstream_chunk["statistics"]["skipped_blocks"]
+    encodingTime = time.perf_counter() - start
+
+    # Decode the video, the original frames are read again alongside for the PSNR calculation
+    metrics = VideoMetrics()
+    start = time.perf_counter()
+    originals = iter_yuv_frames(yuv_video_path, frames_per_chunk=frames_per_chunk, **video_format)
+    with ReadAhead(iter_bitstream(coded_video_path, frames_per_chunk), read_ahead, "read_ahead_bitstream") as bitstream_reader, ReadAhead(originals, read_ahead, "read_ahead_original") as original_reader, \
+            WriteBehind(YUVVideoWriter(os.path.join(output_directory, "DecodedVid.yuv")), write_behind, "write_behind_decoded") as video_writer:
+        decoded_chunks = stream_decoder(bitstream_reader, parameters.get("tile_workers", 1))
+        for original_chunk, decoded_chunk in zip(original_reader, decoded_chunks):
+            video_writer.write(decoded_chunk)
+            metrics.update(original_chunk, decoded_chunk)
+    decodingTime = time.perf_counter() - start
+
+    # Calculate statistics
+    originalVideoSize = os.path.getsize(yuv_video_path)
+    bitstreamSize = os.path.getsize(coded_video_path)
 
     # Print statistics
     print("\n\n---------- Results ----------")
     print("Size of original video:", originalVideoSize)
     print("Size of bitstream:", bitstreamSize)
     print("Compression ratio:", originalVideoSize / bitstreamSize)
-    print("PSNR:", psnr_yuv(originalVideo, decodedVideo))
+    print("PSNR:", metrics.result())
+    print_search_points(search_points)
+    print_skipped_blocks(skipped_blocks)
+    print_throughput(originalVideoSize, encodingTime, decodingTime)
+    print("Background I/O:", frame_reader, bitstream_writer, bitstream_reader, original_reader, video_writer, sep="\n  ")
+
+
+def print_search_points(search_points):
+    '''
+        Prints the average number of search points per block of the motion search over all P-frames, a measure of the encoding speed of the inter prediction
+    '''
+    if search_points:
+        print("Motion search points per block:", sum(search_points) / len(search_points))
+
+
+def print_skipped_blocks(skipped_blocks):
+    '''
+        Prints the number and share of the blocks that were coded without prediction search and transform (see skip_detection), static blocks and flat blocks separately
+    '''
+    blocks = sum(frame["blocks"] for frame in skipped_blocks)
+    if blocks:
+        static = sum(frame["static"] for frame in skipped_blocks)
+        flat = sum(frame["flat"] for frame in skipped_blocks)
+        print("Skipped blocks: {} of {} ({:.1f}%), static {} ({:.1f}%), flat {} ({:.1f}%)".format(
+            static + flat, blocks, 100 * (static + flat) / blocks, static, 100 * static / blocks, flat, 100 * flat / blocks))
+
+
+def print_throughput(originalVideoSize, encodingTime, decodingTime):
+    '''
+        Prints the encoding and decoding throughput in MB/s of the uncompressed video, e.g. to judge the cost of the arithmetic coding mode
+    '''
+    print("Encoding time (s):", encodingTime, "- throughput (MB/s):", originalVideoSize / 1e6 / encodingTime)
+    print("Decoding time (s):", decodingTime, "- throughput (MB/s):", originalVideoSize / 1e6 / decodingTime)
+
+
+def print_telemetry(telemetry_path=""):
+    '''
+        Prints the summary of the recorded stages and the cProfile statistics (if recorded) and writes the stage records as JSON lines to telemetry_path
+    '''
+    print("\n---------- Stages ----------")
+    print(telemetry.summary())
+    print(telemetry.profile_stats())
+    if telemetry_path:
+        telemetry.write_json_lines(telemetry_path)
 
 
-encode_and_decode_video("/home/staff/classen/Teaching/Institutsprojekt-Template/data/ArenaOfValor_384x384_60_8bit_420.yuv")
\ No newline at end of file
+if __name__ == "__main__":
+    from cli import main
+    raise SystemExit(main(["roundtrip"] + sys.argv[1:]))
\ No newline at end of file
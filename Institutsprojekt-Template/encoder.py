@@ -1,312 +1,551 @@
 import numpy as np
-import cv2
-from scipy.fftpack import dct
-
-def encoder(video):
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from block_partitioning import partition_video, merge_blocks
+from transform import dct_blocks, idct_blocks, idct_dc, integer_dct_blocks, integer_idct_blocks, integer_idct_dc, integer_coefficient_scale
+from quantization import quantize, dequantize, quantize_dc, dequantize_dc, quantize_integer, dequantize_integer, quantize_integer_dc, dequantize_integer_dc, nonzero_counts, nonzero_dc_counts, \
+    MAX_QP
+from rate_control import RateController
+from prediction import INTRA_MODES, MODE_HORIZONTAL, MODE_INTER, default_pel_value, wavefront_order, neighbour_edges, prediction_candidates, select_mode, sad, reconstruct_blocks, \
+    horizontal_intra_prediction
+from skip_detection import skip_analysis, restrict_to_zero_vectors
+from motion import motion_search, motion_compensation, channel_vectors, vector_differences
+from parallel import SharedVideo, attach_shared_video
+from entropy_coding import VLCWriter
+from arithmetic_coding import ArithmeticWriter
+from bitstream_io import FRAME_INTRA, FRAME_INTER, pack_tile
+from tiles import tile_layout, map_tiles, tile_pool
+from workspace import EncoderWorkspace
+from telemetry import telemetry, instrument
+from yuv_io import __get_subsampling_scheme__, __get_subsampling_factors__
+
+
+GOP_SIZE = 32  # number of frames from one I-frame to the next, the I-frames are the random access points of the bitstream
+FRAME_RATE = 60  # frames per second, needed to convert the target bitrate of the rate control into bits per frame
+INTRA_BATCH_FRAMES = 8  # I-frames that are coded at once with gop_size=1, see encode_frames
+
+
+def encoder(video, workers=1, **parameters):
 
        # Encodes the video and returns a bitstream
+       # With workers > 1 groups of frames are encoded in parallel by a process pool. The groups consist of whole GOPs, so the result is identical to the serial encoding
+       # Further keyword arguments are the coding parameters of encode_frames, e.g. entropy_mode
 
     print("Encoding video...")
 
-    block_size_luma = 16
-    block_size_chroma = 8
+    if workers > 1:
+        return encode_frames_parallel(video, workers, **parameters)
 
-    frames, height, width = video["Y"].shape
-    num_blocks_h = height // block_size_luma
-    num_blocks_w = width // block_size_luma
+    return encode_frames(video, **parameters)
 
 
-    blocks = {"Y": [], "U": [], "V": []}
-    blocks ["Y"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma), dtype=np.uint8)
-    blocks ["U"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-    blocks ["V"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
+def encode_frames_parallel(video, workers, frames_per_job=0, **parameters):
 
-    
-    for f in range(frames):
-        for i in range(num_blocks_h):
-            for j in range(num_blocks_w):
+    # Jeder Job codiert eine Gruppe von Frames, die mit einem I-Frame beginnt, die Gruppen sind damit unabhängig voneinander. Das Video wird einmal
+    # in shared memory kopiert und die Bitstream-Chunks werden in der ursprünglichen Reihenfolge zusammengefügt.
+    # frames_per_job sollte ein Vielfaches der GOP-Größe sein, sonst beginnt jeder Job zusätzlich mit einem I-Frame
 
-                block = video["Y"][f, i*block_size_luma:(i+1)*block_size_luma, j*block_size_luma:(j+1)*block_size_luma]
-                blocks["Y"][f,i,j,:,:] = block
+    frames = len(video["Y"])
+    if frames_per_job == 0:
+        gop_size = parameters.get("gop_size", GOP_SIZE)
+        frames_per_job = gop_size * max(1, -(-frames // (4 * workers * gop_size)))  # a few jobs per worker for load balancing, whole GOPs per job
 
-                block = video["U"][f, i*block_size_chroma:(i+1)*block_size_chroma, j*block_size_chroma:(j+1)*block_size_chroma]
-                blocks["U"][f,i,j,:,:] = block
+    with SharedVideo(video) as shared_video:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(__encode_shared_frames__, shared_video.spec, f, min(f + frames_per_job, frames), parameters) for f in range(0, frames, frames_per_job)]
+            chunks = [job.result() for job in jobs]
 
+    return merge_bitstreams(chunks)
 
-                block = video["V"][f, i*block_size_chroma:(i+1)*block_size_chroma, j*block_size_chroma:(j+1)*block_size_chroma]
-                blocks["V"][f,i,j,:,:] = block
-    
 
-    blocks = intra_prediction(blocks)
+def __encode_shared_frames__(spec, start, stop, parameters):
 
-    blocks[0] = apply_dct(blocks)   
+    # Worker of encode_frames_parallel, encodes the frames start to stop of the shared video
 
+    shm, video = attach_shared_video(spec)
+    try:
+        bitstream = encode_frames({c: video[c][start:stop] for c in video}, **parameters)
+    finally:
+        del video  # release the views on the shared memory before closing it
+        shm.close()
 
-    bitstream = blocks
     return bitstream
 
 
-def vertical_intra_prediction(top):
-    block_height, block_width = top.shape
-
-    # Erstelle einen leeren Block für die Vorhersage
-    prediction_block = np.zeros((block_height, block_width), dtype=np.uint8)
-
-    # Iteriere über jede Spalte im Block
-    for j in range(block_width):
-        # Der Vorhersagewert wird aus dem oberen Nachbarpixel abgeleitet
-        prediction_value = top[block_height-1, j]
-
-        # Setze die Vorhersagewerte für die aktuelle Spalte im Block
-        prediction_block[:, j] = prediction_value
-
-    return prediction_block
-
-def apply_vert_intraprediction(blocks):
-
-    frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma = blocks["Y"].shape
-    block_size_chroma = blocks["U"].shape[3]
-    temp_blocks = blocks
-
-    residue_vert = {"Y": [], "U": [], "V": []}
-    residue_vert ["Y"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma), dtype=np.uint8)
-    residue_vert ["U"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-    residue_vert ["V"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-     
-    for f in range(frames):
-        for i in range(num_blocks_h - 1):
-            for j in range(num_blocks_w):
-
-                blocks["Y"][f, i+1, j,:,:] = vertical_intra_prediction(temp_blocks["Y"][f, i, j,:,:])
-                residue_vert["Y"][f, i+1, j,:,:] = temp_blocks["Y"][f, i+1, j,:,:] - blocks["Y"][f, i+1, j,:,:]
-
-                blocks["U"][f, i+1, j,:,:] = vertical_intra_prediction(temp_blocks["U"][f, i, j,:,:])
-                residue_vert["U"][f, i+1, j,:,:] = temp_blocks["U"][f, i+1, j,:,:] - blocks["U"][f, i+1, j,:,:]
-
-                blocks["V"][f, i+1, j,:,:] = vertical_intra_prediction(temp_blocks["V"][f, i, j,:,:])
-                residue_vert["V"][f, i+1, j,:,:] = temp_blocks["V"][f, i+1, j,:,:] - blocks["V"][f, i+1, j,:,:]
-                
-    return residue_vert
-
-
-def horizontal_intra_prediction(left):
-    
-    block_height, block_width = left.shape
-
-    # Erstelle einen leeren Block für die Vorhersage
-    prediction_block = np.zeros((block_height, block_width), dtype=np.uint8)
-
-    
-    # Iteriere über jede Zeile im Block
-    for i in range(block_height):
-        # Der Vorhersagewert wird aus dem linken Nachbarpixel abgeleitet
-        prediction_value = left[i, block_width-1]
+def merge_bitstreams(chunks):
 
-        # Setze die Vorhersagewerte für die aktuelle Zeile im Block
-        prediction_block[i, :] = prediction_value
+    # Fügt die Bitstream-Chunks aufeinanderfolgender Frame-Gruppen in Reihenfolge zusammen
 
-    return prediction_block
+    return {
+        "header": chunks[0]["header"],
+        "frames": [frame for chunk in chunks for frame in chunk["frames"]],
+        "statistics": {key: [value for chunk in chunks for value in chunk["statistics"][key]] for key in chunks[0]["statistics"]},
+    }
 
 
-def apply_hori_intraprediction(blocks):
+def stream_encoder(frames, **parameters):
 
-    frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma = blocks["Y"].shape
-    block_size_chroma = blocks["U"].shape[3]
-    temp_blocks = blocks
-
-    residue_hori = {"Y": [], "U": [], "V": []}
-    residue_hori ["Y"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma), dtype=np.uint8)
-    residue_hori ["U"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-    residue_hori ["V"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-     
-    for f in range(frames):
-        for i in range(num_blocks_h):
-            for j in range(num_blocks_w - 1):
-
-                blocks["Y"][f, i, j+1,:,:] = horizontal_intra_prediction(temp_blocks["Y"][f, i, j,:,:])
-                residue_hori["Y"][f, i, j+1,:,:] = temp_blocks["Y"][f, i, j+1,:,:] - blocks["Y"][f, i, j+1,:,:]
-
-                blocks["U"][f, i, j+1,:,:] = horizontal_intra_prediction(temp_blocks["U"][f, i, j,:,:])
-                residue_hori["U"][f, i, j+1,:,:] = temp_blocks["U"][f, i, j+1,:,:] - blocks["U"][f, i, j+1,:,:]
-
-                blocks["V"][f, i, j+1,:,:] = horizontal_intra_prediction(temp_blocks["V"][f, i, j,:,:])
-                residue_hori["V"][f, i, j+1,:,:] = temp_blocks["V"][f, i, j+1,:,:] - blocks["V"][f, i, j+1,:,:]
-                
-    return residue_hori
-
-
-def diagonal_intra_prediction(top, left, top_left):
-    block_height, block_width = top.shape
-
-    # Erstelle einen leeren Block für die Vorhersage
-    prediction_block = np.zeros((block_height, block_width), dtype=np.uint8)
-    
-    for i in range(block_height):
-        for j in range(block_width):
-
-            if i == j:
-                prediction_block[i, j] = top_left[block_height - 1, block_width - 1] 
-            elif j > i:
-                prediction_block[i, j] = top[block_height - 1, j - i - 1]
-            elif i > j:
-                prediction_block[i, j] = left[i - j - 1, block_width - 1] 
-
-    return prediction_block
+    # Encodes a stream of frames (e.g. from yuv_io.iter_yuv_frames) chunk by chunk and yields one bitstream chunk per input chunk.
+    # Only the current chunk is held in memory, so the memory usage does not depend on the length of the video.
+    # The GOPs run across the chunk boundaries: the frame types follow the position of the frame in the stream and the last reconstructed frame
+    # of a chunk is kept as reference for a P-frame at the start of the next chunk (like decoder.stream_decoder), together with its motion vectors as start of the
+    # next motion search, so the chunk size does not change the bitstream.
+    # With a target_bitrate one rate controller is shared by all chunks, so the deviation from the target is carried over from chunk to chunk
 
+    print("Encoding video...")
 
-def apply_diag_intraprediction(blocks):
+    if parameters.get("target_bitrate", 0) > 0:
+        parameters["rate_controller"] = RateController(parameters.pop("target_bitrate"), parameters.pop("frame_rate", FRAME_RATE), parameters.get("qp", 28))
+
+    state = {}
+    first_frame = 0
+    for chunk in frames:
+        yield encode_frames(chunk, first_frame=first_frame, state=state, **parameters)
+        first_frame += len(chunk["Y"])
+
+
+def encode_frames(video, qp=28, entropy_mode="vlc", gop_size=GOP_SIZE, target_bitrate=0, frame_rate=FRAME_RATE, rate_controller=None, tile_size=(0, 0), tile_workers=1, tile_callback=None, skip_blocks=True,
+                  transform="float", first_frame=0, state=None):
+
+    # Encodes a single frame or a group of frames, given as video with shape (frames, height, width) per channel
+    # qp: quantization parameter between 0 and 51, the step size doubles every 6 QP (see quantization)
+    # entropy_mode: "vlc" (Exp-Golomb, see entropy_coding) or "arithmetic" (context-adaptive binary arithmetic coding, see arithmetic_coding)
+    # gop_size: every gop_size-th frame is an I-frame, all other frames are P-frames predicted from the previous reconstructed frame.
+    #           With gop_size=1 all frames are I-frames, which are independent of each other and coded INTRA_BATCH_FRAMES frames at once
+    # target_bitrate: bits per second at frame_rate frames per second. With a target bitrate the rate control (see rate_control) chooses the QP of
+    #                 every frame and qp is only the QP of the first I-frame. Instead of the target bitrate a RateController can be passed
+    # tile_size: (height, width) of the tiles in luma blocks, (0, 0) for one tile per frame. Tiles are coded independently (see tiles)
+    # tile_workers: number of threads that code the tiles of a frame concurrently
+    # tile_callback: optional function(frame, tile, chunk) that gets the bitstream chunk of every tile as soon as the tile is coded, e.g. for a live preview
+    # skip_blocks: static and flat blocks are found by a pre-analysis and coded without prediction search and transform (see skip_detection).
+    #              In P-frames the pre-analysis compares the blocks with the co-located blocks of the reference before the motion search
+    # transform: "float" (float32 DCT) or "integer" (integer DCT with integer dequantization like HEVC, bit-exact on every platform but somewhat slower, see transform)
+    # first_frame, state: position of the first frame in the stream and a dict that carries the last reconstructed frame ("reference") and its motion vectors
+    #                     ("vectors") from call to call (see stream_encoder). The frame types follow the position in the stream, a video that starts within a GOP
+    #                     is predicted from the reference. With a state the GOPs that reach beyond the video are planned by the rate control with gop_size frames,
+    #                     the rest of the GOP follows with the next call
+    # The bitstream contains the number of search points per block of the motion search of every P-frame, the number of skipped blocks of
+    # every frame ("skipped_blocks", dicts with "static", "flat" and "blocks") and, with rate control, the achieved and target bits of every GOP in "statistics"
 
-    frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma = blocks["Y"].shape
-    block_size_chroma = blocks["U"].shape[3]
-    temp_blocks_1 = blocks
-    temp_blocks_2 = blocks
-    residue_diag = blocks
+    block_size_luma = 16
+    block_size_chroma = 8
 
-    '''
-    residue_diag = {"Y": [], "U": [], "V": []}
-    residue_diag ["Y"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma), dtype=np.uint8)
-    residue_diag ["U"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-    residue_diag ["V"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-    '''
-     
-    for f in range(frames):
-        for i in range(num_blocks_h - 1):
-            for j in range(num_blocks_w - 1):
+    header = create_header(video, block_size_luma, block_size_chroma, qp=qp, entropy_mode=entropy_mode, tile_size=tile_size, transform=transform)
+
+    # Zero-copy partitioning into blocks, frames that are not a multiple of the block size are padded by edge replication
+    with telemetry.frame("encode", 0, len(video["Y"])):
+        blocks = partition_video(video, block_size_luma, block_size_chroma)
+    tiles = tile_layout(header, {c: blocks[c].shape[1:3] for c in blocks})
+
+    if rate_controller is None and target_bitrate > 0:
+        rate_controller = RateController(target_bitrate, frame_rate, qp)
+
+    # scratch buffers, allocated with the first frame and reused for all further frames
+    workspace = EncoderWorkspace()
+    pool = tile_pool(tile_workers)
+    try:
+        if gop_size == 1 and rate_controller is None:
+            # die I-Frames sind unabhängig voneinander und werden in Gruppen von INTRA_BATCH_FRAMES Frames gemeinsam codiert,
+            # die Puffer von workspace haben damit unabhängig von der Länge des Videos die Größe einer Gruppe
+            frames = []
+            skipped_blocks = []
+            for f in range(0, len(video["Y"]), INTRA_BATCH_FRAMES):
+                batch = {c: blocks[c][f:f + INTRA_BATCH_FRAMES] for c in blocks}
+                with telemetry.frame("encode", first_frame + f, len(batch["Y"])):
+                    analysis = skip_pre_analysis(batch, qp, header, workspace) if skip_blocks else None
+                    tile_chunks, _, _, skipped = code_tiles(batch, tiles, header, qp, pool, tile_callback, first_frame + f, workspace=workspace, analysis=analysis)
+                    frames += [write_frame(FRAME_INTRA, qp, chunks) for chunks in tile_chunks]
+                skipped_blocks += [skip_statistics(frame_skipped, batch) for frame_skipped in skipped]
+            return {"header": header, "frames": frames, "statistics": {"search_points_per_block": [], "skipped_blocks": skipped_blocks, "rate_control": []}}
+
+        frames = []
+        search_points = []
+        skipped_blocks = []
+        gop_reports = []
+        frame_qp = qp
+        streaming = state is not None
+        reference = state.get("reference") if streaming else None
+        vectors = state.get("vectors") if streaming else None
+        for f in range(len(video["Y"])):
+            position = (first_frame + f) % gop_size  # position of the frame in its GOP
+            with telemetry.frame("encode", first_frame + f):
+                frame = {c: blocks[c][f:f + 1] for c in blocks}
+
+                if rate_controller is not None and position == 0:
+                    rate_controller.start_gop(gop_size if streaming else min(gop_size, len(video["Y"]) - f))
+
+                frame_type = FRAME_INTRA if position == 0 else FRAME_INTER
+                if rate_controller is not None:
+                    frame_qp = rate_controller.frame_qp(frame_type)
+
+                analysis = None
+                if frame_type == FRAME_INTRA:
+                    vectors = None
+                    motion_prediction = None
+                    if skip_blocks:
+                        analysis = skip_pre_analysis(frame, frame_qp, header, workspace)
+                else:
+                    # Bewegungsschätzung auf Luma, die Chroma-Blöcke nutzen den Vektor des zugehörigen Luma-Blocks
+                    assert reference is not None, "P-frame without reference frame"
+                    if skip_blocks:
+                        # Voranalyse gegen die co-lokalisierten Blöcke der Referenz (Nullvektor), die Markierungen gelten nur für Blöcke, deren Vektor
+                        # nach der Bewegungsschätzung der Nullvektor ist. Alle Blöcke werden gesucht, sonst breitet sich der Nullvektor falsch
+                        # markierter Blöcke über die Startpunkte der Nachbarn aus
+                        co_located = {c: motion_compensation(reference[c], np.zeros(frame[c].shape[1:3] + (2,), dtype=np.int16), frame[c].shape[-1])[None] for c in frame}
+                        analysis = skip_pre_analysis(frame, frame_qp, header, workspace, co_located)
+                    vectors, points = motion_search(frame["Y"][0], reference["Y"], vectors)
+                    search_points.append(float(points.mean()))
+                    block_vectors = {c: frame_vectors(vectors, c, frame[c].shape, header) for c in frame}
+                    motion_prediction = {c: motion_compensation(reference[c], block_vectors[c], frame[c].shape[-1])[None] for c in frame}
+                    if analysis is not None:
+                        analysis = {c: restrict_to_zero_vectors(analysis[c], block_vectors[c]) for c in frame}
+
+                tile_chunks, reconstructed, nonzero, skipped = code_tiles(frame, tiles, header, frame_qp, pool, tile_callback, first_frame + f, motion_prediction, vectors,
+                                                                         rate_controller is not None, workspace, analysis)
+                skipped_blocks.append(skip_statistics(skipped[0], frame))
+                # the reference is only read by the motion search and compensation before the reconstruction of the next frame replaces it
+                reference = {c: merge_blocks(reconstructed[c], *video[c].shape[1:], out=workspace.scratch(("reference", c), (1,) + video[c].shape[1:], video[c].dtype))[0] for c in reconstructed}
+                frames.append(write_frame(frame_type, frame_qp, tile_chunks[0]))
+
+                if rate_controller is not None:
+                    rate_controller.update(frame_type, frame_qp, 8 * len(frames[-1]), nonzero)
+                    if position + 1 == gop_size or (f + 1 == len(video["Y"]) and not streaming):
+                        gop_reports.append(rate_controller.gop_report())
+                        print("GOP", len(rate_controller.gops) - 1, "- bits:", gop_reports[-1]["bits"], "target:", round(gop_reports[-1]["target_bits"]), "achieved/target:", round(gop_reports[-1]["ratio"], 3), "mean QP:", gop_reports[-1]["mean_qp"])
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if streaming:
+        state["reference"] = {c: reference[c].copy() for c in reference}  # the reference outlives the workspace of this call
+        state["vectors"] = vectors
+
+    bitstream = {"header": header, "frames": frames, "statistics": {"search_points_per_block": search_points, "skipped_blocks": skipped_blocks, "rate_control": gop_reports}}
+    return bitstream
 
-                temp_blocks_2["Y"][f, i+1, j+1,:,:] = diagonal_intra_prediction(temp_blocks_1["Y"][f, i, j+1,:,:], temp_blocks_1["Y"][f, i+1, j,:,:], temp_blocks_1["Y"][f, i, j,:,:])
-                residue_diag["Y"][f, i+1, j+1,:,:] = (blocks["Y"][f, i, j,:,:] - temp_blocks_2["Y"][f, i, j,:,:])
 
-                temp_blocks_2["U"][f, i+1, j+1,:,:] = diagonal_intra_prediction(temp_blocks_1["U"][f, i, j+1,:,:], temp_blocks_1["U"][f, i+1, j,:,:], temp_blocks_1["U"][f, i, j,:,:])
-                residue_diag["U"][f, i, j,:,:] = (blocks["U"][f, i, j,:,:] - temp_blocks_2["U"][f, i, j,:,:])
+def code_tiles(blocks, tiles, header, qp, pool=None, tile_callback=None, first_frame=0, motion_prediction=None, vectors=None, rate_control=False, workspace=None, analysis=None):
 
-                temp_blocks_2["V"][f, i+1, j+1,:,:] = diagonal_intra_prediction(temp_blocks_1["V"][f, i, j+1,:,:], temp_blocks_1["V"][f, i+1, j,:,:], temp_blocks_1["V"][f, i, j,:,:])
-                residue_diag["V"][f, i+1, j+1,:,:] = (blocks["V"][f, i, j,:,:] - temp_blocks_2["V"][f, i, j,:,:])
+    # Codiert alle Kacheln der übergebenen Frames, mit einem pool nebenläufig. Sobald eine Kachel fertig ist, werden ihre Chunks an tile_callback übergeben
+    # Die Zwischenergebnisse liegen in den Puffern von workspace (siehe workspace), die beim nächsten Aufruf mit demselben workspace überschrieben werden
+    # Rückgabe: die Chunks aller Kacheln pro Frame (in Kachelreihenfolge), die Rekonstruktion pro Kanal (gleiche Form wie blocks)
+    # und mit rate_control die Anzahl der Koeffizienten ungleich null pro QP (siehe quantization.nonzero_counts)
+    # sowie die Anzahl der übersprungenen Blöcke pro Frame (Spalten: statisch, flach, siehe skip_detection), ohne analysis immer 0.
+    # analysis ist die Voranalyse der übersprungenen Blöcke pro Kanal für die ganzen Frames (siehe skip_pre_analysis) oder None
 
-    return residue_diag
+    workspace = workspace if workspace is not None else EncoderWorkspace()
+    tile_chunks = [[None] * len(tiles) for _ in range(len(blocks["Y"]))]
+    reconstructed = {c: workspace.scratch(("reconstructed", c), blocks[c].shape, blocks[c].dtype) for c in blocks}
+    nonzero = np.zeros(MAX_QP + 1, dtype=np.int64) if rate_control else None
+    skipped = np.zeros((len(blocks["Y"]), 2), dtype=np.int64)
 
+    coding = partial(code_tile, blocks, header, qp, motion_prediction, vectors, rate_control, workspace, analysis)
+    for index, (chunks, tile_reconstruction, tile_nonzero, tile_skipped) in map_tiles(coding, tiles, pool):
+        for c in blocks:
+            rows, columns = tiles[index][c]
+            reconstructed[c][:, rows, columns] = tile_reconstruction[c]
 
+        for f, chunk in enumerate(chunks):
+            tile_chunks[f][index] = chunk
+            if tile_callback is not None:
+                tile_callback(first_frame + f, index, chunk)
 
-def intra_prediction(blocks):
-    frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma = blocks["Y"].shape
-    block_size_chroma = blocks["U"].shape[3]
+        if rate_control:
+            nonzero += tile_nonzero
+        skipped += tile_skipped
 
-    temp_blocks_diag = blocks
-    temp_blocks_vert = blocks
-    temp_blocks_hori = blocks
+    return tile_chunks, reconstructed, nonzero, skipped
 
-    residue_diag = {"Y": [], "U": [], "V": []}
-    residue_diag ["Y"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma), dtype=np.uint8)
-    residue_diag ["U"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-    residue_diag ["V"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
 
-    residue_vert = {"Y": [], "U": [], "V": []}
-    residue_vert ["Y"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma), dtype=np.uint8)
-    residue_vert ["U"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-    residue_vert ["V"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
+def code_tile(blocks, header, qp, motion_prediction, vectors, rate_control, workspace, analysis, index, tile):
 
-    residue_hori = {"Y": [], "U": [], "V": []}
-    residue_hori ["Y"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma), dtype=np.uint8)
-    residue_hori ["U"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-    residue_hori ["V"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
+    # Codiert eine Kachel aller übergebenen Frames unabhängig von den anderen Kacheln: die Prädiktion behandelt Blöcke außerhalb der Kachel
+    # als nicht verfügbar und jede Kachel hat einen eigenen Entropiecoder und eigene Puffer (workspace.tile). analysis ist die Voranalyse der übersprungenen Blöcke
+    # pro Kanal (siehe skip_detection.skip_analysis) oder None
+    # Rückgabe: Chunk der Kachel für jeden Frame (siehe bitstream_io.pack_tile), Rekonstruktion der Kachel pro Kanal, die nonzero-Statistik und die übersprungenen Blöcke
 
-    residue = {"Y": [], "U": [], "V": []}
-    residue ["Y"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_luma, block_size_luma), dtype=np.uint8)
-    residue ["U"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
-    residue ["V"] = np.zeros((frames, num_blocks_h, num_blocks_w, block_size_chroma, block_size_chroma), dtype=np.uint8)
+    nonzero = np.zeros(MAX_QP + 1, dtype=np.int64) if rate_control else None
+    skipped = np.zeros((len(blocks["Y"]), 2), dtype=np.int64)
+    levels = {}
+    prediction_mode = {}
+    reconstructed = {}
+    for c in ["Y", "U", "V"]:
+        rows, columns = tile[c]
+        tile_prediction = None if motion_prediction is None else motion_prediction[c][:, rows, columns]
+        tile_analysis = None if analysis is None else tuple(flags[:, rows, columns] for flags in analysis[c])
+        levels[c], prediction_mode[c], reconstructed[c] = block_coding(blocks[c][:, rows, columns], header["bit_depth"], qp, c, tile_prediction, nonzero, workspace.tile(index),
+                                                                         tile_analysis, skipped, header["transform"])
 
-    prediction_mode = {"Y": [], "U": [], "V": []}
-    prediction_mode ["Y"] = np.zeros((frames, num_blocks_h, num_blocks_w, 1), dtype=np.uint8)
-    prediction_mode ["U"] = np.zeros((frames, num_blocks_h, num_blocks_w, 1), dtype=np.uint8)
-    prediction_mode ["V"] = np.zeros((frames, num_blocks_h, num_blocks_w, 1), dtype=np.uint8)
+    tile_vectors = None if vectors is None else vectors[tile["Y"]]
+    chunks = [pack_tile(index, write_tile({c: levels[c][f] for c in levels}, {c: prediction_mode[c][f] for c in prediction_mode}, header, tile_vectors)) for f in range(len(levels["Y"]))]
+    return chunks, reconstructed, nonzero, skipped
 
-    residue_diag = apply_diag_intraprediction(temp_blocks_diag)
 
-    residue_vert = apply_vert_intraprediction(temp_blocks_vert)
-    
-    residue_hori = apply_hori_intraprediction(temp_blocks_hori)
+def skip_pre_analysis(blocks, qp, header, workspace, co_located=None):
 
-    #berechne kleinsten prediction error, speichere den gewählten prediction mode mit kleinstem error in "prediction_mode"
-    for f in range(frames):
-        for i in range(num_blocks_h):
-            for j in range(num_blocks_w):
-                
-                if residue_diag["Y"][f,i,j,:,:] < residue_hori["Y"][f,i,j,:,:] and residue_diag["Y"][f,i,j,:,:] < residue_vert["Y"][f,i,j,:,:]:
-                    residue["Y"][f,i,j,:,:] = residue_diag["Y"][f,i,j,:,:]
-                    prediction_mode["Y"][f,i,j,:] = 1
+    # Voranalyse der statischen und flachen Blöcke aller Kanäle (siehe skip_detection.skip_analysis), einmal für die ganzen Frames und nicht pro Kachel.
+    # In P-Frames sind co_located die co-lokalisierten Blöcke der Referenz pro Kanal (Prädiktion mit dem Nullvektor)
 
-                elif residue_vert["Y"][f,i,j,:,:] < residue_hori["Y"][f,i,j,:,:] and residue_vert["Y"][f,i,j,:,:] < residue_diag["Y"][f,i,j,:,:]:
-                    residue["Y"][f,i,j,:,:] = residue_vert["Y"][f,i,j,:,:]
-                    prediction_mode["Y"][f,i,j,:] = 2
+    return {c: skip_analysis(blocks[c], qp, c, None if co_located is None else co_located[c], workspace.scratch("skip_analysis", (2 * blocks[c].size,), np.int32),
+                             header["transform"], header["bit_depth"])
+            for c in blocks}
 
-                else:
-                    residue["Y"][f,i,j,:,:] = residue_hori["Y"][f,i,j,:,:]
-                    prediction_mode["Y"][f,i,j,:] = 3
-
-                
-                if residue_diag["U"][f,i,j,:,:] < residue_hori["U"][f,i,j,:,:] and residue_diag["U"][f,i,j,:,:] < residue_vert["U"][f,i,j,:,:]:
-                    residue["U"][f,i,j,:,:] = residue_diag["U"][f,i,j,:,:]
-                    prediction_mode["U"][f,i,j,:] = 1
-
-                elif residue_vert["U"][f,i,j,:,:] < residue_hori["U"][f,i,j,:,:] and residue_vert["U"][f,i,j,:,:] < residue_diag["U"][f,i,j,:,:]:
-                    residue["U"][f,i,j,:,:] = residue_vert["U"][f,i,j,:,:]
-                    prediction_mode["U"][f,i,j,:] = 2
-                    
-                else:
-                    residue["U"][f,i,j,:,:] = residue_hori["U"][f,i,j,:,:]
-                    prediction_mode["U"][f,i,j,:] = 3
 
+def skip_statistics(skipped, blocks):
 
-                if residue_diag["V"][f,i,j,:,:] < residue_hori["V"][f,i,j,:,:] and residue_diag["V"][f,i,j,:,:] < residue_vert["V"][f,i,j,:,:]:
-                    residue["V"][f,i,j,:,:] = residue_diag["V"][f,i,j,:,:]
-                    prediction_mode["V"][f,i,j,:] = 1
+    # Anzahl der statischen und flachen Blöcke eines Frames und aller Blöcke des Frames (alle Kanäle)
 
-                elif residue_vert["V"][f,i,j,:,:] < residue_hori["V"][f,i,j,:,:] and residue_vert["V"][f,i,j,:,:] < residue_diag["V"][f,i,j,:,:]:
-                    residue["V"][f,i,j,:,:] = residue_vert["V"][f,i,j,:,:]
-                    prediction_mode["V"][f,i,j,:] = 2
-                    
-                else:
-                    residue["V"][f,i,j,:,:] = residue_hori["V"][f,i,j,:,:]
-                    prediction_mode["V"][f,i,j,:] = 3
+    return {"static": int(skipped[0]), "flat": int(skipped[1]), "blocks": sum(int(np.prod(blocks[c].shape[1:3])) for c in blocks)}
 
-    residues_with_prediction_mode = {residue, prediction_mode}
 
-    return residues_with_prediction_mode
+def frame_vectors(vectors, channel, block_shape, header):
 
+    # Motion vectors of the blocks of a channel with the block shape (frames, num_blocks_h, num_blocks_w, block_size, block_size)
 
-def dct_2d(block):
-    return dct(dct(block.T, norm='ortho').T, norm='ortho')
+    if channel == "Y":
+        return vectors
 
+    _, num_blocks_h, num_blocks_w, block_size, _ = block_shape
+    return channel_vectors(vectors, num_blocks_h, num_blocks_w, block_size, header["block_size_luma"], __get_subsampling_factors__(header["subsampling_scheme"]))
 
-def apply_dct(blocks):
-    '''
-    nach intra_prediction wird ein neues array ausgegeben mit residues_with_prediction_mode = {residue, prediction_mode} und auf residue muss zugegriffen werden,
-    also residues_with_prediction_mode[0] = blocks[0] = residue
-    '''
-    frames, num_blocks_h, num_blocks_w, a, b = blocks[0]["Y"].shape
 
-    for f in range(frames):
-        for i in range(num_blocks_h):
-            for j in range(num_blocks_w):
+def create_header(video, block_size_luma, block_size_chroma, qp=0, entropy_mode="vlc", tile_size=(0, 0), transform="float"):
 
-                blocks[0]["Y"][f, i, j,:,:] = dct_2d(blocks[0]["Y"][f, i, j,:,:])
+    # Parameters of the bitstream that are needed by the decoder, see bitstream_io.pack_header
 
-                blocks[0]["U"][f, i, j,:,:] = dct_2d(blocks[0]["U"][f, i, j,:,:])
-                
-                blocks[0]["V"][f, i, j,:,:] = dct_2d(blocks[0]["V"][f, i, j,:,:])
-    
-    return blocks[0]
+    return {
+        "width": video["Y"].shape[2],
+        "height": video["Y"].shape[1],
+        "bit_depth": 8 if video["Y"].dtype == np.uint8 else 10,
+        "subsampling_scheme": __get_subsampling_scheme__(video),
+        "block_size_luma": block_size_luma,
+        "block_size_chroma": block_size_chroma,
+        "qp": qp,
+        "entropy_mode": entropy_mode,
+        "tile_height": tile_size[0],
+        "tile_width": tile_size[1],
+        "transform": transform,
+    }
 
 
+def write_frame(frame_type, qp, tile_chunks):
 
-                
+    # Schreibt den Frame-Typ und den QP des Frames, gefolgt von den Chunks aller Kacheln in Kachelreihenfolge
+    # Rückgabe: payload des Frames als bytes
 
-    
+    return bytes([frame_type, qp]) + b"".join(tile_chunks)
 
 
+@instrument("entropy_coding")
+def write_tile(levels, prediction_mode, header, vectors=None):
 
+    # Schreibt in P-Frames (vectors ist gegeben) die Prädiktionsfehler der Bewegungsvektoren (siehe motion.vector_differences), die Prädiktionsmodi
+    # einer Kachel für Y, U und V und danach die entropiecodierten Koeffizienten (levels) aller Kanäle mit dem im header gewählten entropy_mode
+    # Rückgabe: payload der Kachel als bytes
 
+    writer = create_syntax_writer(header["entropy_mode"])
+    inter = vectors is not None
 
+    if inter:
+        writer.write_vectors(vector_differences(vectors))
 
+    for c in ["Y", "U", "V"]:
+        writer.write_modes(prediction_mode[c], c, inter)
 
+    for c in ["Y", "U", "V"]:
+        writer.write_levels(levels[c], c)
 
+    return writer.getvalue()
 
+
+def create_syntax_writer(entropy_mode):
+
+    # VLCWriter und ArithmeticWriter haben dieselbe Schnittstelle (write_vectors, write_modes, write_levels, getvalue)
+
+    if entropy_mode == "vlc":
+        return VLCWriter()
+    if entropy_mode == "arithmetic":
+        return ArithmeticWriter()
+    raise ValueError("Unknown entropy mode " + str(entropy_mode))
+
+
+def block_coding(blocks, bit_depth, qp, channel, motion_prediction=None, nonzero=None, workspace=None, analysis=None, skipped=None, transform="float"):
+
+    # Codiert alle Blöcke eines Kanals: Prädiktion, DCT und Quantisierung der Koeffizienten mit dem qp und der Quantisierungsmatrix des Kanals.
+    # Die Intra-Prädiktion nutzt die rekonstruierten Nachbarblöcke (wie im Decoder), damit sich Quantisierungsfehler nicht aufsummieren.
+    # Die Blöcke werden deshalb in Wellenfront-Reihenfolge codiert: alle Blöcke einer Anti-Diagonalen hängen nur von früheren
+    # Anti-Diagonalen ab und werden gemeinsam (vektorisiert) verarbeitet.
+    # In P-Frames ist motion_prediction die bewegungskompensierte Prädiktion (gleiche Form wie blocks), die als zusätzlicher Modus MODE_INTER zur Wahl steht.
+    # Für die Ratenregelung wird in nonzero (falls übergeben) die Anzahl der Koeffizienten ungleich null für jeden QP aufsummiert, siehe quantization.nonzero_counts
+    # Mit analysis, dem Ergebnis (static, flat_margin) von skip_detection.skip_analysis für die Blöcke, werden statische und flache Blöcke ohne Prädiktionssuche
+    # und DCT codiert (siehe __code_without_transform__), ihre Anzahl pro Frame wird in skipped (int64-Array der Form (frames, 2)) in skipped[:, 0] (statisch)
+    # und skipped[:, 1] (flach) aufsummiert.
+    # Die übrigen Blöcke einer Anti-Diagonalen werden nur kompaktiert, wenn mindestens die Hälfte übersprungen wird, sonst werden alle regulär codiert.
+    # transform wählt die Float- oder die Integer-DCT (siehe transform_coding).
+    # Alle Arrays liegen in den Puffern von workspace (siehe workspace): die Arrays pro Frame werden von Frame zu Frame wiederverwendet,
+    # die Zwischenergebnisse einer Anti-Diagonalen (Kandidaten, Residuen, Koeffizienten, levels) werden mit out= in Puffer für die längste Diagonale geschrieben.
+    # Die Eingangsblöcke werden nur gelesen.
+    # Rückgabe: levels (int16, gleiche Form wie blocks), prediction_mode (uint8, Form (frames, num_blocks_h, num_blocks_w)) und die Rekonstruktion,
+    # gültig bis zum nächsten Aufruf mit demselben workspace
+
+    frames, num_blocks_h, num_blocks_w, block_size, _ = blocks.shape
+    default = default_pel_value(bit_depth)
+    workspace = workspace if workspace is not None else EncoderWorkspace()
+    num_modes = len(INTRA_MODES) + (motion_prediction is not None)
+
+    levels = workspace.scratch((channel, "levels"), blocks.shape, np.int16)
+    prediction_mode = workspace.scratch((channel, "prediction_mode"), (frames, num_blocks_h, num_blocks_w), np.uint8)
+    reconstructed = workspace.scratch((channel, "reconstructed"), blocks.shape, blocks.dtype)
+    frame_coefficients = None
+    flat_dc = None
+    coded_coefficients = 0
+    if nonzero is not None:
+        # die DCT schreibt die Koeffizienten der regulär codierten Blöcke direkt hintereinander in diesen Puffer (die Statistik hängt nicht von der Reihenfolge ab),
+        # von den übersprungenen flachen Blöcken wird nur der DC-Koeffizient gebraucht
+        frame_coefficients = workspace.scratch((channel, "coefficients"), (blocks.size,), np.float32)
+        flat_dc = workspace.scratch((channel, "flat_dc"), (frames, num_blocks_h, num_blocks_w), np.float32)
+
+    if analysis is not None:
+        static, flat_margin = analysis
+        skip = static | (flat_margin > 0)  # die flachen Blöcke in I-Frames hängen noch von der linken Kante ab, siehe unten
+        if not skip.any():
+            analysis = None
+
+    if analysis is not None:
+        if motion_prediction is not None:
+            # in P-Frames hängen die übersprungenen Blöcke nicht von ihren Nachbarn ab und werden vorab für den ganzen Frame codiert
+            for mask, dc_only in [(static, False), (skip & ~static, True)]:
+                if mask.any():
+                    __code_without_transform__(blocks[mask], motion_prediction[mask], (mask,), MODE_INTER, dc_only, qp, channel, bit_depth,
+                                               levels, prediction_mode, reconstructed, flat_dc, transform)
+
+        # Anzahl der Kandidaten pro Anti-Diagonale, Diagonalen ohne Kandidaten werden ohne weitere Prüfung regulär codiert
+        skip_counts = np.bincount(np.add.outer(np.arange(num_blocks_h), np.arange(num_blocks_w)).ravel(), weights=skip.sum(axis=0).ravel(), minlength=num_blocks_h + num_blocks_w - 1)
+
+    for d, (rows, columns) in enumerate(wavefront_order(num_blocks_h, num_blocks_w)):
+        top, left, top_left = neighbour_edges(reconstructed, rows, columns, default)
+        source = blocks[:, rows, columns]
+        prediction = None if motion_prediction is None else motion_prediction[:, rows, columns]
+        index = (slice(None), rows, columns)
+
+        if analysis is not None and skip_counts[d] > 0:
+            coded = ~skip[index]
+            if motion_prediction is None and 2 * skip_counts[d] >= coded.size:
+                # flache Blöcke in I-Frames: horizontale Prädiktion, falls auch die linke Kante flach genug ist (AC-Energie der Prädiktion unter flat_margin)
+                edge = left.astype(np.float64)
+                edge_energy = np.sqrt(block_size * np.square(edge - edge.mean(axis=-1, keepdims=True)).sum(axis=-1))
+                flat = ~coded & (flat_margin[index] > edge_energy)
+                frame_index, position = np.nonzero(flat)
+                __code_without_transform__(source[flat], horizontal_intra_prediction(left[flat]), (frame_index, rows[position], columns[position]), MODE_HORIZONTAL, True,
+                                           qp, channel, bit_depth, levels, prediction_mode, reconstructed, flat_dc, transform)
+                coded = ~flat
+                skip[index] = flat
+
+            if 2 * coded.sum() > coded.size:
+                skip[index] = False  # with few skipped blocks the compaction costs more than it saves, all blocks of the diagonal are coded regularly
+            elif not coded.any():
+                continue
+            else:
+                # nur die übrigen Blöcke werden kompakt (ohne Frame-Achse) weitercodiert
+                frame_index, position = np.nonzero(coded)
+                index = (frame_index, rows[position], columns[position])
+                source, top, left, top_left = source[coded], top[coded], left[coded], top_left[coded]
+                prediction = None if prediction is None else prediction[coded]
+
+        candidates = prediction_candidates(top, left, top_left, prediction, out=workspace.scratch("candidates", (num_modes,) + source.shape, blocks.dtype))
+        residue, mode, selected = mode_decision(source, candidates, out=workspace.scratch("residues", (num_modes,) + source.shape, np.int16))
+
+        coefficients = None
+        if frame_coefficients is not None:
+            coefficients = frame_coefficients[coded_coefficients:coded_coefficients + residue.size].reshape(residue.shape)
+            coded_coefficients += residue.size
+        coefficients, level, residual = transform_coding(residue, qp, channel, bit_depth, transform, workspace, coefficients)
+
+        levels[index] = level
+        prediction_mode[index] = mode
+        reconstructed[index] = reconstruct_blocks(selected, residual, bit_depth, out=residual)
+
+    if analysis is not None:
+        skipped[:, 0] += (skip & static).sum(axis=(1, 2))
+        skipped[:, 1] += (skip & ~static).sum(axis=(1, 2))
+    if nonzero is not None:
+        coefficients = frame_coefficients[:coded_coefficients].reshape(-1, block_size, block_size)
+        dc = flat_dc[skip & ~static] if analysis is not None else flat_dc[:0, 0, 0]
+        if transform == "integer":
+            coefficients /= integer_coefficient_scale(block_size, bit_depth)  # the statistics are in units of the orthonormal DCT
+            dc /= integer_coefficient_scale(block_size, bit_depth)
+        nonzero += nonzero_counts(coefficients, channel) + nonzero_dc_counts(dc, block_size, channel)  # once for all blocks of the frame
+
+    return levels, prediction_mode, reconstructed
+
+
+def transform_coding(residue, qp, channel, bit_depth, transform="float", workspace=None, out=None):
+
+    # DCT, Quantisierung, Dequantisierung und inverse DCT der Residuen (Form (..., block_size, block_size)) mit der Float- oder der Integer-DCT (siehe transform).
+    # Die Integer-DCT wird mit ganzzahliger Arithmetik dequantisiert und rücktransformiert, die Rekonstruktion ist damit auf jeder Plattform identisch mit der des Decoders.
+    # Rückgabe: die Koeffizienten (float32, bei der Integer-DCT mit der Skalierung transform.integer_coefficient_scale), die levels (int16) und das rekonstruierte Residuum (int16),
+    # alle in den Puffern von workspace. out ist ein optionales float32-Array mit der Form von residue, in das die Koeffizienten geschrieben werden
+
+    workspace = workspace if workspace is not None else EncoderWorkspace()
+    coefficients = out if out is not None else workspace.scratch("coefficients", residue.shape, np.float32)
+    level = workspace.scratch("level", residue.shape, np.int16)
+    residual = workspace.scratch("residual", residue.shape, np.int16)
+
+    if transform == "integer":
+        integer_dct_blocks(residue, bit_depth, out=coefficients)
+        quantize_integer(coefficients, qp, channel, bit_depth, out=level)
+        integer_idct_blocks(dequantize_integer(level, qp, channel, bit_depth), bit_depth, out=residual)
+    elif transform == "float":
+        dct_blocks(residue, out=coefficients)
+        quantize(coefficients, qp, channel, out=level)
+        idct_blocks(dequantize(level, qp, channel, out=workspace.scratch("dequantized", residue.shape, np.float32)), out=residual)
+    else:
+        raise ValueError("Unknown transform " + str(transform))
+
+    return coefficients, level, residual
+
+
+def __code_without_transform__(blocks, prediction, target, mode, dc_only, qp, channel, bit_depth, levels, prediction_mode, reconstructed, dc_coefficients, transform="float"):
+
+    # Codiert Blöcke (Form (n, block_size, block_size)) ohne Prädiktionssuche und DCT mit der gegebenen Prädiktion und dem Modus mode, siehe skip_detection:
+    # statische Blöcke ohne Residuum, flache Blöcke (dc_only) nur mit dem DC-Level des Residuums.
+    # target ist das Index-Tupel der Blöcke in levels, prediction_mode und reconstructed sowie in dc_coefficients (falls gegeben, Form (frames, num_blocks_h, num_blocks_w)) für die DC-Koeffizienten
+
+    levels[target] = 0
+    prediction_mode[target] = mode
+    if not dc_only:
+        reconstructed[target] = prediction
+        return
+
+    # mittlere Differenz zur Prädiktion als DC-Koeffizient der orthonormalen DCT: sum(r) / block_size, bei der Integer-DCT mit deren Skalierung
+    block_size = blocks.shape[-1]
+    dc = (blocks.sum(axis=(-2, -1), dtype=np.int64) - prediction.sum(axis=(-2, -1), dtype=np.int64)) / block_size
+    if transform == "integer":
+        dc = np.rint(dc * integer_coefficient_scale(block_size, bit_depth))
+        level = quantize_integer_dc(dc, qp, block_size, channel, bit_depth)
+        residual = integer_idct_dc(dequantize_integer_dc(level, qp, block_size, channel, bit_depth), block_size, bit_depth)
+    else:
+        level = quantize_dc(dc, qp, block_size, channel)
+        residual = idct_dc(dequantize_dc(level, qp, block_size, channel), block_size)
+
+    levels[target + (0, 0)] = level
+    if dc_coefficients is not None:
+        dc_coefficients[target] = dc
+
+    reconstructed[target] = reconstruct_blocks(prediction, residual[:, None, None], bit_depth)
+
+
+@instrument("mode_decision")
+def mode_decision(blocks, candidates, out=None):
+
+    # Berechnet das Residuum aller übergebenen Blöcke für jede Prädiktion (horizontal, vertikal, diagonal und in P-Frames bewegungskompensiert)
+    # und wählt pro Block den Modus mit der kleinsten Summe der absoluten Differenzen (SAD). out ist ein optionales int16-Array mit der Form von candidates für die Residuen.
+    # Rückgabe: residue (int16, gleiche Form wie blocks), prediction_mode (uint8, Form von blocks ohne die letzten beiden Achsen) und die gewählte Prädiktion
+
+    residues = np.subtract(blocks, candidates, out=out, dtype=np.int16, casting="unsafe")
+
+    # kleinster prediction error pro Block, bei Gleichstand gewinnt der kleinere Modus
+    prediction_mode = np.argmin(sad(residues), axis=0).astype(np.uint8)
+    residue = select_mode(residues, prediction_mode)
+
+    return residue, prediction_mode, select_mode(candidates, prediction_mode)
@@ -0,0 +1,251 @@
+# This file contains the entropy coding of the quantized coefficients.
+#
+# The coefficients of every block are scanned in zig-zag order and run-length coded. The blocks of a channel are coded as
+#   the number of non-zero coefficients of every block, followed by run, mapped level for every non-zero coefficient of every block
+# where run is the number of zeros in front of the coefficient. The symbols are written with the unsigned Exp-Golomb code (see write_ue).
+# In P-frames the prediction errors of the motion vectors are written with the signed Exp-Golomb code (see map_signed).
+# Scanning, symbol generation and parsing are vectorized over all blocks of a frame, code lengths are looked up in a precomputed table.
+import numpy as np
+from functools import lru_cache
+from bitstream_io import BitWriter, BitReader
+
+
+UE_TABLE_SIZE = 1 << 16
+MODE_BITS = 2
+
+
+@lru_cache(maxsize=None)
+def zigzag_order(block_size):
+    '''
+        Computes the zig-zag scan order of a block. The result is computed once per block size and cached afterwards
+
+        Parameters:
+            block_size (int): Size of the quadratic blocks
+
+        Returns:
+            order (numpy array): Read-only array with block_size**2 indices into the flattened block, ordered by the zig-zag scan
+    '''
+    i, j = np.meshgrid(np.arange(block_size), np.arange(block_size), indexing="ij")
+    diagonal = i + j
+    # on even anti-diagonals the scan runs from bottom left to top right, on odd ones from top right to bottom left
+    secondary = np.where(diagonal % 2 == 0, j, i)
+    order = np.lexsort((secondary.ravel(), diagonal.ravel()))
+
+    order.flags.writeable = False
+    return order
+
+
+@lru_cache(maxsize=None)
+def __ue_length_table__():
+    '''
+        Lookup table with the length of the Exp-Golomb codeword of every value below UE_TABLE_SIZE
+    '''
+    table = (2 * np.floor(np.log2(np.arange(1, UE_TABLE_SIZE + 1))) + 1).astype(np.int64)
+    table.flags.writeable = False
+    return table
+
+
+def ue_lengths(values):
+    '''
+        Returns the length of the unsigned Exp-Golomb codewords of the given values
+    '''
+    if values.size == 0 or values.max() < UE_TABLE_SIZE:
+        return __ue_length_table__()[values]
+    return 2 * (np.frexp((values + 1).astype(np.float64))[1] - 1) + 1
+
+
+def write_ue(writer, values):
+    '''
+        Writes an array of non-negative integers with the unsigned Exp-Golomb code. The codewords are split into two sections so that they can be parsed without walking over them one by one:
+        first the number of values (as a single Exp-Golomb codeword), then the prefixes of all codewords (z zeros followed by a one) and then the suffixes (the z bits below the leading one of value + 1).
+        The total number of bits is the same as for plain concatenated Exp-Golomb codewords
+    '''
+    values = np.asarray(values, dtype=np.int64).ravel()
+    lengths = ue_lengths(values)
+    suffix_lengths = lengths // 2
+
+    writer.write(len(values) + 1, ue_lengths(np.array([len(values)])))
+    writer.write(np.ones(len(values), dtype=np.uint64), suffix_lengths + 1)
+    writer.write(values + 1 - (np.int64(1) << suffix_lengths), suffix_lengths)
+
+
+def read_ue(reader):
+    '''
+        Reads an array of values written by write_ue from a BitReader
+
+        Returns:
+            values (numpy array): int64 array with the decoded values
+    '''
+    bits = reader.bits
+
+    # number of values, a single Exp-Golomb codeword
+    leading_zeros = int(reader.next_ones(1)[0]) - reader.position
+    count = reader.read(2 * leading_zeros + 1) - 1
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # the prefixes are a sequence of unary codes, the positions of the first count ones give the suffix length of every codeword
+    ones = reader.next_ones(count)
+    suffix_lengths = np.diff(ones, prepend=reader.position - 1) - 1
+    reader.position = int(ones[-1]) + 1
+
+    # the suffixes follow each other directly: every suffix bit is shifted to its place in its codeword and the codewords are summed up segment by segment
+    values = np.int64(1) << suffix_lengths
+    total = int(suffix_lengths.sum())
+    if total > 0:
+        ends = np.cumsum(suffix_lengths)
+        shifts = np.repeat(ends - 1, suffix_lengths) - np.arange(total)
+        suffixes = bits[reader.position:reader.position + total].astype(np.int64) << shifts
+        coded = suffix_lengths > 0
+        values[coded] += np.add.reduceat(suffixes, (ends - suffix_lengths)[coded])
+        reader.position += total
+
+    return values - 1
+
+
+def map_levels(levels):
+    '''
+        Maps non-zero signed levels to non-negative integers: 1 -> 0, -1 -> 1, 2 -> 2, -2 -> 3, ...
+    '''
+    return 2 * (np.abs(levels) - 1) + (levels < 0)
+
+
+def unmap_levels(mapped):
+    '''
+        Inverse of map_levels
+    '''
+    return (mapped // 2 + 1) * (1 - 2 * (mapped & 1))
+
+
+def map_signed(values):
+    '''
+        Maps signed values to non-negative integers like the signed Exp-Golomb code: 0 -> 0, 1 -> 1, -1 -> 2, 2 -> 3, -2 -> 4, ...
+    '''
+    return 2 * np.abs(values) - (values > 0)
+
+
+def unmap_signed(mapped):
+    '''
+        Inverse of map_signed
+    '''
+    return (mapped + 1) // 2 * (1 - 2 * (1 - (mapped & 1)))
+
+
+def run_length_symbols(levels):
+    '''
+        Computes the symbols of the run-length coding for all blocks at once
+
+        Parameters:
+            levels (numpy array): Quantized coefficients with shape (..., block_size, block_size)
+
+        Returns:
+            symbols (numpy array): int64 array with the symbols of all blocks in coding order, i.e. the counts of all blocks followed by run, level, run, level, ... for every block
+    '''
+    block_size = levels.shape[-1]
+    scanned = levels.reshape(-1, block_size * block_size)[:, zigzag_order(block_size)]
+
+    counts = np.count_nonzero(scanned, axis=1)
+    rows, columns = np.nonzero(scanned)
+
+    # run = number of zeros between the previous non-zero coefficient of the same block (or the block start) and this coefficient
+    previous = np.empty_like(columns)
+    previous[1:] = columns[:-1]
+    first_in_block = np.ones(len(rows), dtype=bool)
+    first_in_block[1:] = rows[1:] != rows[:-1]
+    previous[first_in_block] = -1
+    runs = columns - previous - 1
+
+    # The counts of all blocks come first, followed by the interleaved (run, level) pairs of all blocks in block order
+    symbols = np.empty(len(counts) + 2 * len(rows), dtype=np.int64)
+    symbols[:len(counts)] = counts
+    symbols[len(counts)::2] = runs
+    symbols[len(counts) + 1::2] = map_levels(scanned[rows, columns].astype(np.int64))
+
+    return symbols
+
+
+def read_coefficients(symbols, position, num_blocks, block_size, dtype=np.int16):
+    '''
+        Rebuilds the quantized coefficients of num_blocks blocks from the decoded symbols, inverse of run_length_symbols
+
+        Parameters:
+            symbols (numpy array): Decoded Exp-Golomb values, see read_ue
+            position (int): Index of the first symbol of the blocks
+            num_blocks (int): Number of blocks to decode
+            block_size (int): Size of the quadratic blocks
+            dtype (numpy dtype): Type of the returned coefficients
+
+        Returns:
+            levels (numpy array): Coefficients with shape (num_blocks, block_size, block_size)
+            position (int): Index of the first symbol after the decoded blocks
+    '''
+    counts = symbols[position:position + num_blocks]
+    position += num_blocks
+
+    pairs = symbols[position:position + 2 * int(counts.sum())]
+    position += len(pairs)
+
+    return levels_from_symbols(counts, pairs, block_size, dtype), position
+
+
+def levels_from_symbols(counts, pairs, block_size, dtype=np.int16):
+    '''
+        Rebuilds the coefficient blocks from the counts and the interleaved (run, level) pairs of all blocks
+    '''
+    num_blocks = len(counts)
+    runs = pairs[0::2]
+    levels = unmap_levels(pairs[1::2])
+
+    # the position of a coefficient in the scan is the cumulative sum of run + 1 within its block
+    rows = np.repeat(np.arange(num_blocks), counts)
+    cumulative = np.cumsum(runs + 1)
+    block_start = np.cumsum(counts) - counts
+    block_offset = np.concatenate([[0], cumulative])[block_start]
+    positions = cumulative - 1 - np.repeat(block_offset, counts)
+
+    scanned = np.zeros((num_blocks, block_size * block_size), dtype=dtype)
+    scanned[rows, positions] = levels
+
+    blocks = np.empty_like(scanned)
+    blocks[:, zigzag_order(block_size)] = scanned
+    return blocks.reshape(num_blocks, block_size, block_size)
+
+
+class VLCWriter:
+    '''
+        Syntax writer of the variable length coding mode. Prediction modes (including MODE_INTER) are written with MODE_BITS bits, coefficients are run-length coded and written with the Exp-Golomb code
+    '''
+
+    def __init__(self):
+        self.writer = BitWriter()
+
+    def write_modes(self, modes, channel, inter=False):
+        self.writer.write(np.asarray(modes).ravel(), MODE_BITS)
+
+    def write_vectors(self, differences):
+        write_ue(self.writer, map_signed(np.asarray(differences, dtype=np.int64)))
+
+    def write_levels(self, levels, channel):
+        write_ue(self.writer, run_length_symbols(levels))
+
+    def getvalue(self):
+        return self.writer.getvalue()
+
+
+class VLCReader:
+    '''
+        Syntax reader of the variable length coding mode, inverse of VLCWriter
+    '''
+
+    def __init__(self, data):
+        self.reader = BitReader(data)
+
+    def read_modes(self, count, channel, inter=False):
+        return self.reader.read_array(count, MODE_BITS).astype(np.uint8)
+
+    def read_vectors(self, count):
+        return unmap_signed(read_ue(self.reader)).astype(np.int16).reshape(count, 2)
+
+    def read_levels(self, num_blocks, block_size, channel, dtype=np.int16):
+        levels, _ = read_coefficients(read_ue(self.reader), 0, num_blocks, block_size, dtype)
+        return levels
@@ -0,0 +1,171 @@
+# This file contains the quality metrics of decoded YUV-videos: PSNR (per channel, over all channels and weighted 6:1:1) and SSIM.
+#
+# The channels are upcast once per chunk of frames and the squared errors of every frame are summed in a single reduction per channel,
+# the PSNR of all channels is derived from these sums. VideoMetrics accumulates the per-frame values chunk by chunk, so the metrics can be
+# computed inside a streaming pipeline without holding the videos in memory.
+import numpy as np
+from telemetry import instrument
+
+
+CHANNEL_WEIGHTS = {"Y": 6, "U": 1, "V": 1}  # weights of the weighted YUV PSNR
+SSIM_WINDOW = 7
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+
+
+def peak_value(bit_depth):
+    '''
+        Returns the largest pixel value of the bit depth, 255 for 8 bit and 1023 for 10 bit videos
+    '''
+    return (1 << bit_depth) - 1
+
+
+def bit_depth_of(channel):
+    '''
+        Infers the bit depth from the data type of a channel, uint8 for 8 bit and uint16 for 10 bit videos
+    '''
+    return 8 if channel.dtype == np.uint8 else 10
+
+
+def squared_error_sums(vid1, vid2):
+    '''
+        Computes the sum of squared errors of every frame and channel
+
+        Parameters:
+            vid1, vid2 (dict): YUV-videos with the keys "Y", "U" and "V" and shapes (frames, height, width) or (height, width) for a single frame
+
+        Returns:
+            sums (dict): float64 array with the sum of squared errors of every frame for every channel
+            pixels (dict): Number of pixels per frame of every channel
+    '''
+    sums = {}
+    pixels = {}
+    for c in ["Y", "U", "V"]:
+        # upcast before subtracting, a difference of unsigned integers would wrap around
+        difference = np.subtract(vid1[c], vid2[c], dtype=np.int32)
+        difference = difference.reshape(-1, difference.shape[-2] * difference.shape[-1])
+        sums[c] = np.einsum("fp,fp->f", difference, difference, dtype=np.float64)
+        pixels[c] = difference.shape[1]
+    return sums, pixels
+
+
+def psnr(mse, bit_depth):
+    '''
+        Converts mean squared errors into PSNR values, the PSNR of a zero MSE is inf
+    '''
+    with np.errstate(divide="ignore"):
+        return 10 * np.log10(peak_value(bit_depth) ** 2 / np.asarray(mse, dtype=np.float64))
+
+
+@instrument("psnr")
+def psnr_per_frame(vid1, vid2, bit_depth=0):
+    '''
+        Calculates the PSNR of every frame of two YUV-videos
+
+        Parameters:
+            vid1, vid2 (dict): YUV-videos with the keys "Y", "U" and "V"
+            bit_depth (int): Bit depth of the videos, inferred from the data type if 0
+
+        Returns:
+            psnr (dict): Arrays with the PSNR of every frame. The keys are "Y", "U", "V", "YUV" (PSNR of the MSE over all pixels of all channels) and "YUV_weighted" (6:1:1 weighted average of the channel PSNRs)
+    '''
+    bit_depth = bit_depth or bit_depth_of(vid1["Y"])
+    sums, pixels = squared_error_sums(vid1, vid2)
+
+    result = {c: psnr(sums[c] / pixels[c], bit_depth) for c in ["Y", "U", "V"]}
+    result["YUV"] = psnr(sum(sums.values()) / sum(pixels.values()), bit_depth)
+    result["YUV_weighted"] = sum(CHANNEL_WEIGHTS[c] * result[c] for c in CHANNEL_WEIGHTS) / sum(CHANNEL_WEIGHTS.values())
+    return result
+
+
+@instrument("ssim")
+def ssim_per_frame(channel1, channel2, bit_depth=0):
+    '''
+        Calculates the SSIM of every frame of a channel. The local means, variances and the covariance are computed with a SSIM_WINDOW x SSIM_WINDOW box filter
+        on integral images, vectorized over all frames
+
+        Parameters:
+            channel1, channel2 (numpy array): Channels with shape (frames, height, width)
+            bit_depth (int): Bit depth of the channels, inferred from the data type if 0
+
+        Returns:
+            ssim (numpy array): SSIM of every frame
+    '''
+    bit_depth = bit_depth or bit_depth_of(channel1)
+    c1 = (SSIM_K1 * peak_value(bit_depth)) ** 2
+    c2 = (SSIM_K2 * peak_value(bit_depth)) ** 2
+
+    x = channel1.reshape((-1,) + channel1.shape[-2:]).astype(np.float64)
+    y = channel2.reshape((-1,) + channel2.shape[-2:]).astype(np.float64)
+    window = min(SSIM_WINDOW, x.shape[1], x.shape[2])
+
+    mean_x = __box_filter__(x, window)
+    mean_y = __box_filter__(y, window)
+    # unbiased estimates of the local (co)variances
+    correction = window * window / (window * window - 1) if window > 1 else 1
+    variance_x = (__box_filter__(x * x, window) - mean_x * mean_x) * correction
+    variance_y = (__box_filter__(y * y, window) - mean_y * mean_y) * correction
+    covariance = (__box_filter__(x * y, window) - mean_x * mean_y) * correction
+
+    ssim_map = ((2 * mean_x * mean_y + c1) * (2 * covariance + c2)) / ((mean_x * mean_x + mean_y * mean_y + c1) * (variance_x + variance_y + c2))
+    return ssim_map.mean(axis=(1, 2))
+
+
+def __box_filter__(frames, window):
+    '''
+        Mean of every window x window window (valid positions only) of every frame, computed with an integral image
+    '''
+    integral = np.zeros((frames.shape[0], frames.shape[1] + 1, frames.shape[2] + 1))
+    np.cumsum(np.cumsum(frames, axis=1), axis=2, out=integral[:, 1:, 1:])
+    sums = integral[:, window:, window:] - integral[:, :-window, window:] - integral[:, window:, :-window] + integral[:, :-window, :-window]
+    return sums / (window * window)
+
+
+class VideoMetrics:
+    '''
+        Accumulates the quality metrics of a YUV-video chunk by chunk, e.g. inside a streaming encode/decode pipeline
+
+        Usage:
+            metrics = VideoMetrics(ssim=True)
+            for original_chunk, decoded_chunk in chunks:
+                metrics.update(original_chunk, decoded_chunk)
+            average = metrics.result()
+            per_frame = metrics.per_frame()
+    '''
+
+    def __init__(self, bit_depth=0, ssim=False):
+        '''
+            Parameters:
+                bit_depth (int): Bit depth of the videos, inferred from the data type of the first chunk if 0
+                ssim (bool): Calculate the SSIM of every channel in addition to the PSNR
+        '''
+        self.bit_depth = bit_depth
+        self.ssim = ssim
+        self.chunks = []
+
+    def update(self, vid1, vid2):
+        '''
+            Adds one frame or a chunk of frames of two corresponding YUV-videos
+        '''
+        bit_depth = self.bit_depth or bit_depth_of(vid1["Y"])
+        chunk = psnr_per_frame(vid1, vid2, bit_depth)
+        if self.ssim:
+            for c in ["Y", "U", "V"]:
+                chunk["SSIM_" + c] = ssim_per_frame(vid1[c], vid2[c], bit_depth)
+        self.chunks.append(chunk)
+
+    def per_frame(self):
+        '''
+            Returns:
+                metrics (dict): Arrays with the value of every frame added so far. The keys are "Y", "U", "V", "YUV", "YUV_weighted" (PSNR, see psnr_per_frame) and with ssim=True "SSIM_Y", "SSIM_U" and "SSIM_V"
+        '''
+        if not self.chunks:
+            return {}
+        return {key: np.concatenate([chunk[key] for chunk in self.chunks]) for key in self.chunks[0]}
+
+    def result(self):
+        '''
+            Returns:
+                metrics (dict): Average of every metric over all frames added so far, with the keys of per_frame
+        '''
+        return {key: float(values.mean()) for key, values in self.per_frame().items()}
@@ -0,0 +1,207 @@
+# This file contains the motion estimation and motion compensation of the inter prediction (P-frames).
+#
+# Every luma block gets one motion vector (dy, dx) with integer precision, which points into the previous reconstructed frame. The chroma
+# blocks use the vector of the co-located luma block, scaled by the subsampling. The reference frame is padded by edge replication, so
+# vectors may point up to SEARCH_RANGE pixels outside of the frame.
+# The motion search is a diamond search that runs for all blocks of a frame at once: every step gathers the candidate blocks of all
+# pattern points of all blocks from a sliding window view of the reference and computes their SAD in one batch.
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from telemetry import instrument
+
+
+SEARCH_RANGE = 16
+MAX_DIAMOND_STEPS = 8  # the large diamond moves the centre by up to 2 pixels per step
+LARGE_DIAMOND = np.array([[-2, 0], [-1, -1], [-1, 1], [0, -2], [0, 2], [1, -1], [1, 1], [2, 0]])
+SMALL_DIAMOND = np.array([[-1, 0], [0, -1], [0, 1], [1, 0]])
+
+
+def reference_windows(reference, block_size):
+    '''
+        Pads the reference frame by edge replication and returns a view of all block_size x block_size windows of the padded frame, without copying them
+
+        Parameters:
+            reference (numpy array): Reconstructed channel of the previous frame with shape (height, width)
+            block_size (int): Size of the quadratic blocks
+
+        Returns:
+            windows (numpy array): View with shape (padded_height - block_size + 1, padded_width - block_size + 1, block_size, block_size), windows[y + SEARCH_RANGE, x + SEARCH_RANGE] is the block with the top left pixel (y, x) of the frame
+    '''
+    height, width = reference.shape
+    pad_h = -height % block_size + SEARCH_RANGE
+    pad_w = -width % block_size + SEARCH_RANGE
+
+    padded = np.pad(reference, ((SEARCH_RANGE, pad_h), (SEARCH_RANGE, pad_w)), mode="edge")
+    return sliding_window_view(padded, (block_size, block_size))
+
+
+@instrument("motion_compensation")
+def motion_compensation(reference, vectors, block_size):
+    '''
+        Predicts every block of a frame from the block of the reference frame that its motion vector points to. The encoder and the decoder use this function, so that their predictions are identical
+
+        Parameters:
+            reference (numpy array): Reconstructed channel of the previous frame with shape (height, width)
+            vectors (numpy array): Motion vector (dy, dx) of every block with shape (num_blocks_h, num_blocks_w, 2)
+            block_size (int): Size of the quadratic blocks
+
+        Returns:
+            prediction (numpy array): Predicted blocks with shape (num_blocks_h, num_blocks_w, block_size, block_size)
+    '''
+    num_blocks_h, num_blocks_w, _ = vectors.shape
+    windows = reference_windows(reference, block_size)
+
+    rows = (np.arange(num_blocks_h) * block_size)[:, None] + vectors[..., 0] + SEARCH_RANGE
+    columns = (np.arange(num_blocks_w) * block_size)[None, :] + vectors[..., 1] + SEARCH_RANGE
+    return windows[rows, columns]
+
+
+def channel_vectors(vectors, num_blocks_h, num_blocks_w, block_size, block_size_luma, subsampling_factors):
+    '''
+        Derives the motion vectors of the blocks of a chroma channel from the vectors of the co-located luma blocks
+
+        Parameters:
+            vectors (numpy array): Luma motion vectors with shape (luma_blocks_h, luma_blocks_w, 2)
+            num_blocks_h, num_blocks_w (int): Number of blocks of the chroma channel
+            block_size (int): Block size of the chroma channel
+            block_size_luma (int): Block size of the luma channel
+            subsampling_factors (tuple): Horizontal and vertical subsampling factors (h_sub, v_sub) of the chroma channel
+
+        Returns:
+            vectors (numpy array): Chroma motion vectors with shape (num_blocks_h, num_blocks_w, 2)
+    '''
+    h_sub, v_sub = subsampling_factors
+
+    # luma block that contains the top left pixel of every chroma block
+    rows = np.minimum(np.arange(num_blocks_h) * block_size * v_sub // block_size_luma, vectors.shape[0] - 1)
+    columns = np.minimum(np.arange(num_blocks_w) * block_size * h_sub // block_size_luma, vectors.shape[1] - 1)
+
+    co_located = vectors[rows[:, None], columns[None, :]]
+    return np.stack([co_located[..., 0] // v_sub, co_located[..., 1] // h_sub], axis=-1)
+
+
+@instrument("motion_estimation")
+def motion_search(blocks, reference, seed=None):
+    '''
+        Estimates the motion vector of every block of a frame with a diamond search. The search starts at the best of the zero vector and the seed vector of the block,
+        moves with the large diamond pattern until the centre is the best point and finishes with one step of the small diamond. Afterwards the vectors of the four
+        neighbouring blocks are tested as further start points and blocks that improve are refined again. All steps are computed for all blocks at once
+
+        Parameters:
+            blocks (numpy array): Blocks of the current frame with shape (num_blocks_h, num_blocks_w, block_size, block_size)
+            reference (numpy array): Reconstructed channel of the previous frame with shape (height, width)
+            seed (numpy array): Optional start vectors with shape (num_blocks_h, num_blocks_w, 2), e.g. the vectors of the previous frame
+
+        Returns:
+            vectors (numpy array): int16 motion vectors with shape (num_blocks_h, num_blocks_w, 2)
+            search_points (numpy array): Number of evaluated candidate blocks of every block with shape (num_blocks_h, num_blocks_w)
+    '''
+    num_blocks_h, num_blocks_w, block_size, _ = blocks.shape
+    num_blocks = num_blocks_h * num_blocks_w
+
+    search = {
+        "blocks": blocks.reshape(num_blocks, block_size, block_size).astype(np.int32),
+        "windows": reference_windows(reference, block_size),
+        "origins": np.stack(np.meshgrid(np.arange(num_blocks_h), np.arange(num_blocks_w), indexing="ij"), axis=-1).reshape(num_blocks, 2) * block_size + SEARCH_RANGE,
+        "vectors": np.zeros((num_blocks, 2), dtype=np.int64),
+        "costs": np.full(num_blocks, np.iinfo(np.int64).max),
+        "points": np.zeros(num_blocks, dtype=np.int64),
+        "scratch": np.empty((num_blocks, block_size, block_size), dtype=np.int32),  # differences of the candidate blocks, see block_sad
+    }
+    all_blocks = np.arange(num_blocks)
+
+    start = np.zeros((num_blocks, 1, 2), dtype=np.int64)
+    if seed is not None:
+        start = np.concatenate([start, seed.reshape(num_blocks, 1, 2)], axis=1)
+    __search_step__(search, all_blocks, start)
+    __diamond_search__(search, all_blocks)
+
+    # the vectors of the neighbours (left, top, right, bottom) as start points, e.g. for blocks that got stuck in a local minimum
+    field = np.pad(search["vectors"].reshape(num_blocks_h, num_blocks_w, 2), ((1, 1), (1, 1), (0, 0)), mode="edge")
+    neighbours = np.stack([field[1:-1, :-2], field[:-2, 1:-1], field[1:-1, 2:], field[2:, 1:-1]], axis=2).reshape(num_blocks, 4, 2)
+    improved = __search_step__(search, all_blocks, neighbours)
+    __diamond_search__(search, all_blocks[improved])
+
+    vectors = search["vectors"].reshape(num_blocks_h, num_blocks_w, 2).astype(np.int16)
+    return vectors, search["points"].reshape(num_blocks_h, num_blocks_w)
+
+
+def block_sad(blocks, windows, origins, candidates, scratch=None):
+    '''
+        Computes the SAD between every block and its candidate blocks of the reference frame. The candidates are evaluated one after another for all blocks at once,
+        so only one difference per block is held in memory instead of one per candidate
+
+        Parameters:
+            blocks (numpy array): Blocks with shape (num_blocks, block_size, block_size)
+            windows (numpy array): Windows of the reference frame, see reference_windows
+            origins (numpy array): Position of every block in windows for the zero vector with shape (num_blocks, 2)
+            candidates (numpy array): Candidate vectors with shape (num_blocks, num_candidates, 2)
+            scratch (numpy array): Optional buffer for the differences with at least the size of blocks and their data type
+
+        Returns:
+            sad (numpy array): SAD of every candidate with shape (num_blocks, num_candidates)
+    '''
+    if scratch is None:
+        scratch = np.empty(blocks.shape, dtype=blocks.dtype)
+    difference = scratch.reshape(-1)[:blocks.size].reshape(blocks.shape)
+
+    positions = origins[:, None, :] + candidates
+    sad = np.empty(candidates.shape[:2], dtype=np.int64)
+    for k in range(candidates.shape[1]):
+        np.subtract(windows[positions[:, k, 0], positions[:, k, 1]], blocks, out=difference)
+        np.abs(difference, out=difference)
+        difference.sum(axis=(-2, -1), out=sad[:, k])
+    return sad
+
+
+def __diamond_search__(search, index):
+    '''
+        Moves the vectors of the given blocks with the large diamond until the centre is the best point, followed by one step of the small diamond
+    '''
+    active = index
+    for _ in range(MAX_DIAMOND_STEPS):
+        if len(active) == 0:
+            break
+        candidates = search["vectors"][active, None, :] + LARGE_DIAMOND
+        active = active[__search_step__(search, active, candidates)]
+
+    if len(index) > 0:
+        __search_step__(search, index, search["vectors"][index, None, :] + SMALL_DIAMOND)
+
+
+def __search_step__(search, index, candidates):
+    '''
+        Evaluates the candidate vectors of the given blocks and moves every block to its best candidate if that is better than its current vector
+
+        Returns:
+            improved (numpy array): Boolean array, True for the blocks whose vector changed
+    '''
+    candidates = np.clip(candidates, -SEARCH_RANGE, SEARCH_RANGE)
+    costs = block_sad(search["blocks"][index], search["windows"], search["origins"][index], candidates, search["scratch"])
+    search["points"][index] += candidates.shape[1]
+
+    best = np.argmin(costs, axis=1)
+    best_costs = costs[np.arange(len(index)), best]
+    improved = best_costs < search["costs"][index]
+
+    search["vectors"][index[improved]] = candidates[improved, best[improved]]
+    search["costs"][index[improved]] = best_costs[improved]
+    return improved
+
+
+def vector_differences(vectors):
+    '''
+        Predicts every motion vector from its left neighbour (the vectors of the first column from the block above) and returns the prediction errors, which are written to the bitstream
+    '''
+    differences = np.diff(vectors, axis=1, prepend=0)
+    differences[:, 0] = np.diff(vectors[:, 0], axis=0, prepend=0)
+    return differences
+
+
+def vectors_from_differences(differences):
+    '''
+        Inverse of vector_differences
+    '''
+    vectors = differences.copy()
+    vectors[:, 0] = np.cumsum(differences[:, 0], axis=0)
+    return np.cumsum(vectors, axis=1, dtype=differences.dtype)
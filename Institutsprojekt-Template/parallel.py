@@ -0,0 +1,56 @@
+# This file contains helpers to share a YUV-video with worker processes without pickling copies of the frames.
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SharedVideo:
+    '''
+        Copies a YUV-video once into shared memory. Worker processes attach to it with attach_shared_video(shared_video.spec) and get numpy arrays backed by the same memory, so only the small spec is pickled per job.
+
+        Usage:
+            with SharedVideo(video) as shared_video:
+                pool.submit(work, shared_video.spec, ...)
+    '''
+
+    def __init__(self, video):
+        nbytes = sum(video[c].nbytes for c in ["Y", "U", "V"])
+        self.shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self.spec = {"name": self.shm.name, "channels": {}}
+
+        offset = 0
+        for c in ["Y", "U", "V"]:
+            channel = np.ndarray(video[c].shape, dtype=video[c].dtype, buffer=self.shm.buf, offset=offset)
+            channel[...] = video[c]
+            self.spec["channels"][c] = (video[c].shape, video[c].dtype.str, offset)
+            offset += video[c].nbytes
+            del channel  # the shared memory can only be closed if no array references its buffer anymore
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def attach_shared_video(spec):
+    '''
+        Attaches to a video shared by SharedVideo
+
+        Parameters:
+            spec (dict): The spec attribute of the SharedVideo
+
+        Returns:
+            shm (SharedMemory): The attached shared memory, it has to be closed by the caller once the video is not used anymore
+            video (dict): YUV-Video given as dict of numpy arrays with the keys "Y", "U" and "V" backed by the shared memory
+    '''
+    shm = shared_memory.SharedMemory(name=spec["name"])
+
+    video = {}
+    for c, (shape, dtype, offset) in spec["channels"].items():
+        video[c] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+
+    return shm, video
@@ -0,0 +1,203 @@
+# This file contains the intra predictors. All predictors work on whole tensors of blocks at once, the prediction of every block is broadcast from its neighbouring edge pixels.
+import numpy as np
+from functools import lru_cache
+from telemetry import instrument
+
+
+MODE_HORIZONTAL = 0
+MODE_VERTICAL = 1
+MODE_DIAGONAL = 2
+INTRA_MODES = [MODE_HORIZONTAL, MODE_VERTICAL, MODE_DIAGONAL]
+MODE_INTER = len(INTRA_MODES)  # motion compensated prediction in P-frames, see motion
+
+
+def default_pel_value(bit_depth):
+    '''
+        Returns the value used for neighbouring pixels that are not available, i.e. outside of the frame. This is the middle of the value range, 128 for 8 bit and 512 for 10 bit videos
+    '''
+    return 1 << (bit_depth - 1)
+
+
+@lru_cache(maxsize=None)
+def wavefront_order(num_blocks_h, num_blocks_w):
+    '''
+        Groups the blocks of a frame into anti-diagonals. A block is predicted from its top, left and top left neighbour, which all lie on earlier anti-diagonals, so all blocks of one anti-diagonal can be predicted and reconstructed at once
+
+        Parameters:
+            num_blocks_h (int): Number of block rows
+            num_blocks_w (int): Number of block columns
+
+        Returns:
+            diagonals (list): List of tuples (rows, columns) with the block indices of every anti-diagonal in coding order
+    '''
+    diagonals = []
+    for d in range(num_blocks_h + num_blocks_w - 1):
+        rows = np.arange(max(0, d - num_blocks_w + 1), min(d, num_blocks_h - 1) + 1)
+        diagonals.append((rows, d - rows))
+    return diagonals
+
+
+def neighbour_edges(reconstructed, rows, columns, default):
+    '''
+        Extracts the neighbouring edge pixels of the given blocks from the already reconstructed blocks: the last row of the block above, the last column of the block to the left and the last pixel of the block above left. Neighbours outside of the frame are set to the default value
+
+        Parameters:
+            reconstructed (numpy array): Reconstructed blocks of a channel with shape (frames, num_blocks_h, num_blocks_w, block_size, block_size)
+            rows, columns (numpy arrays): Indices of the blocks, e.g. one anti-diagonal of wavefront_order
+            default (int): Value for unavailable neighbours, see default_pel_value
+
+        Returns:
+            edges (tuple): Tuple (top, left, top_left) with shapes (frames, len(rows), block_size) for top and left and (frames, len(rows)) for top_left
+    '''
+    frames, _, _, block_size, _ = reconstructed.shape
+
+    top = np.full((frames, len(rows), block_size), default, dtype=reconstructed.dtype)
+    left = np.full((frames, len(rows), block_size), default, dtype=reconstructed.dtype)
+    top_left = np.full((frames, len(rows)), default, dtype=reconstructed.dtype)
+
+    has_top = rows > 0
+    has_left = columns > 0
+    has_top_left = has_top & has_left
+    # select the edge rows and columns first (views), so only the edge pixels are gathered
+    top[:, has_top] = reconstructed[:, :, :, -1, :][:, rows[has_top] - 1, columns[has_top]]
+    left[:, has_left] = reconstructed[:, :, :, :, -1][:, rows[has_left], columns[has_left] - 1]
+    top_left[:, has_top_left] = reconstructed[:, :, :, -1, -1][:, rows[has_top_left] - 1, columns[has_top_left] - 1]
+
+    return top, left, top_left
+
+
+def reconstruct_blocks(prediction, residual, bit_depth, out=None):
+    '''
+        Adds the decoded residual to the prediction and clips the result to the value range of the bit depth. The encoder and the decoder use this function, so that their reconstructions are identical.
+        Without out the result has the data type of prediction, with an int16 out array (which may be residual itself) the clipped result is written to out and no array is allocated
+    '''
+    if out is None:
+        reconstructed = prediction.astype(np.int16) + residual
+        np.clip(reconstructed, 0, (1 << bit_depth) - 1, out=reconstructed)
+        return reconstructed.astype(prediction.dtype)
+
+    np.add(residual, prediction, out=out, casting="unsafe")
+    np.clip(out, 0, (1 << bit_depth) - 1, out=out)
+    return out
+
+
+def vertical_intra_prediction(top, out=None):
+    '''
+        Predicts every column of a block from the pixel above it. top has shape (..., block_size), the prediction has shape (..., block_size, block_size)
+    '''
+    block_size = top.shape[-1]
+    prediction = np.broadcast_to(top[..., None, :], top.shape + (block_size,))
+    return __write_output__(prediction, out)
+
+
+def horizontal_intra_prediction(left, out=None):
+    '''
+        Predicts every row of a block from the pixel left of it. left has shape (..., block_size), the prediction has shape (..., block_size, block_size)
+    '''
+    block_size = left.shape[-1]
+    prediction = np.broadcast_to(left[..., :, None], left.shape + (block_size,))
+    return __write_output__(prediction, out)
+
+
+def diagonal_intra_prediction(top, left, top_left, out=None):
+    '''
+        Predicts a block along the diagonal from top left to bottom right. The main diagonal is predicted from the top left pixel, the pixels above it from the top row and the pixels below it from the left column
+    '''
+    block_size = top.shape[-1]
+
+    # edge = [left[N-2], ..., left[0], top_left, top[0], ..., top[N-2]], the pixel (i, j) is predicted from edge[j - i + N - 1]
+    edge = np.concatenate([left[..., -2::-1], top_left[..., None], top[..., :-1]], axis=-1)
+    prediction = edge[..., __diagonal_index__(block_size)]
+    return __write_output__(prediction, out)
+
+
+def intra_predictions(top, left, top_left, out=None):
+    '''
+        Computes the prediction of all intra modes for all blocks
+
+        Parameters:
+            top, left, top_left (numpy arrays): Neighbouring edge pixels, see neighbour_edges
+            out (numpy array): Optional output array with shape (len(INTRA_MODES), ..., block_size, block_size)
+
+        Returns:
+            predictions (numpy array): Predictions with shape (len(INTRA_MODES), ..., block_size, block_size), indexed by the mode
+    '''
+    block_size = top.shape[-1]
+    if out is None:
+        out = np.empty((len(INTRA_MODES),) + top.shape + (block_size,), dtype=top.dtype)
+
+    horizontal_intra_prediction(left, out=out[MODE_HORIZONTAL])
+    vertical_intra_prediction(top, out=out[MODE_VERTICAL])
+    diagonal_intra_prediction(top, left, top_left, out=out[MODE_DIAGONAL])
+
+    return out
+
+
+@instrument("prediction")
+def prediction_candidates(top, left, top_left, motion_prediction=None, out=None):
+    '''
+        Computes the predictions of all intra modes and, in P-frames, appends the motion compensated prediction as the candidate of MODE_INTER
+
+        Parameters:
+            top, left, top_left (numpy arrays): Neighbouring edge pixels, see neighbour_edges
+            motion_prediction (numpy array): Motion compensated prediction with shape (..., block_size, block_size), only in P-frames
+            out (numpy array): Optional output array with shape (number of modes, ..., block_size, block_size), e.g. from encoder workspace
+
+        Returns:
+            candidates (numpy array): Predictions with shape (number of modes, ..., block_size, block_size), indexed by the mode
+    '''
+    num_modes = len(INTRA_MODES) + (motion_prediction is not None)
+    if out is None:
+        out = np.empty((num_modes,) + top.shape + (top.shape[-1],), dtype=top.dtype)
+
+    intra_predictions(top, left, top_left, out=out[:len(INTRA_MODES)])
+    if motion_prediction is not None:
+        out[MODE_INTER] = motion_prediction
+    return out
+
+
+def intra_prediction_for_modes(modes, top, left, top_left, motion_prediction=None):
+    '''
+        Computes the prediction of every block for the given mode of that block, e.g. in the decoder
+
+        Parameters:
+            modes (numpy array): Prediction mode of every block with shape (...)
+            top, left, top_left (numpy arrays): Neighbouring edge pixels, see neighbour_edges
+            motion_prediction (numpy array): Motion compensated prediction with shape (..., block_size, block_size), only in P-frames
+
+        Returns:
+            prediction (numpy array): Prediction with shape (..., block_size, block_size)
+    '''
+    predictions = prediction_candidates(top, left, top_left, motion_prediction)
+    return select_mode(predictions, modes)
+
+
+def select_mode(candidates, modes):
+    '''
+        Selects the candidate of the given mode for every block, candidates has the shape (number of modes, ..., block_size, block_size) and modes the shape (...)
+    '''
+    return np.take_along_axis(candidates, modes[None, ..., None, None].astype(np.intp), axis=0)[0]
+
+
+def sad(residuals):
+    '''
+        Computes the sum of absolute differences of every block, the result has the shape of residuals without the last two axes
+    '''
+    return np.abs(residuals).sum(axis=(-2, -1), dtype=np.int32)
+
+
+@lru_cache(maxsize=None)
+def __diagonal_index__(block_size):
+    '''
+        Index matrix for the diagonal prediction, see diagonal_intra_prediction
+    '''
+    i = np.arange(block_size)[:, None]
+    j = np.arange(block_size)[None, :]
+    return j - i + block_size - 1
+
+
+def __write_output__(prediction, out):
+    if out is None:
+        return np.array(prediction)
+    out[...] = prediction
+    return out
@@ -1,6 +1,7 @@
 # This script provides function for calculating the psnr between two different YUV-Videos or images
 import numpy as np
 import warnings
+from metrics import psnr, psnr_per_frame, VideoMetrics
 
 
 def psnr_yuv(vid1, vid2):
@@ -33,25 +34,14 @@ def psnr_yuv_video(vid1, vid2):
         Returns:
             psnr (dict): PSNR between the two videos. The dictionary contains the keys "Y", "U", "V" and "YUV" for the PSNR of the luminance, chrominance and the overall psnr
     '''
-    psnr_dict = {"YUV": 0, "Y": 0, "U": 0, "V": 0}
-
     if not vid1["Y"].dtype == vid2["Y"].dtype:
         warnings.warn("input videos do not have the same bit depth", RuntimeWarning)
 
-    max_pel_value = 255 if vid1["Y"].dtype == np.uint8 and vid2["Y"].dtype == np.uint8 else 1020
-
-    for frame_count in range(vid1["Y"].shape[0]):
-        with warnings.catch_warnings():  # suppress divide by zero warnings as the default behaviore of setting the PSNR to inf in case of zero MSE is expected
-            warnings.filterwarnings("ignore", message="divide by zero encountered")
-            psnr_dict["YUV"] += 10 * np.log10(max_pel_value**2 / np.square(np.subtract(np.concatenate([np.ndarray.flatten(vid1["Y"][frame_count]), np.ndarray.flatten(vid1["U"][frame_count]), np.ndarray.flatten(vid1["V"][frame_count])]), np.concatenate([np.ndarray.flatten(vid2["Y"][frame_count]), np.ndarray.flatten(vid2["U"][frame_count]), np.ndarray.flatten(vid2["V"][frame_count])]))).mean())
-            psnr_dict["Y"] += 10 * np.log10(max_pel_value**2 / np.square(np.subtract(vid1["Y"][frame_count], vid2["Y"][frame_count])).mean())
-            psnr_dict["U"] += 10 * np.log10(max_pel_value**2 / np.square(np.subtract(vid1["U"][frame_count], vid2["U"][frame_count])).mean())
-            psnr_dict["V"] += 10 * np.log10(max_pel_value**2 / np.square(np.subtract(vid1["V"][frame_count], vid2["V"][frame_count])).mean())
+    bit_depth = 8 if vid1["Y"].dtype == np.uint8 and vid2["Y"].dtype == np.uint8 else 10
 
-    for key in psnr_dict:
-        psnr_dict[key] /= vid1["Y"].shape[0]  # Divide by the number of frames to get the average psnr
-    
-    return psnr_dict
+    # average of the PSNR of every frame, see metrics.psnr_per_frame
+    per_frame = psnr_per_frame(vid1, vid2, bit_depth)
+    return {key: per_frame[key].mean() for key in ["YUV", "Y", "U", "V"]}
 
 
 def psnr_image(img1, img2):
@@ -70,14 +60,34 @@ def psnr_image(img1, img2):
     if not img1.dtype == img2.dtype:
         warnings.warn("input images do not have the same bit depth", RuntimeWarning)
 
-    max_pel_value = 255 if img1.dtype == np.uint8 and img2.dtype == np.uint8 else 1020
+    bit_depth = 8 if img1.dtype == np.uint8 and img2.dtype == np.uint8 else 10
 
-    with warnings.catch_warnings():  # suppress divide by zero warnings as the default behaviore of setting the PSNR to inf in case of zero MSE is expected
-        warnings.filterwarnings("ignore", message="divide by zero encountered")
+    with warnings.catch_warnings():
         warnings.filterwarnings("error", message="mean of empty slice")
-        psnr_dict["YUV"] = 10 * np.log10(max_pel_value**2 / np.square(np.subtract(img1, img2)).mean())
+        difference = np.subtract(img1, img2, dtype=np.float64)  # upcast, a difference of unsigned integers would wrap around
+        psnr_dict["YUV"] = psnr(np.square(difference).mean(), bit_depth)
         psnr_dict["Y"] = psnr_dict["YUV"]
         psnr_dict["U"] = psnr_dict["YUV"]
         psnr_dict["V"] = psnr_dict["YUV"]
 
-    return psnr_dict
\ No newline at end of file
+    return psnr_dict
+
+class PSNRAccumulator(VideoMetrics):
+    '''
+        Accumulates the PSNR of a YUV-video chunk by chunk, e.g. inside a streaming encode/decode pipeline. The result is identical to calling psnr_yuv on the complete videos.
+        See metrics.VideoMetrics for the per-frame values, the weighted PSNR and the SSIM.
+
+        Usage:
+            accumulator = PSNRAccumulator()
+            for original_chunk, decoded_chunk in chunks:
+                accumulator.update(original_chunk, decoded_chunk)
+            psnr = accumulator.result()
+    '''
+
+    def result(self):
+        '''
+            Returns:
+                psnr (dict): Average PSNR over all frames added so far. The dictionary contains the keys "Y", "U", "V" and "YUV"
+        '''
+        average = super().result()
+        return {key: average[key] for key in ["YUV", "Y", "U", "V"]}
\ No newline at end of file
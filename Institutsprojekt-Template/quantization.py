@@ -0,0 +1,325 @@
+# This file contains the quantization and dequantization of the DCT coefficients.
+#
+# The quantization step size doubles every 6 QP (QP 4 corresponds to a step size of 1) and is weighted per coefficient with a
+# quantization matrix, which quantizes high frequencies coarser than low frequencies, and chroma coarser than luma.
+# For every QP, block size and channel type the step sizes and their reciprocals are computed once and cached, quantization is then
+# a multiplication with the reciprocal table for the whole coefficient tensor.
+# The coefficients of the integer transform (see transform.integer_dct_blocks) are dequantized with integer arithmetic like in HEVC: the step size
+# is LEVEL_SCALE[qp % 6] << (qp // 6) times the quantization matrix in 1/16 (see integer_scaling_tables), followed by a rounding right shift.
+import numpy as np
+from functools import lru_cache
+from transform import integer_coefficient_scale
+from telemetry import instrument
+
+
+MAX_QP = 51
+DEAD_ZONE_OFFSET = 1 / 3  # rounding offset of the quantization, values below 0.5 widen the zero bin (dead zone)
+MATRIX_SLOPE = {"luma": 0.75, "chroma": 1.0}  # relative increase of the step size from the DC to the highest frequency coefficient
+LEVEL_SCALE = (40, 45, 51, 57, 64, 72)  # 64 * 2^((k - 4) / 6) rounded, the integer step sizes of the QPs 0 to 5 (like HEVC)
+MATRIX_BITS = 4  # fractional bits of the integer quantization matrix, the weight of the DC coefficient is 16
+EXACT_FLOAT32 = 2 ** 23  # largest product of dequantize_integer that is computed in float32, see transform
+
+
+def step_size(qp):
+    '''
+        Returns the quantization step size of the DC coefficient for the given QP
+    '''
+    assert 0 <= qp <= MAX_QP, "QP has to be between 0 and " + str(MAX_QP)
+    return 2 ** ((qp - 4) / 6)
+
+
+@lru_cache(maxsize=None)
+def quantization_matrix(block_size, channel):
+    '''
+        Weighting of the step size for every coefficient of a block. The weight is 1 for the DC coefficient and grows linearly with the frequency (i + j) up to 1 + MATRIX_SLOPE for the highest frequency
+
+        Parameters:
+            block_size (int): Size of the quadratic blocks, e.g. 16 for luma and 8 for chroma
+            channel (String): "Y", "U" or "V"
+
+        Returns:
+            matrix (numpy array): Read-only float32 matrix with shape (block_size, block_size)
+    '''
+    slope = MATRIX_SLOPE["luma" if channel == "Y" else "chroma"]
+    frequency = np.add.outer(np.arange(block_size), np.arange(block_size)) / (2 * block_size - 2)
+
+    matrix = (1 + slope * frequency).astype(np.float32)
+    matrix.flags.writeable = False
+    return matrix
+
+
+@lru_cache(maxsize=None)
+def scaling_tables(qp, block_size, channel):
+    '''
+        Precomputes the step sizes (for dequantization) and their reciprocals (for quantization) of every coefficient of a block
+
+        Returns:
+            tables (tuple): Read-only float32 matrices (steps, reciprocals) with shape (block_size, block_size)
+    '''
+    steps = (step_size(qp) * quantization_matrix(block_size, channel)).astype(np.float32)
+    reciprocals = (1 / steps).astype(np.float32)
+
+    steps.flags.writeable = False
+    reciprocals.flags.writeable = False
+    return steps, reciprocals
+
+
+@lru_cache(maxsize=None)
+def integer_scaling_tables(qp, block_size, channel, bit_depth):
+    '''
+        Precomputes the integer step sizes (for dequantize_integer) and their reciprocals (for quantize_integer) of every coefficient of a block for the
+        coefficients of the integer transform. The step size of a coefficient is scales / 2^shift with scales = LEVEL_SCALE[qp % 6] * weight << (qp // 6),
+        where weight is the quantization matrix rounded to MATRIX_BITS fractional bits. In units of the orthonormal DCT this is step_size(qp) * matrix up to the rounding
+
+        Returns:
+            tables (tuple): Read-only int64 matrix scales, the right shift shift (int) and read-only float32 matrix reciprocals (2^shift / scales) with shape (block_size, block_size)
+    '''
+    assert 0 <= qp <= MAX_QP, "QP has to be between 0 and " + str(MAX_QP)
+    weights = np.rint(quantization_matrix(block_size, channel) * 2 ** MATRIX_BITS).astype(np.int64)
+    scales = (LEVEL_SCALE[qp % 6] * weights) << (qp // 6)
+
+    # LEVEL_SCALE is the step size in 1/64 and the weights in 1/16, the integer coefficients are scaled by integer_coefficient_scale
+    shift = 6 + MATRIX_BITS - int(np.log2(integer_coefficient_scale(block_size, bit_depth)))
+    reciprocals = (2.0 ** shift / scales).astype(np.float32)
+
+    scales.flags.writeable = False
+    reciprocals.flags.writeable = False
+    return scales, shift, reciprocals
+
+
+@instrument("quantization")
+def quantize(coefficients, qp, channel, out=None):
+    '''
+        Quantizes the DCT coefficients of all blocks at once with dead-zone rounding: level = sign(c) * floor(|c| / step + DEAD_ZONE_OFFSET)
+
+        Parameters:
+            coefficients (numpy array): DCT coefficients with shape (..., block_size, block_size)
+            qp (int): Quantization parameter
+            channel (String): "Y", "U" or "V"
+            out (numpy array): Optional int16 output array
+
+        Returns:
+            levels (numpy array): Quantized coefficients as int16 with the shape of coefficients
+    '''
+    _, reciprocals = scaling_tables(qp, coefficients.shape[-1], channel)
+    return __dead_zone_rounding__(coefficients, reciprocals, out)
+
+
+def quantize_dc(dc, qp, block_size, channel):
+    '''
+        Quantizes only the DC coefficients of blocks like quantize, e.g. of the flat blocks that are coded without transform (see skip_detection)
+
+        Parameters:
+            dc (numpy array): DC coefficients with shape (...)
+            qp (int): Quantization parameter
+            block_size (int): Size of the blocks
+            channel (String): "Y", "U" or "V"
+
+        Returns:
+            levels (numpy array): Quantized DC coefficients as int16 with the shape of dc
+    '''
+    _, reciprocals = scaling_tables(qp, block_size, channel)
+    return __dead_zone_rounding__(dc.astype(np.float32, copy=False), reciprocals[0, 0])
+
+
+@instrument("quantization")
+def quantize_integer(coefficients, qp, channel, bit_depth, out=None):
+    '''
+        Quantizes the coefficients of the integer transform of all blocks at once with dead-zone rounding like quantize, with the step sizes of integer_scaling_tables
+
+        Parameters:
+            coefficients (numpy array): Coefficients of transform.integer_dct_blocks with shape (..., block_size, block_size)
+            qp (int): Quantization parameter
+            channel (String): "Y", "U" or "V"
+            bit_depth (int): Bit depth of the video, 8 or 10
+            out (numpy array): Optional int16 output array
+
+        Returns:
+            levels (numpy array): Quantized coefficients as int16 with the shape of coefficients
+    '''
+    _, _, reciprocals = integer_scaling_tables(qp, coefficients.shape[-1], channel, bit_depth)
+    return __dead_zone_rounding__(coefficients, reciprocals, out)
+
+
+def quantize_integer_dc(dc, qp, block_size, channel, bit_depth):
+    '''
+        Quantizes only the DC coefficients of the integer transform like quantize_integer, the counterpart of quantize_dc
+    '''
+    _, _, reciprocals = integer_scaling_tables(qp, block_size, channel, bit_depth)
+    return __dead_zone_rounding__(dc.astype(np.float32, copy=False), reciprocals[0, 0])
+
+
+def __dead_zone_rounding__(coefficients, reciprocals, out=None):
+    '''
+        level = sign(c) * floor(|c| * reciprocal + DEAD_ZONE_OFFSET), clipped to int16
+    '''
+    magnitude = np.abs(coefficients, dtype=np.float32)
+    magnitude *= reciprocals
+    magnitude += DEAD_ZONE_OFFSET
+    np.floor(magnitude, out=magnitude)
+    np.copysign(magnitude, coefficients, out=magnitude)
+
+    if out is None:
+        out = np.empty(coefficients.shape, dtype=np.int16)
+    np.clip(magnitude, np.iinfo(np.int16).min, np.iinfo(np.int16).max, out=magnitude)
+    out[...] = magnitude
+    return out
+
+
+@instrument("quantization")
+def dequantize(levels, qp, channel, out=None):
+    '''
+        Scales the quantized coefficients of all blocks back to DCT coefficients
+
+        Parameters:
+            levels (numpy array): Quantized coefficients with shape (frames, ..., block_size, block_size)
+            qp (int or numpy array): Quantization parameter of all frames or an array with the QP of every frame
+            channel (String): "Y", "U" or "V"
+            out (numpy array): Optional float32 output array
+
+        Returns:
+            coefficients (numpy array): float32 array with the shape of levels
+    '''
+    if np.ndim(qp) == 0:
+        steps, _ = scaling_tables(qp, levels.shape[-1], channel)
+    else:
+        steps = np.stack([scaling_tables(int(q), levels.shape[-1], channel)[0] for q in qp])
+        steps = steps.reshape((len(qp),) + (1,) * (levels.ndim - 3) + steps.shape[1:])
+    return np.multiply(levels, steps, out=out)
+
+
+def dequantize_dc(levels, qp, block_size, channel):
+    '''
+        Scales quantized DC coefficients back like dequantize (with the same float32 arithmetic), the counterpart of quantize_dc
+    '''
+    steps, _ = scaling_tables(qp, block_size, channel)
+    return np.multiply(levels, steps[0, 0])
+
+
+@lru_cache(maxsize=None)
+def __integer_steps__(qp, block_size, channel, bit_depth):
+    '''
+        Step sizes scales * 2^-shift of dequantize_integer (the shift is a power of two) as read-only float64 and float32 matrices, the float32 steps are exact
+        if the largest scale is at most EXACT_FLOAT32. Returns (float64 steps, float32 steps, largest scale, shift)
+    '''
+    scales, shift, _ = integer_scaling_tables(qp, block_size, channel, bit_depth)
+    steps = scales * 2.0 ** -shift
+    steps_float32 = steps.astype(np.float32)
+    steps.flags.writeable = False
+    steps_float32.flags.writeable = False
+    return steps, steps_float32, int(scales.max()), shift
+
+
+@instrument("quantization")
+def dequantize_integer(levels, qp, channel, bit_depth, out=None):
+    '''
+        Scales the quantized coefficients of all blocks back to coefficients of the integer transform: (level * scales + 2^(shift - 1)) >> shift, clipped to int16
+        (see integer_scaling_tables). The products are computed in float32 if they are at most EXACT_FLOAT32 and in float64 otherwise, so the result is that of the
+        integer arithmetic on every platform
+
+        Parameters:
+            levels (numpy array): Quantized coefficients with shape (frames, ..., block_size, block_size)
+            qp (int or numpy array): Quantization parameter of all frames or an array with the QP of every frame
+            channel (String): "Y", "U" or "V"
+            bit_depth (int): Bit depth of the video, 8 or 10
+            out (numpy array): Optional output array, e.g. int16
+
+        Returns:
+            coefficients (numpy array): Integer coefficients with the shape of levels, float32 (or float64) with integer values if out is not given
+    '''
+    block_size = levels.shape[-1]
+    if np.ndim(qp) == 0:
+        steps, steps_float32, largest_scale, shift = __integer_steps__(qp, block_size, channel, bit_depth)
+    else:
+        tables = [__integer_steps__(int(q), block_size, channel, bit_depth) for q in qp]
+        shape = (len(qp),) + (1,) * (levels.ndim - 3) + (block_size, block_size)
+        steps = np.stack([table[0] for table in tables]).reshape(shape)
+        steps_float32 = np.stack([table[1] for table in tables]).reshape(shape)
+        largest_scale = max(table[2] for table in tables)
+        shift = tables[0][3]
+
+    # the products level * scales are at most largest, the steps include the shift
+    largest = max(int(levels.max(initial=0)), -int(levels.min(initial=0))) * largest_scale
+    coefficients = np.multiply(levels, steps_float32 if largest <= EXACT_FLOAT32 else steps)
+    coefficients += 0.5
+    np.floor(coefficients, out=coefficients)
+    if largest * 2.0 ** -shift + 0.5 >= 2 ** 15:
+        np.clip(coefficients, -2 ** 15, 2 ** 15 - 1, out=coefficients)
+
+    if out is None:
+        return coefficients
+    out[...] = coefficients
+    return out
+
+
+def dequantize_integer_dc(levels, qp, block_size, channel, bit_depth):
+    '''
+        Scales quantized DC coefficients back like dequantize_integer, the counterpart of quantize_integer_dc
+    '''
+    scales, shift, _ = integer_scaling_tables(qp, block_size, channel, bit_depth)
+    return np.clip((levels.astype(np.int64) * scales[0, 0] + (1 << (shift - 1))) >> shift, -2 ** 15, 2 ** 15 - 1).astype(np.int16)
+
+
+def zero_level_bounds(qp, block_size, channel, transform="float", bit_depth=8):
+    '''
+        Magnitudes below which quantize (or quantize_integer for transform "integer") returns level 0: a coefficient c is quantized to 0 if |c| < step * (1 - DEAD_ZONE_OFFSET).
+        The bounds are in units of the orthonormal DCT for both transforms
+
+        Returns:
+            bounds (tuple): (dc_bound, ac_bound), the bound of the DC coefficient and the smallest bound of all AC coefficients
+    '''
+    if transform == "integer":
+        scales, shift, _ = integer_scaling_tables(qp, block_size, channel, bit_depth)
+        steps = scales / 2.0 ** shift / integer_coefficient_scale(block_size, bit_depth)
+    else:
+        steps, _ = scaling_tables(qp, block_size, channel)
+    return float(steps[0, 0]) * (1 - DEAD_ZONE_OFFSET), float(steps[0, 1]) * (1 - DEAD_ZONE_OFFSET)
+
+
+@instrument("quantization")
+def nonzero_counts(coefficients, channel):
+    '''
+        Counts for every QP how many of the given DCT coefficients would be quantized to a non-zero level, without quantizing them. A coefficient c is non-zero
+        if |c| / matrix >= step_size(qp) * (1 - DEAD_ZONE_OFFSET), i.e. for all QPs up to 6 * log2(|c|) + 4 - 6 * log2(matrix * (1 - DEAD_ZONE_OFFSET)).
+        The counts are the statistics of the bit-cost model of the rate control (see rate_control)
+
+        Parameters:
+            coefficients (numpy array): DCT coefficients with shape (..., block_size, block_size)
+            channel (String): "Y", "U" or "V"
+
+        Returns:
+            counts (numpy array): int64 array with MAX_QP + 1 entries, counts[qp] is the number of non-zero levels at this QP
+    '''
+    return __count_largest_qps__(np.abs(coefficients, dtype=np.float32), __largest_qp_offsets__(coefficients.shape[-1], channel))
+
+
+def nonzero_dc_counts(dc, block_size, channel):
+    '''
+        Counts the non-zero levels per QP of only the DC coefficients of blocks like nonzero_counts, e.g. of the flat blocks that are coded without transform (see skip_detection)
+    '''
+    return __count_largest_qps__(np.abs(dc, dtype=np.float32), __largest_qp_offsets__(block_size, channel)[0, 0])
+
+
+@lru_cache(maxsize=None)
+def __largest_qp_offsets__(block_size, channel):
+    '''
+        4 - 6 * log2(matrix * (1 - DEAD_ZONE_OFFSET)) for every coefficient of a block, see nonzero_counts
+    '''
+    offsets = (4 - 6 * np.log2(quantization_matrix(block_size, channel) * (1 - DEAD_ZONE_OFFSET))).astype(np.float32)
+    offsets.flags.writeable = False
+    return offsets
+
+
+def __count_largest_qps__(magnitude, offsets):
+    '''
+        Histogram of the largest QP with a non-zero level of every coefficient, accumulated from MAX_QP down to 0. magnitude (float32) is overwritten
+    '''
+    np.maximum(magnitude, np.finfo(np.float32).tiny, out=magnitude)
+    np.log2(magnitude, out=magnitude)
+    magnitude *= 6
+    magnitude += offsets
+    np.floor(magnitude, out=magnitude)
+    np.clip(magnitude, -1, MAX_QP, out=magnitude)  # -1: zero at all QPs
+
+    histogram = np.bincount((magnitude.ravel() + 1).astype(np.intp), minlength=MAX_QP + 2)[1:]
+    return np.cumsum(histogram[::-1])[::-1]
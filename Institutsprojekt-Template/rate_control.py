@@ -0,0 +1,122 @@
+# This file contains the rate control, which chooses the QP of every frame such that the bitstream meets a target bitrate.
+#
+# Bit-cost model: the bits of a frame are proportional to the number of non-zero quantized coefficients (rho-domain model),
+#   bits(qp) = theta * nonzero(qp)
+# with one slope theta per frame type. The encoder counts for the coded frame how many coefficients would be non-zero at every QP
+# (quantization.nonzero_counts, a histogram of the coefficient magnitudes), so the curve nonzero(qp) of the last frame of the same type is
+# known for all QPs without encoding the frame again. After every frame theta is fitted to the actually written bits.
+# Bit allocation: every GOP gets the bits of its frames at the target bitrate plus the deviation of the previous GOPs, the remaining bits of
+# a GOP are distributed to its remaining frames, with INTRA_WEIGHT times as many bits for an I-frame as for a P-frame.
+import numpy as np
+from quantization import MAX_QP
+from bitstream_io import FRAME_INTRA
+
+
+INTRA_WEIGHT = 4
+MAX_QP_CHANGE = 4  # largest change of the QP from one frame to the next frame of the same type
+P_FRAME_QP_OFFSET = 2  # QP of the first P-frame relative to the QP of the I-frame
+THETA_SMOOTHING = 0.5  # weight of the newest frame when theta is fitted
+MAX_CARRY = 0.5  # the deviation carried into the next GOP is limited to this fraction of a GOP budget
+
+
+class RateController:
+    '''
+        Chooses the QP of every frame for a target bitrate, see the description at the top of this file
+
+        Usage:
+            rate_controller = RateController(target_bitrate, frame_rate, initial_qp)
+            for every GOP:
+                rate_controller.start_gop(frames_in_gop)
+                for every frame:
+                    qp = rate_controller.frame_qp(frame_type)
+                    ... encode the frame with qp, counting the non-zero levels per QP with quantization.nonzero_counts ...
+                    rate_controller.update(frame_type, qp, bits, nonzero)
+    '''
+
+    def __init__(self, target_bitrate, frame_rate, initial_qp=28):
+        '''
+            Parameters:
+                target_bitrate (float): Target bitrate in bits per second
+                frame_rate (float): Frames per second of the video
+                initial_qp (int): QP of the first I-frame, before the model has any statistics
+        '''
+        self.target_bits_per_frame = target_bitrate / frame_rate
+        self.initial_qp = initial_qp
+
+        self.theta = {}  # bits per non-zero level of every frame type
+        self.nonzero = {}  # non-zero levels per QP of the last frame of every frame type
+        self.last_qp = {}
+
+        self.carry = 0.0
+        self.gops = []
+
+    def start_gop(self, num_frames):
+        '''
+            Starts a new GOP with num_frames frames, the first of which is an I-frame
+        '''
+        budget = self.target_bits_per_frame * num_frames
+        self.carry = float(np.clip(self.carry, -MAX_CARRY * budget, MAX_CARRY * budget))
+
+        self.gops.append({"frames": num_frames, "target_bits": budget, "bits": 0, "qp": []})
+        self.remaining_bits = budget - self.carry
+        self.remaining_weight = INTRA_WEIGHT + num_frames - 1
+
+    def frame_qp(self, frame_type):
+        '''
+            Returns the QP for the next frame of the given type: the smallest QP whose estimated bits fit into the bit budget of the frame
+        '''
+        weight = INTRA_WEIGHT if frame_type == FRAME_INTRA else 1
+        budget = max(self.remaining_bits, 0) * weight / self.remaining_weight
+
+        if frame_type not in self.theta:
+            if frame_type == FRAME_INTRA:
+                return self.initial_qp
+            return min(self.last_qp[FRAME_INTRA] + P_FRAME_QP_OFFSET, MAX_QP)
+
+        estimated_bits = self.theta[frame_type] * self.nonzero[frame_type]
+        fitting = np.flatnonzero(estimated_bits <= budget)
+        qp = int(fitting[0]) if len(fitting) else MAX_QP
+
+        last_qp = self.last_qp[frame_type]
+        return int(np.clip(qp, last_qp - MAX_QP_CHANGE, last_qp + MAX_QP_CHANGE))
+
+    def update(self, frame_type, qp, bits, nonzero):
+        '''
+            Updates the model and the budgets with a coded frame
+
+            Parameters:
+                frame_type (int): FRAME_INTRA or FRAME_INTER
+                qp (int): QP the frame was coded with
+                bits (int): Number of bits of the coded frame
+                nonzero (numpy array): Number of non-zero levels of the frame for every QP, see quantization.nonzero_counts
+        '''
+        theta = bits / max(int(nonzero[qp]), 1)
+        if frame_type in self.theta:
+            theta = THETA_SMOOTHING * theta + (1 - THETA_SMOOTHING) * self.theta[frame_type]
+
+        self.theta[frame_type] = theta
+        self.nonzero[frame_type] = nonzero
+        self.last_qp[frame_type] = qp
+
+        gop = self.gops[-1]
+        gop["bits"] += bits
+        gop["qp"].append(qp)
+        self.remaining_bits -= bits
+        self.remaining_weight -= INTRA_WEIGHT if frame_type == FRAME_INTRA else 1
+        self.carry += bits - self.target_bits_per_frame
+
+    def gop_report(self, gop=-1):
+        '''
+            Returns the achieved and the target bits of a GOP (default: the last one), e.g. for logging
+
+            Returns:
+                report (dict): Dict with the keys "frames", "bits", "target_bits", "ratio" (bits / target_bits) and "mean_qp"
+        '''
+        gop = self.gops[gop]
+        return {
+            "frames": gop["frames"],
+            "bits": gop["bits"],
+            "target_bits": gop["target_bits"],
+            "ratio": gop["bits"] / gop["target_bits"],
+            "mean_qp": float(np.mean(gop["qp"])),
+        }
@@ -0,0 +1,125 @@
+# This file contains the pre-analysis of the encoder that finds blocks which can be coded without prediction search and transform.
+#
+# The analysis runs for all blocks of a channel at once, before the wavefront coding of encoder.block_coding, and flags two kinds of blocks:
+#   static: (P-frames) all quantized levels of the difference to the co-located block of the previous reconstructed frame are 0, e.g. a block of
+#           a still background. The block gets the zero vector and is coded with MODE_INTER and without residual, its reconstruction is the co-located block.
+#   flat:   the residual of the block is almost constant (P-frames: the difference to the co-located block, I-frames: the block and its
+#           prediction are almost constant). The block is coded with a fixed mode (MODE_INTER with the zero vector in P-frames, MODE_HORIZONTAL
+#           in I-frames) and only the DC level of its residual, which is the mean difference and needs no transform.
+# In P-frames the analysis runs before the motion search (see encoder.encode_frames), which still searches all blocks: the flags of blocks whose
+# vector is not zero are cleared afterwards (see restrict_to_zero_vectors), so a skipped block never loses a better vector.
+# Both tests are exact, i.e. the levels of a skipped block are those that the regular coding with the same prediction would give, only the choice
+# of the mode and vector may differ. By Parseval's theorem no DCT coefficient of a residual is larger than its energy sqrt(sum(r^2)), and quantize
+# returns 0 for coefficients below zero_level_bounds. A flat block has an AC energy below the AC bound (in P-frames that of the residual, in I-frames
+# sqrt(sum((x - mean)^2)) of the block plus that of the prediction as upper bound), i.e. all of its AC levels would be 0 anyway. A block is static
+# if in addition its DC level is 0. This bound is too strict for the quantization noise of an unchanged textured block, whose coefficients are
+# each below the zero level bound but whose energy is about block_size times larger. The remaining blocks whose coefficients are small enough on
+# average (energy / block_size below STATIC_THRESHOLD times the AC bound) are therefore checked with the forward transform and quantization of
+# the encoder (see __zero_levels__), which is still much cheaper than the motion search, the mode decision and the inverse transform.
+# The energies are computed in one vectorized pass over the frame.
+import numpy as np
+from quantization import zero_level_bounds, quantize, quantize_integer
+from transform import dct_blocks, integer_dct_blocks
+from telemetry import instrument
+
+
+SKIP_MARGIN = 0.99  # safety factor on the bounds for the rounding errors of the float32 transform
+STATIC_MARGIN = 0.99  # the same for the check of the static blocks with the transform
+STATIC_THRESHOLD = 1.0  # blocks whose coefficients have a larger RMS (in AC bounds) are not checked with the transform, only limits the work of the check
+
+
+@instrument("skip_detection")
+def skip_analysis(blocks, qp, channel, co_located=None, scratch=None, transform="float", bit_depth=8):
+    '''
+        Flags the static and flat blocks of a channel, see the description at the top of this file
+
+        Parameters:
+            blocks (numpy array): Blocks with shape (frames, num_blocks_h, num_blocks_w, block_size, block_size)
+            qp (int): Quantization parameter
+            channel (String): "Y", "U" or "V"
+            co_located (numpy array): Co-located blocks of the previous reconstructed frame (the prediction with the zero vector) with the shape of blocks, only in P-frames
+            scratch (numpy array): Optional int32 buffer with at least twice the size of blocks for the differences and squared samples
+            transform (String): "float" or "integer", the transform of the encoder whose step sizes give the thresholds (see quantization.zero_level_bounds)
+            bit_depth (int): Bit depth of the video, needed for the integer transform
+
+        Returns:
+            static (numpy array): Boolean array with shape (frames, num_blocks_h, num_blocks_w), always False in I-frames
+            flat_margin (numpy array): float64 array with the same shape. A block can be coded DC-only with a prediction whose AC energy is below its margin,
+                                       in P-frames the margin of the residual to the co-located block (prediction AC energy 0). Blocks that are not flat have a margin <= 0
+    '''
+    block_size = blocks.shape[-1]
+    dc_bound, ac_bound = zero_level_bounds(qp, block_size, channel, transform, bit_depth)
+
+    if scratch is None:
+        scratch = np.empty(2 * blocks.size, dtype=np.int32)
+    if co_located is None:
+        return np.zeros(blocks.shape[:3], dtype=bool), SKIP_MARGIN * ac_bound - ac_energy(blocks, scratch)
+
+    difference = scratch.reshape(-1)[blocks.size:2 * blocks.size].reshape(blocks.shape)
+    np.subtract(blocks, co_located, out=difference, dtype=np.int32)
+    energy = ac_energy(difference, scratch)
+    flat_margin = SKIP_MARGIN * ac_bound - energy
+
+    dc = difference.sum(axis=(-2, -1), dtype=np.int64) / block_size  # DC coefficient of the orthonormal DCT
+    static = (energy < STATIC_MARGIN * ac_bound) & (np.abs(dc) < STATIC_MARGIN * dc_bound)
+
+    candidates = ~static & (np.sqrt(energy ** 2 + dc ** 2) < STATIC_THRESHOLD * ac_bound * block_size)
+    if candidates.any():
+        static[candidates] = __zero_levels__(difference[candidates], qp, channel, transform, bit_depth)
+    return static, flat_margin
+
+
+def __zero_levels__(residuals, qp, channel, transform, bit_depth):
+    '''
+        Checks with the transform and quantization of the encoder whether all levels of residuals (shape (n, block_size, block_size)) are 0. The coefficients
+        are enlarged by 1 / STATIC_MARGIN, so rounding differences of the float32 transform between this check and the coding cannot give a non-zero level
+
+        Returns:
+            zero (numpy array): Boolean array with shape (n,)
+    '''
+    if transform == "integer":
+        coefficients = integer_dct_blocks(residuals, bit_depth)
+        coefficients /= STATIC_MARGIN
+        levels = quantize_integer(coefficients, qp, channel, bit_depth)
+    else:
+        coefficients = dct_blocks(residuals)
+        coefficients /= STATIC_MARGIN
+        levels = quantize(coefficients, qp, channel)
+    return ~levels.any(axis=(-2, -1))
+
+
+def restrict_to_zero_vectors(analysis, vectors):
+    '''
+        Clears the flags of the blocks whose motion vector is not zero, the analysis of P-frames only holds for the prediction with the zero vector
+
+        Parameters:
+            analysis (tuple): Result (static, flat_margin) of skip_analysis for the blocks of one channel
+            vectors (numpy array): Motion vectors of the blocks of the channel with shape (num_blocks_h, num_blocks_w, 2)
+
+        Returns:
+            analysis (tuple): (static, flat_margin) without the blocks that moved
+    '''
+    static, flat_margin = analysis
+    moved = vectors.any(axis=-1)
+    return static & ~moved, np.where(moved, -np.inf, flat_margin)
+
+
+def ac_energy(blocks, scratch=None):
+    '''
+        Computes the energy of the AC coefficients of every block without the transform, sqrt(sum((x - mean)^2)) = sqrt(sum(x^2) - sum(x)^2 / block_size^2)
+
+        Parameters:
+            blocks (numpy array): Integer blocks with shape (..., block_size, block_size)
+            scratch (numpy array): Optional int32 buffer with at least the size of blocks for the squared samples
+
+        Returns:
+            energy (numpy array): float64 array with the shape of blocks without the last two axes
+    '''
+    if scratch is None:
+        scratch = np.empty(blocks.shape, dtype=np.int32)
+    squares = scratch.reshape(-1)[:blocks.size].reshape(blocks.shape)
+    np.square(blocks, out=squares, dtype=np.int32)
+
+    total = blocks.sum(axis=(-2, -1), dtype=np.int64)
+    energy = squares.sum(axis=(-2, -1), dtype=np.int64) - total.astype(np.float64) ** 2 / (blocks.shape[-1] * blocks.shape[-2])
+    return np.sqrt(np.maximum(energy, 0))
@@ -0,0 +1,234 @@
+# This file contains the stage-level telemetry of the codec pipeline.
+#
+# The stages of the pipeline (partitioning, prediction, motion estimation, DCT, quantization, entropy coding, bitstream and YUV I/O, PSNR)
+# are marked with the decorator instrument. While the telemetry is enabled, every call of a marked function adds its wall time, the bytes
+# of its array/bytes arguments (bytes in) and of its result (bytes out) and optionally the peak of the memory allocated during the call
+# (tracemalloc) to the current frame scope. The encoder and decoder open a frame scope per frame or group of frames, so there is one record
+# per scope and stage, which can be written as JSON lines or printed as a summary table.
+# While the telemetry is disabled, a marked function costs one attribute lookup per call.
+#
+# The telemetry covers the calling process only: with encoder workers > 1 the stages of the worker processes are not recorded, and the
+# optional cProfile capture sees the calling thread only (not the tile threads, see tiles). With tile_workers > 1 the memory peaks of
+# concurrent stages overlap and are approximate. The same holds for the background I/O threads (see background_io), whose I/O stages are
+# recorded in the scope that is open in the coding thread at that time.
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+from functools import wraps
+
+import numpy as np
+
+
+class Telemetry:
+    '''
+        Collects the stage records of the codec pipeline, see the description at the top of this file. The module-level instance telemetry is used by all stages
+
+        Usage:
+            telemetry.enable(memory=True, profile=False)
+            ... encode / decode ...
+            telemetry.disable()
+            telemetry.write_json_lines(path)
+            print(telemetry.summary())
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.profiler = None
+        self.scopes = []
+        self.__stack__ = []
+        self.__lock__ = threading.Lock()
+        self.__local__ = threading.local()  # peaks of the enclosing stage calls of every thread, see measure
+
+    def enable(self, memory=False, profile=False):
+        '''
+            Starts recording, previous records are discarded
+
+            Parameters:
+                memory (bool): Record the peak allocated memory of every stage with tracemalloc, which slows down the pipeline considerably
+                profile (bool): Additionally run cProfile, see profile_stats
+        '''
+        self.scopes = []
+        self.__stack__ = []
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.profiler = cProfile.Profile() if profile else None
+        if profile:
+            self.profiler.enable()
+        self.enabled = True
+
+    def disable(self):
+        '''
+            Stops recording, the records are kept until the next call of enable
+        '''
+        self.enabled = False
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.memory:
+            tracemalloc.stop()
+
+    def frame(self, scope, frame=0, frames=1):
+        '''
+            Context manager for the records of one frame or a group of frames, e.g. with telemetry.frame("encode", f): ...
+            The stages called inside are recorded with this scope, nested scopes take precedence
+
+            Parameters:
+                scope (String): Part of the pipeline, e.g. "encode" or "decode"
+                frame (int): Index of the first frame within the coded group of frames
+                frames (int): Number of frames
+        '''
+        if not self.enabled:
+            return nullcontext()
+        return FrameScope(self, {"scope": scope, "frame": frame, "frames": frames, "stages": {}})
+
+    def measure(self, stage, function, args, kwargs):
+        '''
+            Calls function and adds the time, bytes in/out and peak memory of the call to the stage record of the current scope.
+            The peak of tracemalloc is reset for every call, so the peak of an enclosing stage call reached before this call is kept on a stack
+            and the peak of this call is passed on to it, so a nested stage does not hide the peak of the enclosing stage
+        '''
+        if self.memory:
+            peaks = self.__local__.__dict__.setdefault("peaks", [])
+            base, outer_peak = tracemalloc.get_traced_memory()
+            if peaks:
+                peaks[-1] = max(peaks[-1], outer_peak)
+            peaks.append(0)
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.memory:
+                absolute_peak = max(tracemalloc.get_traced_memory()[1], peaks.pop())
+                if peaks:
+                    peaks[-1] = max(peaks[-1], absolute_peak)
+
+        peak = absolute_peak - base if self.memory else 0
+        bytes_in = sum(__nbytes__(value) for value in args) + sum(__nbytes__(value) for value in kwargs.values())
+        self.record(stage, elapsed, bytes_in, __nbytes__(result), peak)
+        return result
+
+    def record(self, stage, elapsed, bytes_in=0, bytes_out=0, peak=0):
+        '''
+            Adds one call with the given time (seconds), bytes in/out and peak memory to the stage record of the current scope, e.g. for waiting times that are not the call of a function (see background_io)
+        '''
+        with self.__lock__:
+            if not self.__stack__:
+                self.__push__({"scope": "pipeline", "frame": 0, "frames": 0, "stages": {}})  # stages outside of a frame scope, e.g. file I/O
+            stages = self.__stack__[-1]["stages"]
+            record = stages.setdefault(stage, {"calls": 0, "time": 0.0, "bytes_in": 0, "bytes_out": 0, "peak_memory": 0})
+            record["calls"] += 1
+            record["time"] += elapsed
+            record["bytes_in"] += bytes_in
+            record["bytes_out"] += bytes_out
+            record["peak_memory"] = max(record["peak_memory"], peak)
+
+    def __push__(self, scope):
+        self.scopes.append(scope)
+        self.__stack__.append(scope)
+
+    def records(self):
+        '''
+            Returns:
+                records (list): One dict per scope and stage with the keys "scope", "frame", "frames", "stage", "calls", "time" (seconds), "bytes_in", "bytes_out" and "peak_memory" (bytes, 0 without memory recording)
+        '''
+        return [{"scope": scope["scope"], "frame": scope["frame"], "frames": scope["frames"], "stage": stage, **record}
+                for scope in self.scopes for stage, record in scope["stages"].items()]
+
+    def write_json_lines(self, path):
+        '''
+            Writes the records as JSON lines, one record per line
+        '''
+        with open(path, "w") as file:
+            for record in self.records():
+                file.write(json.dumps(record) + "\n")
+
+    def summary(self):
+        '''
+            Returns a table with the totals of every stage over all scopes: calls, time, share of the total time of all stages, bytes in/out, input throughput and peak memory
+        '''
+        totals = {}
+        for record in self.records():
+            total = totals.setdefault((record["scope"], record["stage"]), {"calls": 0, "time": 0.0, "bytes_in": 0, "bytes_out": 0, "peak_memory": 0})
+            for key in ["calls", "time", "bytes_in", "bytes_out"]:
+                total[key] += record[key]
+            total["peak_memory"] = max(total["peak_memory"], record["peak_memory"])
+
+        all_time = sum(total["time"] for total in totals.values()) or 1.0
+        lines = ["{:<8} {:<20} {:>8} {:>10} {:>7} {:>10} {:>10} {:>9} {:>9}".format("scope", "stage", "calls", "time (s)", "share", "MB in", "MB out", "MB/s", "peak MB")]
+        for (scope, stage), total in sorted(totals.items(), key=lambda item: -item[1]["time"]):
+            lines.append("{:<8} {:<20} {:>8} {:>10.4f} {:>6.1f}% {:>10.2f} {:>10.2f} {:>9.1f} {:>9.2f}".format(
+                scope, stage, total["calls"], total["time"], 100 * total["time"] / all_time, total["bytes_in"] / 1e6, total["bytes_out"] / 1e6,
+                total["bytes_in"] / 1e6 / max(total["time"], 1e-9), total["peak_memory"] / 1e6))
+        return "\n".join(lines)
+
+    def profile_stats(self, sort="cumulative", limit=25, path=""):
+        '''
+            Returns the cProfile statistics of the last recording with profile=True as text, sorted by sort and limited to limit functions. With a path the raw statistics are also written to this file (e.g. for snakeviz)
+        '''
+        if self.profiler is None:
+            return ""
+        if path:
+            self.profiler.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(self.profiler, stream=text).sort_stats(sort).print_stats(limit)
+        return text.getvalue()
+
+
+class FrameScope:
+    '''
+        Context manager returned by Telemetry.frame
+    '''
+
+    def __init__(self, telemetry, scope):
+        self.telemetry = telemetry
+        self.scope = scope
+
+    def __enter__(self):
+        with self.telemetry.__lock__:
+            self.telemetry.__push__(self.scope)
+        return self.scope
+
+    def __exit__(self, *args):
+        with self.telemetry.__lock__:
+            self.telemetry.__stack__.remove(self.scope)
+
+
+telemetry = Telemetry()
+
+
+def instrument(stage):
+    '''
+        Decorator that marks a function as a stage of the pipeline: while the telemetry is enabled, its calls are recorded under the name stage
+    '''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not telemetry.enabled:
+                return function(*args, **kwargs)
+            return telemetry.measure(stage, function, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def __nbytes__(value):
+    '''
+        Size of the data of an array, a bytes object or a (nested) dict, list or tuple of them, other values count 0
+    '''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(__nbytes__(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(__nbytes__(item) for item in value)
+    return 0
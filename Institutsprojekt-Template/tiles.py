@@ -0,0 +1,75 @@
+# This file contains the partitioning of frames into tiles.
+#
+# A tile is a rectangle of luma blocks (tile_height x tile_width blocks, the tiles at the right and bottom border may be smaller) together with
+# the chroma blocks at the same position. Tiles are coded independently of each other: the intra prediction treats the blocks outside of the
+# tile as unavailable, the motion vectors are predicted within the tile and every tile has its own entropy coder. So the tiles of a frame can
+# be encoded and decoded concurrently. Motion compensation may still reference the whole previous frame.
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from yuv_io import __get_subsampling_factors__
+
+
+def tile_layout(header, grid):
+    '''
+        Computes the block ranges of all tiles of a frame in raster order
+
+        Parameters:
+            header (dict): Bitstream header with the keys "tile_height" and "tile_width" (in luma blocks, 0 for the whole frame), "block_size_luma", "block_size_chroma" and "subsampling_scheme"
+            grid (dict): Number of blocks (num_blocks_h, num_blocks_w) of every channel
+
+        Returns:
+            tiles (list): For every tile a dict with a tuple of slices (rows, columns) into the block grid of every channel
+    '''
+    num_blocks_h, num_blocks_w = grid["Y"]
+    tile_height = header["tile_height"] or num_blocks_h
+    tile_width = header["tile_width"] or num_blocks_w
+
+    tiles = []
+    for top in range(0, num_blocks_h, tile_height):
+        for left in range(0, num_blocks_w, tile_width):
+            bottom = min(top + tile_height, num_blocks_h)
+            right = min(left + tile_width, num_blocks_w)
+            tiles.append({c: __channel_slices__(header, grid, c, top, bottom, left, right) for c in grid})
+    return tiles
+
+
+def __channel_slices__(header, grid, channel, top, bottom, left, right):
+    '''
+        Converts a block range of the luma channel into the block range of the given channel that covers the same pixels
+    '''
+    if channel == "Y":
+        return slice(top, bottom), slice(left, right)
+
+    h_sub, v_sub = __get_subsampling_factors__(header["subsampling_scheme"])
+    num_blocks_h, num_blocks_w = grid[channel]
+    luma_blocks_h, luma_blocks_w = grid["Y"]
+
+    def convert(index, luma_blocks, num_blocks, subsampling):
+        if index == luma_blocks:  # the last tile covers the rest of the chroma blocks
+            return num_blocks
+        return min(index * header["block_size_luma"] // (header["block_size_chroma"] * subsampling), num_blocks)
+
+    return (slice(convert(top, luma_blocks_h, num_blocks_h, v_sub), convert(bottom, luma_blocks_h, num_blocks_h, v_sub)),
+            slice(convert(left, luma_blocks_w, num_blocks_w, h_sub), convert(right, luma_blocks_w, num_blocks_w, h_sub)))
+
+
+def map_tiles(function, tiles, pool=None):
+    '''
+        Calls function(index, tile) for every tile and yields the tuples (index, result) as soon as a tile is finished. With a ThreadPoolExecutor as pool the tiles
+        are processed concurrently and yielded in the order they finish, otherwise one after another in raster order
+    '''
+    if pool is None:
+        for index, tile in enumerate(tiles):
+            yield index, function(index, tile)
+        return
+
+    jobs = {pool.submit(function, index, tile): index for index, tile in enumerate(tiles)}
+    for job in as_completed(jobs):
+        yield jobs[job], job.result()
+
+
+def tile_pool(workers):
+    '''
+        Returns a thread pool for map_tiles, or None for workers <= 1. NumPy releases the GIL in its array operations, so threads avoid copying the frames to worker processes
+    '''
+    return ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
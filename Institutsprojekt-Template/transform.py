@@ -0,0 +1,306 @@
+# This file contains the 2-D DCT and its inverse for whole tensors of blocks.
+#
+# Besides the float32 transform there is an integer transform in the style of the H.264/HEVC core transforms: the DCT matrix is approximated by
+# the integer matrix of HEVC (about 64 * sqrt(block_size) * C, see integer_dct_matrix), both 1-D stages are followed by a rounding right shift
+# and a clip to 16 bits with the shifts of HEVC, and the coefficients are int16 with the scale integer_coefficient_scale. The inverse is defined
+# exactly by integer arithmetic, so the reconstruction of the encoder and the decoder is bit-exact on every platform.
+# numpy has no BLAS for integer matrix products, so the products are computed with floats: if every input of a stage is at most
+# 2^23 / (64 * block_size) in magnitude, every product and every partial sum is an integer of at most 2^23, which float32 represents exactly
+# (in any summation order), also after the rounding offset is added. This holds for typical residuals, other stages are computed in float64,
+# which is exact for all 16-bit inputs. The bound of every stage follows from the largest input of the transform, see __integer_stage__.
+# The integer transform trades speed for bit-exactness: besides the matrix products of the float transform every stage needs a rounding pass
+# (+0.5 and floor) and a bound check, and dequantize_integer needs a range check. The shifts are part of the stage matrices and the stages that
+# multiply from the right use one matrix product for all rows, so on large batches 8x8 blocks are about as fast as with the float transform and
+# 16x16 blocks take about 10% longer. On the small batches of the wavefront coding the fixed cost per call dominates, the encoder and decoder
+# reach about 0.85 - 1.0 times the frame rate of the float transform.
+import numpy as np
+from functools import lru_cache
+from telemetry import instrument
+
+
+@lru_cache(maxsize=None)
+def dct_matrix(block_size):
+    '''
+        Computes the orthonormal DCT-II basis matrix. The matrix is computed once per block size and cached afterwards
+
+        Parameters:
+            block_size (int): Size of the quadratic blocks, e.g. 8 or 16
+
+        Returns:
+            dct_matrix (numpy array): Read-only float32 matrix C with shape (block_size, block_size), such that C @ x is the DCT of the vector x
+    '''
+    k = np.arange(block_size)[:, None]
+    n = np.arange(block_size)[None, :]
+
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * block_size)) * np.sqrt(2 / block_size)
+    matrix[0, :] /= np.sqrt(2)
+
+    matrix = matrix.astype(np.float32)
+    matrix.flags.writeable = False
+    return matrix
+
+
+@instrument("dct")
+def dct_blocks(blocks, out=None):
+    '''
+        Applies the orthonormal 2-D DCT to all blocks at once. The transform is computed as C @ X @ C^T, which is broadcast over all leading axes
+
+        Parameters:
+            blocks (numpy array): Blocks with shape (..., block_size, block_size), e.g. (frames, num_blocks_h, num_blocks_w, block_size, block_size)
+            out (numpy array): Optional output array. For integer outputs (e.g. int16) the coefficients are rounded
+
+        Returns:
+            coefficients (numpy array): DCT coefficients with the same shape as blocks, float32 if out is not given
+    '''
+    matrix = dct_matrix(blocks.shape[-1])
+
+    coefficients = matrix @ blocks.astype(np.float32, copy=False) @ matrix.T
+
+    return __write_output__(coefficients, out)
+
+
+@instrument("dct")
+def idct_blocks(coefficients, out=None):
+    '''
+        Applies the inverse of dct_blocks to all blocks at once, i.e. C^T @ Y @ C
+
+        Parameters:
+            coefficients (numpy array): DCT coefficients with shape (..., block_size, block_size)
+            out (numpy array): Optional output array. For integer outputs (e.g. int16) the samples are rounded
+
+        Returns:
+            blocks (numpy array): Reconstructed blocks with the same shape as coefficients, float32 if out is not given
+    '''
+    matrix = dct_matrix(coefficients.shape[-1])
+
+    blocks = matrix.T @ coefficients.astype(np.float32, copy=False) @ matrix
+
+    return __write_output__(blocks, out)
+
+
+def idct_dc(dc, block_size):
+    '''
+        Computes the samples of blocks whose only non-zero coefficient is the DC coefficient, without the matrix products. All other products of
+        C^T @ Y @ C are exact zeros, so the rounded result is identical to idct_blocks with an integer output
+
+        Parameters:
+            dc (numpy array): Dequantized DC coefficients with shape (...)
+            block_size (int): Size of the blocks
+
+        Returns:
+            samples (numpy array): int16 array with the shape of dc, the value of all samples of the block
+    '''
+    basis = dct_matrix(block_size)[0, 0]
+    samples = dc.astype(np.float32) * basis
+    samples *= basis
+    return np.rint(samples).astype(np.int16)
+
+
+# integer approximations of 64 * sqrt(2) * cos(m * pi / 64) for m = 1 to 31, the entries of the HEVC transform matrices
+INTEGER_COSINES = (90, 90, 90, 89, 88, 87, 85, 83, 82, 80, 78, 75, 73, 70, 67, 64, 61, 57, 54, 50, 46, 43, 38, 36, 31, 25, 22, 18, 13, 9, 4)
+EXACT_FLOAT32 = 2 ** 23  # float32 represents all integers up to 2^24 exactly, the margin keeps the sums plus the rounding offset exact
+INT16_LIMIT = 2 ** 15
+
+
+@lru_cache(maxsize=None)
+def integer_dct_matrix(block_size):
+    '''
+        Integer DCT-II matrix of HEVC: 64 in the first row, the rows k > 0 are the cosines of the angles (2n + 1) * k * pi / (2 * block_size) from INTEGER_COSINES.
+        The matrices of all block sizes are nested like in HEVC, e.g. the 8x8 matrix is the left half of every second row of the 16x16 matrix
+
+        Parameters:
+            block_size (int): Size of the quadratic blocks, 4, 8, 16 or 32
+
+        Returns:
+            integer_dct_matrix (numpy array): Read-only float32 matrix T with integer values and shape (block_size, block_size), T is about 64 * sqrt(block_size) * dct_matrix(block_size)
+    '''
+    assert block_size in (4, 8, 16, 32), "The integer transform supports the block sizes 4, 8, 16 and 32"
+    k = np.arange(block_size)[:, None] * (32 // block_size)
+    n = np.arange(block_size)[None, :]
+
+    # angle m * pi / 64, folded into 0 < m < 32 with the symmetries of the cosine
+    m = (2 * n + 1) * k % 128
+    m = np.where(m > 64, 128 - m, m)
+    sign = np.where(m > 32, -1, 1)
+    m = np.where(m > 32, 64 - m, m)
+
+    matrix = (sign * np.array((0,) + INTEGER_COSINES)[m]).astype(np.float32)
+    matrix[0, :] = 64
+    assert np.abs(matrix).sum(axis=1).max() <= 64 * block_size  # the bounds of __integer_stage__ assume that no row exceeds the first one
+    matrix.flags.writeable = False
+    return matrix
+
+
+def integer_coefficient_scale(block_size, bit_depth):
+    '''
+        Scale of the coefficients of integer_dct_blocks relative to the orthonormal DCT: 2^(15 - bit_depth) / block_size (like HEVC),
+        the largest coefficient (the DC coefficient of a block with the largest residual) just fits into int16
+    '''
+    return 2.0 ** (15 - bit_depth) / block_size
+
+
+@lru_cache(maxsize=None)
+def __integer_shifts__(block_size, bit_depth):
+    '''
+        Right shifts of the two stages of integer_dct_blocks and integer_idct_blocks (those of HEVC). Both stages multiply with T (about 64 * sqrt(block_size)),
+        the four shifts together undo the scale 2^24 * block_size^2 of the matrices
+
+        Returns:
+            shifts (tuple): (first_forward, second_forward, first_inverse, second_inverse)
+    '''
+    log_size = int(np.log2(block_size))
+    return log_size + bit_depth - 9, log_size + 6, 7, 20 - bit_depth
+
+
+def __integer_stage__(values, bound, shift, left, transposed):
+    '''
+        One stage of the integer transform: the matrix product of a float array with integer values and the integer DCT matrix T (or T^T), followed by
+        a rounding right shift and a clip to 16 bits. The product is computed in float32 if it is exact (see top of the file) and in float64 otherwise,
+        so the result is always that of the integer arithmetic
+
+        Parameters:
+            values (numpy array): Integer values with shape (..., block_size, block_size)
+            bound (float): Upper bound of the magnitudes of values, if it is too large for float32 the actual largest magnitude is used
+            shift (int): Right shift of the stage
+            left (bool): Whether the matrix is the left factor (matrix @ values) or the right factor (values @ matrix)
+            transposed (bool): Whether the matrix is T^T instead of T
+
+        Returns:
+            values (numpy array): Result of the stage with the shape of values
+            bound (float): Upper bound of the magnitudes of the result, the bound of the next stage
+    '''
+    block_size = values.shape[-1]
+    if bound * 64 * block_size > EXACT_FLOAT32:
+        bound = __magnitude__(values)
+    exact_float32 = bound * 64 * block_size <= EXACT_FLOAT32
+    matrix = __stage_matrix__(block_size, shift, transposed, exact_float32)
+    if not exact_float32:
+        values = values.astype(np.float64)
+
+    if left:
+        result = matrix @ values
+    else:
+        result = (values.reshape(-1, block_size) @ matrix).reshape(values.shape)  # one matrix product for all rows instead of one per block
+    result += 0.5
+    np.floor(result, out=result)
+
+    bound = bound * 64 * block_size * 2.0 ** -shift + 0.5
+    if bound >= INT16_LIMIT:
+        np.clip(result, -INT16_LIMIT, INT16_LIMIT - 1, out=result)
+        bound = INT16_LIMIT
+    return result, bound
+
+
+@lru_cache(maxsize=None)
+def __stage_matrix__(block_size, shift, transposed, exact_float32):
+    '''
+        Integer DCT matrix T (or T^T) multiplied with 2^-shift, which is exact, as float32 or float64. The shift of a stage is thus part of the matrix product
+    '''
+    matrix = integer_dct_matrix(block_size)
+    matrix = (matrix.T if transposed else matrix).astype(np.float32 if exact_float32 else np.float64) * 2.0 ** -shift
+    matrix.flags.writeable = False
+    return matrix
+
+
+def __magnitude__(values):
+    '''
+        Largest magnitude of an array with integer values, without a temporary array of the absolute values
+    '''
+    return max(float(values.max(initial=0)), -float(values.min(initial=0)))
+
+
+def __round_shift__(values, shift):
+    '''
+        Rounding right shift (values + 2^(shift - 1)) >> shift of the integers (at most 2^23) in the float32 array values with a clip to 16 bits, in place
+    '''
+    values *= np.float32(2.0 ** -shift)
+    values += np.float32(0.5)
+    np.floor(values, out=values)
+    np.clip(values, -INT16_LIMIT, INT16_LIMIT - 1, out=values)
+    return values
+
+
+@instrument("dct")
+def integer_dct_blocks(blocks, bit_depth, out=None):
+    '''
+        Applies the integer 2-D DCT to all blocks at once: T @ X @ T^T, with a rounding right shift and a clip to 16 bits after each of the two stages (see top of the file).
+        The rounding makes it somewhat slower than dct_blocks
+
+        Parameters:
+            blocks (numpy array): Integer residuals with shape (..., block_size, block_size) and magnitudes below 2^bit_depth
+            bit_depth (int): Bit depth of the video, 8 or 10
+            out (numpy array): Optional output array, e.g. int16 or float32
+
+        Returns:
+            coefficients (numpy array): Integer coefficients (scale integer_coefficient_scale) with the same shape as blocks, float with integer values if out is not given
+    '''
+    first, second, _, _ = __integer_shifts__(blocks.shape[-1], bit_depth)
+
+    rows, bound = __integer_stage__(blocks.astype(np.float32), __magnitude__(blocks), first, left=False, transposed=True)
+    coefficients, _ = __integer_stage__(rows, bound, second, left=True, transposed=False)
+
+    return __write_integer_output__(coefficients, out)
+
+
+@instrument("dct")
+def integer_idct_blocks(coefficients, bit_depth, out=None):
+    '''
+        Inverse of integer_dct_blocks for all blocks at once: T^T @ Y @ T, with a rounding right shift and a clip to 16 bits after each of the two stages.
+        The result is defined by integer arithmetic, so the encoder and the decoder reconstruct bit-exactly, at the price of some speed compared to idct_blocks (see top of the file)
+
+        Parameters:
+            coefficients (numpy array): int16 coefficients (scale integer_coefficient_scale) with shape (..., block_size, block_size), e.g. from quantization.dequantize_integer
+            bit_depth (int): Bit depth of the video, 8 or 10
+            out (numpy array): Optional output array, e.g. int16
+
+        Returns:
+            blocks (numpy array): Reconstructed residuals with the same shape as coefficients, float with integer values if out is not given
+    '''
+    _, _, first, second = __integer_shifts__(coefficients.shape[-1], bit_depth)
+
+    columns, bound = __integer_stage__(coefficients.astype(np.float32, copy=False), __magnitude__(coefficients), first, left=True, transposed=True)
+    blocks, _ = __integer_stage__(columns, bound, second, left=False, transposed=False)
+
+    return __write_integer_output__(blocks, out)
+
+
+def integer_idct_dc(dc, block_size, bit_depth):
+    '''
+        Computes the samples of blocks whose only non-zero coefficient is the DC coefficient like integer_idct_blocks, without the matrix products:
+        every stage multiplies the DC value with 64 and shifts
+
+        Parameters:
+            dc (numpy array): int16 DC coefficients with shape (...), e.g. from quantization.dequantize_integer_dc
+            block_size (int): Size of the blocks
+            bit_depth (int): Bit depth of the video, 8 or 10
+
+        Returns:
+            samples (numpy array): int16 array with the shape of dc, the value of all samples of the block
+    '''
+    _, _, first, second = __integer_shifts__(block_size, bit_depth)
+
+    samples = __round_shift__(np.asarray(dc, dtype=np.float32) * np.float32(64), first)
+    return __round_shift__(samples * np.float32(64), second).astype(np.int16)
+
+
+def __write_integer_output__(result, out):
+    '''
+        Writes the result of an integer transform, which already has integer values, to the output array
+    '''
+    if out is None:
+        return result
+    out[...] = result
+    return out
+
+
+def __write_output__(result, out):
+    '''
+        Writes the float32 result of a transform to the output array, rounding to the nearest integer for integer outputs
+    '''
+    if out is None:
+        return result
+
+    if np.issubdtype(out.dtype, np.integer):
+        np.rint(result, out=result)
+    out[...] = result
+    return out
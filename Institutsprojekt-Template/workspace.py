@@ -0,0 +1,62 @@
+# This file contains the workspace of the encoder, a set of scratch buffers that are allocated once and reused from frame to frame.
+#
+# The encoder codes a frame anti-diagonal by anti-diagonal (see prediction.wavefront_order). Without a workspace every diagonal allocates
+# its prediction candidates, residues, coefficients and levels anew and every frame its level, mode and reconstruction arrays. With a workspace
+# these arrays are views into buffers that grow to the largest requested size once, the predictors, the transform and the quantization
+# write into them through their out parameters. The transient memory of the encoder is then a small multiple of one frame.
+#
+# A buffer is only valid until it is requested again under the same name, so the arrays returned by the encoder stages (e.g. the levels of
+# encoder.block_coding) have to be consumed before the next frame is coded. Concurrent tiles use separate child workspaces (see tile).
+import math
+import numpy as np
+
+
+class EncoderWorkspace:
+    '''
+        Scratch buffers of the encoder, see the description at the top of this file
+
+        Usage:
+            workspace = EncoderWorkspace()
+            for every frame:
+                levels = workspace.scratch(("Y", "levels"), blocks.shape, np.int16)
+                ...
+    '''
+
+    def __init__(self):
+        self.buffers = {}
+        self.tiles = {}
+
+    def scratch(self, name, shape, dtype):
+        '''
+            Returns a C-contiguous array with the given shape and data type, which is a view into the buffer of that name. The buffer is only reallocated if it is too small
+
+            Parameters:
+                name (hashable): Name of the buffer, e.g. a tuple (channel, purpose)
+                shape (tuple): Shape of the array
+                dtype (numpy dtype): Data type of the array
+
+            Returns:
+                array (numpy array): Uninitialized array, the content of the previous request of the buffer may still be in it
+        '''
+        dtype = np.dtype(dtype)
+        size = math.prod(shape)
+
+        buffer = self.buffers.get((name, dtype))
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype=dtype)
+            self.buffers[(name, dtype)] = buffer
+        return buffer[:size].reshape(shape)
+
+    def tile(self, index):
+        '''
+            Returns the child workspace of a tile, so that tiles that are coded concurrently do not share buffers
+        '''
+        if index not in self.tiles:
+            self.tiles[index] = EncoderWorkspace()
+        return self.tiles[index]
+
+    def nbytes(self):
+        '''
+            Returns the total size of all buffers in bytes, including the child workspaces of the tiles
+        '''
+        return sum(buffer.nbytes for buffer in self.buffers.values()) + sum(tile.nbytes() for tile in self.tiles.values())
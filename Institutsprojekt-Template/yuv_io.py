@@ -1,8 +1,11 @@
 # This file contains helper functions to read yuv from *.yuv files into arrays and writing arrays as valid yuv files to hard drive.
 import numpy as np
+import os
+from telemetry import instrument
 
 
-def read_yuv_video(video_path, width=0, height=0, bit_depth=0, subsampling_scheme="", n_frames=-1):
+@instrument("yuv_io")
+def read_yuv_video(video_path, width=0, height=0, bit_depth=0, subsampling_scheme="", n_frames=-1, start=0, step=1, memmap=False):
     '''
         Loads a YUV-video and converts it to an array of numpy arrays, where each of the numpy arrays corresponds to one channel of the YUV-video.
 
@@ -13,61 +16,76 @@ def read_yuv_video(video_path, width=0, height=0, bit_depth=0, subsampling_schem
             bitdepth (int): Bit depth of the YUV-video
             subsampling_scheme (String): Subsampling used for the chroma channels of the video. Common options are: 444, 422, 420
             n_frames (int): Number of frames to load. The default (-1) loads the whole video, i.e. all frames
+            start (int): Index of the first frame to load
+            step (int): Distance between two loaded frames, e.g. 2 loads every second frame
+            memmap (bool): Whether the video should be memory mapped instead of loaded. The returned channels are then zero-copy views into the file and frames are only read from disk when they are accessed
 
         Returns:
             vid (list): List containig a numpy array of shape (frame_number, width, height) for every channel. 
     '''
-    assert bit_depth in [0, 8, 10]  # other bit depths are not supported yet
-
-    video_info = video_path.replace("dec_", "").replace("enc_", "").split("/")[-1]
+    width, height, bit_depth, subsampling_scheme = __get_video_format__(video_path, width, height, bit_depth, subsampling_scheme)
+    assert start >= 0 and step >= 1
 
-    if width == 0:  # automatically infer width if not given
-        width = int(video_info.split("_")[1].split("x")[0])
-    if height == 0:  # automatically infer height if not given
-        height = int(video_info.split("_")[1].split("x")[1])
-    if bit_depth == 0:  # automatically infer bit depth if not given
-        try:    
-            bit_depth = int(video_info.split("_")[2].replace("bit", ""))
-        except Exception:
-            bit_depth = 8
-    if subsampling_scheme == "":  # automatically infer bit depth if not given
-        subsampling_scheme = video_info.split("_")[-1].split(".")[0]
-        if not subsampling_scheme[0] == "4":
-            subsampling_scheme = "420"
-
-    pix_luma = width * height
     dtype = np.uint16 if bit_depth == 10 else np.uint8
-    raw_pix = np.fromfile(video_path, dtype=dtype)  # load the video
+    chroma_height, chroma_width = __get_chroma_shape__(width, height, subsampling_scheme)
+    pix_luma = width * height
+    pix_chroma = chroma_width * chroma_height
+    pix_frame = pix_luma + 2 * pix_chroma
+
+    file_size = os.path.getsize(video_path) // np.dtype(dtype).itemsize
+    total_frames = file_size // pix_frame
+    assert file_size == total_frames * pix_frame
 
     if n_frames == -1:  # Set the number of frames to the length of the video stream
-        bandwidth_factor = __get_bandwidth_factor__(subsampling_scheme)
-        pix_frame = int(pix_luma * bandwidth_factor * 3)
-        n_frames = len(raw_pix) // pix_frame
-        assert len(raw_pix) == n_frames * pix_frame
-
-    # convert the video into a usable format
-    vid = {"Y": [], "U": [], "V": []}
-    subsampling_factors = __get_subsampling_factors__(subsampling_scheme)
-    n = 0
-    n_prev = 0
-    for f in range(n_frames):
-        for c in ["Y", "U", "V"]:
-            if c != "Y":
-                n += pix_luma // subsampling_factors[0] // subsampling_factors[1]
-                vid[c].append(raw_pix[n_prev:n].reshape([height // subsampling_factors[0], width // subsampling_factors[1]]))
-            else:
-                n += pix_luma
-                vid[c].append(raw_pix[n_prev:n].reshape([height, width]))
-            n_prev = n
-
-    if len(vid["Y"]) == 0:  # Return empty video if the input file is empty
+        n_frames = len(range(start, total_frames, step))
+    stop = start + (n_frames - 1) * step + 1 if n_frames > 0 else start
+    assert stop <= total_frames or n_frames == 0, "Requested frames exceed the length of the video"
+
+    if n_frames == 0:  # Return empty video if the input file is empty or no frames are requested
         return {"Y": np.array([], dtype=dtype), "U": np.array([], dtype=dtype), "V": np.array([], dtype=dtype)}
 
-    vid = [np.stack(vid[v]) for v in vid if not v == "metadata"]
-    return {"Y": vid[0], "U": vid[1], "V": vid[2]}
+    # only the requested frame range is mapped or loaded
+    if memmap:
+        raw_frames = np.memmap(video_path, dtype=dtype, mode="r", offset=start * pix_frame * np.dtype(dtype).itemsize, shape=(stop - start, pix_frame))
+    else:
+        raw_frames = np.fromfile(video_path, dtype=dtype, count=(stop - start) * pix_frame, offset=start * pix_frame * np.dtype(dtype).itemsize).reshape(stop - start, pix_frame)
+    raw_frames = raw_frames[::step]
+
+    # convert the video into a usable format by creating strided views on the frames, no data is copied here
+    return {
+        "Y": raw_frames[:, :pix_luma].reshape(n_frames, height, width),
+        "U": raw_frames[:, pix_luma:pix_luma + pix_chroma].reshape(n_frames, chroma_height, chroma_width),
+        "V": raw_frames[:, pix_luma + pix_chroma:].reshape(n_frames, chroma_height, chroma_width),
+    }
+
+
+def iter_yuv_frames(video_path, width=0, height=0, bit_depth=0, subsampling_scheme="", n_frames=-1, start=0, step=1, frames_per_chunk=1):
+    '''
+        Generator that reads a YUV-video chunk by chunk. Only the current chunk is held in memory, so long videos can be processed with a bounded amount of memory.
+
+        Parameters:
+            video_path (String): Path to the YUV-video file
+            width (int): Width of the video
+            height (int): Height of the video
+            bitdepth (int): Bit depth of the YUV-video
+            subsampling_scheme (String): Subsampling used for the chroma channels of the video. Common options are: 444, 422, 420
+            n_frames (int): Number of frames to load. The default (-1) loads the whole video, i.e. all frames
+            start (int): Index of the first frame to load
+            step (int): Distance between two loaded frames, e.g. 2 loads every second frame
+            frames_per_chunk (int): Number of frames yielded at once, e.g. the size of a group of pictures
+
+        Yields:
+            vid (dict): Video with the keys "Y", "U" and "V" containing a numpy array of shape (frames_per_chunk, height, width) for every channel. The last chunk may contain fewer frames
+    '''
+    video = read_yuv_video(video_path, width, height, bit_depth, subsampling_scheme, n_frames, start, step, memmap=True)
+
+    for f in range(0, len(video["Y"]), frames_per_chunk):
+        # copy the chunk out of the memory map, so that the encoder works on regular writable arrays
+        yield {c: np.array(video[c][f:f + frames_per_chunk]) for c in ["Y", "U", "V"]}
 
 
-def write_yuv_video(video, path, automatic_file_name_extension=True):    
+@instrument("yuv_io")
+def write_yuv_video(video, path, automatic_file_name_extension=True, append=False):    
     '''
         Writes a YUV-Video to a file given by path. The video is expected to be an array containing three numpy arrays. Those numpy array should correspond to the Y, U and V channels. Each of those numpy arrays shoul have a shape with (frame, width, height). Note that the width and height of the U and V (chroma) channels do not necessarily need to be equivalent to the width and height of the Y (luma) channel. 
 
@@ -75,9 +93,10 @@ def write_yuv_video(video, path, automatic_file_name_extension=True):
             video_pat (list): YUV-Video given as list of numpy arrays, with [Y_numpy_array, U_numpy_array, V_numpy_array]
             path (String): Path to where the video is supposed to be saved
             automatic_file_name_extension (bool): Whether the file name should be automatically extended such that width, height, bit depth and subsampling scheme are encoded in the file name
+            append (bool): Whether the frames should be appended to an existing file instead of overwriting it. This allows flushing decoded frames as soon as they are produced
         
         Returns:
-            None
+            path (String): Path of the written file including the file name extension
     '''
     assert "Y" in video, "Video does not contain luminance channel"
 
@@ -85,45 +104,55 @@ def write_yuv_video(video, path, automatic_file_name_extension=True):
         video["U"] = np.ones(video["Y"].shape, dtype=video["Y"].dtype) * 128
         video["V"] = np.ones(video["Y"].shape, dtype=video["Y"].dtype) * 128
 
-    raw_pix = np.array([], dtype=video["Y"].dtype)
-    for f in range(len(video["Y"])):
-        for c in ["Y", "U", "V"]:
-            raw_pix = np.concatenate([raw_pix, np.ndarray.flatten(video[c][f])])
-
     if automatic_file_name_extension:
-        video_width = video["Y"].shape[2]
-        video_height = video["Y"].shape[1]
-        bitdepth = 8 if video["Y"].dtype == np.uint8 else 10
-        subsampling_scheme = "4"
-        subsampling_scheme += str(4 * video["U"].shape[2] // video_width) 
-        subsampling_scheme += str(subsampling_scheme[-1] if video_height == video["U"].shape[1] else 0)
+        path = path.replace(".yuv", __get_file_name_extension__(video) + ".yuv")
 
-        filename_extension = "_" + str(video_width) + "x" + str(video_height) + "_" + str(bitdepth) + "bit_" + subsampling_scheme
-        path = path.replace(".yuv", filename_extension + ".yuv")
-
-    np.ndarray.tofile(raw_pix, sep="", file=path)
+    with open(path, "ab" if append else "wb") as file:
+        __write_frames__(video, file)
 
     return path
 
 
-def __get_bandwidth_factor__(subsampling_scheme):
+class YUVVideoWriter:
     '''
-        Computes the relative bandwidth required for the video compared to a video in 4:4:4 format
-
-        Parameters:
-            subsampling_scheme (String): Subsampling used for the chroma channels of the video. Common options are: 444, 422, 420
+        Incremental counterpart to write_yuv_video. Chunks of frames are written to the file as soon as they are passed to write(), so a decoded video never has to be held in memory completely.
 
-        Returns:
-            bandwidth_factor (float): Required bandwidth of the video compared to a YUV-Video stored in 4:4:4 format
+        Usage:
+            with YUVVideoWriter(path) as writer:
+                for chunk in decoded_chunks:
+                    writer.write(chunk)
     '''
-    horizontal_sampling_reference = int(subsampling_scheme[0])
 
-    subsampling_scheme_sum = 0
+    def __init__(self, path, automatic_file_name_extension=True):
+        self.path = path
+        self.automatic_file_name_extension = automatic_file_name_extension
+        self.file = None
+
+    @instrument("yuv_io")
+    def write(self, video):
+        '''
+            Appends the frames of the given video to the file. The file name is determined by the first written chunk
 
-    for i in range(len(subsampling_scheme)):
-        subsampling_scheme_sum += int(subsampling_scheme[i])
+            Parameters:
+                video (dict): YUV-Video given as dict of numpy arrays with the keys "Y", "U" and "V"
+        '''
+        if self.file is None:
+            if self.automatic_file_name_extension:
+                self.path = self.path.replace(".yuv", __get_file_name_extension__(video) + ".yuv")
+            self.file = open(self.path, "wb")
 
-    return subsampling_scheme_sum / horizontal_sampling_reference / 3
+        __write_frames__(video, self.file)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 def __get_subsampling_factors__(subsampling_scheme):
@@ -143,4 +172,114 @@ def __get_subsampling_factors__(subsampling_scheme):
     horizontal_subsampling_factor = horizontal_sampling_reference / int(subsampling_scheme[1])
     vertical_subsampling_factor = 1 if int(subsampling_scheme[1]) == int(subsampling_scheme[2]) else 2
 
-    return (round(horizontal_subsampling_factor), vertical_subsampling_factor)
\ No newline at end of file
+    return (round(horizontal_subsampling_factor), vertical_subsampling_factor)
+
+
+def __get_video_format__(video_path, width=0, height=0, bit_depth=0, subsampling_scheme=""):
+    '''
+        Infers the format of a YUV-video from its file name, e.g. ArenaOfValor_384x384_60_8bit_420.yuv. Parameters that are already given (not 0 or "") are kept as they are
+
+        Parameters:
+            video_path (String): Path to the YUV-video file
+            width (int): Width of the video
+            height (int): Height of the video
+            bitdepth (int): Bit depth of the YUV-video
+            subsampling_scheme (String): Subsampling used for the chroma channels of the video. Common options are: 444, 422, 420
+
+        Returns:
+            video_format (tuple): Tuple of (width, height, bit_depth, subsampling_scheme)
+    '''
+    assert bit_depth in [0, 8, 10]  # other bit depths are not supported yet
+
+    video_info = video_path.replace("dec_", "").replace("enc_", "").split("/")[-1]
+
+    if width == 0:  # automatically infer width if not given
+        width = int(video_info.split("_")[1].split("x")[0])
+    if height == 0:  # automatically infer height if not given
+        height = int(video_info.split("_")[1].split("x")[1])
+    if bit_depth == 0:  # automatically infer bit depth if not given
+        try:    
+            bit_depth = int(video_info.split("_")[2].replace("bit", ""))
+        except Exception:
+            bit_depth = 8
+    if subsampling_scheme == "":  # automatically infer bit depth if not given
+        subsampling_scheme = video_info.split("_")[-1].split(".")[0]
+        if not subsampling_scheme[0] == "4":
+            subsampling_scheme = "420"
+
+    return width, height, bit_depth, subsampling_scheme
+
+
+def __get_chroma_shape__(width, height, subsampling_scheme):
+    '''
+        Computes the shape of the chroma channels of a video
+
+        Parameters:
+            width (int): Width of the video
+            height (int): Height of the video
+            subsampling_scheme (String): Subsampling used for the chroma channels of the video. Common options are: 444, 422, 420
+
+        Returns:
+            chroma_shape (tuple): Tuple of the height and width of the chroma channels (chroma_height, chroma_width)
+    '''
+    horizontal_subsampling_factor, vertical_subsampling_factor = __get_subsampling_factors__(subsampling_scheme)
+
+    return (height // vertical_subsampling_factor, width // horizontal_subsampling_factor)
+
+
+def __write_frames__(video, file):
+    '''
+        Interleaves the Y, U and V planes of all frames into one preallocated buffer and writes it to the file in a single call. Videos that are not stored as uint8 are written as 10 bit video with little endian uint16 samples
+
+        Parameters:
+            video (dict): YUV-Video given as dict of numpy arrays with the keys "Y", "U" and "V"
+            file (file object): File opened in binary mode the frames are written to
+    '''
+    n_frames = len(video["Y"])
+    dtype = np.uint8 if video["Y"].dtype == np.uint8 else np.dtype("<u2")
+    pix_luma = video["Y"][0].size if n_frames > 0 else 0
+    pix_chroma = video["U"][0].size if n_frames > 0 else 0
+
+    raw_pix = np.empty((n_frames, pix_luma + 2 * pix_chroma), dtype=dtype)
+    raw_pix[:, :pix_luma] = video["Y"].reshape(n_frames, pix_luma)
+    raw_pix[:, pix_luma:pix_luma + pix_chroma] = video["U"].reshape(n_frames, pix_chroma)
+    raw_pix[:, pix_luma + pix_chroma:] = video["V"].reshape(n_frames, pix_chroma)
+
+    raw_pix.tofile(file)
+
+
+def __get_file_name_extension__(video):
+    '''
+        Computes the file name extension that encodes width, height, bit depth and subsampling scheme of a video, e.g. _384x384_8bit_420
+
+        Parameters:
+            video (dict): YUV-Video given as dict of numpy arrays with the keys "Y", "U" and "V"
+
+        Returns:
+            filename_extension (String): File name extension to be inserted before ".yuv"
+    '''
+    video_width = video["Y"].shape[2]
+    video_height = video["Y"].shape[1]
+    bitdepth = 8 if video["Y"].dtype == np.uint8 else 10
+    subsampling_scheme = __get_subsampling_scheme__(video)
+
+    return "_" + str(video_width) + "x" + str(video_height) + "_" + str(bitdepth) + "bit_" + subsampling_scheme
+
+
+def __get_subsampling_scheme__(video):
+    '''
+        Infers the subsampling scheme of a video from the shapes of its channels
+
+        Parameters:
+            video (dict): YUV-Video given as dict of numpy arrays with the keys "Y", "U" and "V"
+
+        Returns:
+            subsampling_scheme (String): Subsampling used for the chroma channels of the video, e.g. 444, 422 or 420
+    '''
+    video_width = video["Y"].shape[2]
+    video_height = video["Y"].shape[1]
+    subsampling_scheme = "4"
+    subsampling_scheme += str(4 * video["U"].shape[2] // video_width) 
+    subsampling_scheme += str(subsampling_scheme[-1] if video_height == video["U"].shape[1] else 0)
+
+    return subsampling_scheme